@@ -1,20 +1,65 @@
 from blacksheep import Application, Request
 from mspscammers.routes.registration import register_registration_routes
-from mspscammers.routes.discord_auth import register_discord_routes
+from mspscammers.routes.discord_auth import cache as template_cache, register_discord_routes
 from mspscammers.routes.reporting import register_reporting_routes
+from mspscammers.routes.scammers import register_scammer_routes
+from mspscammers.routes.moderation import register_moderation_routes
+from mspscammers.routes.metrics import register_metrics_routes
+from mspscammers.routes.feed import register_feed_routes
 import mspscammers.database as database
+from mspscammers import settings
+from mspscammers.bans import ban_enforcement_middleware, ban_list
+from mspscammers.ratelimit import rate_limit_middleware
+from mspscammers.token_manager.signed import signed_tokens
+from mspscammers.discord import discord_client
+from mspscammers.msp import msp_resolver
+from mspscammers.brigading import brigading_index
+from mspscammers.membership import load_registrations
+from mspscammers.database.maintenance import maintenance
+from mspscammers.cache.shared import start_shared_cache, stop_shared_cache
 import asyncio
 
 app = Application()
+if settings.RATE_LIMIT_ENABLED:
+    app.middlewares.append(rate_limit_middleware)
+app.middlewares.append(ban_enforcement_middleware)
 register_registration_routes(app=app)
 register_discord_routes(app=app)
 register_reporting_routes(app=app)
+register_scammer_routes(app=app)
+register_moderation_routes(app=app)
+register_metrics_routes(app=app)
+register_feed_routes(app=app)
 
 @app.on_start
 async def on_start():
+    await database.open_databases()
+    await start_shared_cache()
     await database.create_ban_database(),
     await database.create_report_database(),
     await database.create_user_database()
+    await database.migrate_databases()
+    if await database.needs_reputation_recompute():
+        await database.recompute_reputation()
+    ban_list.load(await database.get_banned_user_ids())
+    signed_tokens.load_revocations(await database.get_token_revocations())
+    load_registrations(await database.get_registered_users())
+    brigading_index.load(await database.get_report_signatures())
+    discord_client.start()
+    msp_resolver.start()
+    maintenance.start()
+    await template_cache.preload()
+    if settings.TEMPLATES_RELOAD:
+        template_cache.start_watcher()
+
+@app.on_stop
+async def on_stop():
+    await template_cache.stop_watcher()
+    await discord_client.close()
+    await msp_resolver.close()
+    await maintenance.stop()
+    await stop_shared_cache()
+    await database.close_databases()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+"""
+A stand-in for the Discord API, for trying out the OAuth login without a
+Discord application.
+
+The authorize page redirects straight back with a code. Codes of the form
+`user<N>` exchange for an access token of the Discord user with ID N and
+username `user<N>`; any other code is refused with 400 `invalid_grant`, and
+a wrong client secret with 401 `invalid_client`, as Discord does.
+`/users/@me` answers 401 for a token it did not hand out. `--rate-limit N`
+answers the first N calls to each endpoint with 429 and a Retry-After
+header before serving them.
+
+Usage:
+    python -m benchmarks.discord_api [--port 8082] [--user 1] [--latency 0.05] [--rate-limit 0]
+
+Then start the API with
+MSPSCAMMERS_DISCORD_API_URL=http://127.0.0.1:8082/api/v10,
+MSPSCAMMERS_DISCORD_AUTHORIZE_URL=http://127.0.0.1:8082/oauth2/authorize and
+MSPSCAMMERS_DISCORD_REDIRECT_URI=http://127.0.0.1:8000/discord/callback.
+"""
+import argparse
+import asyncio
+import re
+import secrets
+from typing import Optional
+from urllib.parse import urlencode
+
+from blacksheep import Application, Request, Response, Router
+from blacksheep.server.responses import json, redirect
+
+CODE = re.compile(r'^user(\d+)$')
+
+
+def build_app(client_secret: Optional[str] = None, user: int = 1, latency: float = 0.0,
+              rate_limit: int = 0, retry_after: float = 1.0) -> Application:
+    # A router of its own, so several stubs can run side by side in tests.
+    app = Application(router=Router())
+    app.calls = {}
+    app.tokens = {}
+
+    async def answer(endpoint: str) -> Optional[Response]:
+        calls = app.calls[endpoint] = app.calls.get(endpoint, 0) + 1
+        if latency:
+            await asyncio.sleep(latency)
+        if calls <= rate_limit:
+            response = json({'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': False},
+                            status=429)
+            response.add_header(b'retry-after', str(retry_after).encode('ascii'))
+            return response
+        return None
+
+    async def authorize(request: Request) -> Response:
+        query = {name: values[0] for name, values in request.query.items()}
+        return redirect(query['redirect_uri'] + '?' + urlencode({'code': f'user{user}', 'state': query.get('state', '')}))
+
+    async def token(request: Request) -> Response:
+        limited = await answer('token')
+        if limited is not None:
+            return limited
+        form = await request.form()
+        if client_secret is not None and form.get('client_secret') != client_secret:
+            return json({'error': 'invalid_client'}, status=401)
+        match = CODE.match(form.get('code') or '')
+        if form.get('grant_type') != 'authorization_code' or match is None:
+            return json({'error': 'invalid_grant', 'error_description': 'Invalid "code" in request.'}, status=400)
+        access_token = secrets.token_urlsafe(24)
+        app.tokens[access_token] = int(match.group(1))
+        return json({
+            'access_token': access_token,
+            'token_type': 'Bearer',
+            'expires_in': 604800,
+            'refresh_token': secrets.token_urlsafe(24),
+            'scope': 'identify',
+        })
+
+    async def me(request: Request) -> Response:
+        limited = await answer('users/@me')
+        if limited is not None:
+            return limited
+        authorization = (request.headers.get_first(b'authorization') or b'').decode('latin-1')
+        user_id = app.tokens.get(authorization.removeprefix('Bearer '))
+        if user_id is None:
+            return json({'message': '401: Unauthorized', 'code': 0}, status=401)
+        return json({'id': str(user_id), 'username': f'user{user_id}', 'avatar': None, 'discriminator': '0'})
+
+    app.router.add_get('/oauth2/authorize', authorize)
+    app.router.add_post('/api/v10/oauth2/token', token)
+    app.router.add_get('/api/v10/users/@me', me)
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve a stub Discord API.")
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--client-secret', default=None, help="refuse token requests with another secret")
+    parser.add_argument('--user', type=int, default=1, help="Discord user ID the authorize page logs in as")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every API answer")
+    parser.add_argument('--rate-limit', type=int, default=0, help="calls per endpoint answered with 429 first")
+    args = parser.parse_args()
+    app = build_app(args.client_secret, args.user, args.latency, args.rate_limit)
+    uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Microbenchmark for auth token derivation.
+
+Compares the original `create_sha256_hash`, which built and registered a new
+singledispatch function on every call, with the module-level dispatcher, the
+batch API and keyed HMAC tokens.
+
+Usage:
+    python -m benchmarks.hashing [--count 100000]
+"""
+import argparse
+import functools
+import hashlib
+import time
+from typing import Callable, List
+
+from mspscammers.hashing import create_hmac_sha256, create_hmac_sha256_hashes, create_sha256_hash, create_sha256_hashes
+
+KEY = b'benchmark-secret'
+
+
+def legacy_sha256_hash(input_string: str) -> str:
+    # The implementation create_sha256_hash had before the dispatcher moved to module level.
+    @functools.singledispatch
+    def hash_string(input_string: str) -> str:
+        sha256_hash = hashlib.sha256()
+        sha256_hash.update(input_string.encode('utf-8'))
+        return sha256_hash.hexdigest()
+
+    @hash_string.register
+    def _(input_strings: list) -> str:
+        sha256_hash = hashlib.sha256()
+        for input_string in input_strings:
+            sha256_hash.update(input_string.encode('utf-8'))
+        return sha256_hash.hexdigest()
+
+    return hash_string(input_string)
+
+
+def measure(run: Callable[[List[str]], object], inputs: List[str], repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(inputs)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark auth token hashing.")
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+    inputs = [str(100000000000000000 + index) for index in range(args.count)]
+
+    assert [legacy_sha256_hash(value) for value in inputs[:100]] == create_sha256_hashes(inputs[:100])
+
+    cases = {
+        'legacy create_sha256_hash': lambda values: [legacy_sha256_hash(value) for value in values],
+        'create_sha256_hash': lambda values: [create_sha256_hash(value) for value in values],
+        'create_sha256_hashes': create_sha256_hashes,
+        'bare hashlib.sha256': lambda values: [hashlib.sha256(value.encode('utf-8')).hexdigest() for value in values],
+        'create_hmac_sha256': lambda values: [create_hmac_sha256(value, KEY) for value in values],
+        'create_hmac_sha256_hashes': lambda values: create_hmac_sha256_hashes(values, KEY),
+    }
+    baseline = None
+    print(f"{'':<28}{'hashes/s':>12}{'us/hash':>10}{'speedup':>10}")
+    for name, run in cases.items():
+        elapsed = measure(run, inputs)
+        baseline = baseline or elapsed
+        print(f"{name:<28}{args.count / elapsed:>12,.0f}{elapsed / args.count * 1e6:>10.2f}{baseline / elapsed:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
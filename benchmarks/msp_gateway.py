@@ -0,0 +1,71 @@
+"""
+A stand-in for the MSP AMF gateway, for trying out and load testing the
+player checks without talking to MovieStarPlanet.
+
+Every call of the resolve method gets the player ID of the name it is
+given: names listed in the players file map to their IDs, names of the
+form `player<N>` (as seeded by benchmarks.seed) map to N, and anything
+else is answered with 0, the way the real service reports an unknown name.
+
+Usage:
+    python -m benchmarks.msp_gateway [--port 8081] [--players players.csv] [--latency 0.05]
+
+Then start the API with MSPSCAMMERS_MSP_GATEWAY_URL=http://127.0.0.1:8081/Gateway.aspx.
+The players file holds one `<username>,<player id>` pair per line.
+"""
+import argparse
+import asyncio
+import csv
+import re
+from typing import Dict
+
+import pyamf
+from pyamf import remoting
+
+from blacksheep import Application, Request, Response, Router
+from blacksheep.contents import Content
+
+SEEDED_NAME = re.compile(r'^player(\d+)$')
+
+
+def build_app(players: Dict[str, int], latency: float) -> Application:
+    # A router of its own, so several stubs can run side by side in tests.
+    app = Application(router=Router())
+    app.calls = 0
+
+    async def gateway(request: Request) -> Response:
+        app.calls += 1
+        envelope = remoting.decode(await request.read())
+        answer = remoting.Envelope(envelope.amfVersion)
+        for target, message in envelope:
+            name = str(message.body[0]).casefold()
+            match = SEEDED_NAME.match(name)
+            player_id = players.get(name, int(match.group(1)) if match else 0)
+            answer[target] = remoting.Response(player_id)
+        if latency:
+            await asyncio.sleep(latency)
+        return Response(200, None, Content(remoting.CONTENT_TYPE.encode('ascii'), remoting.encode(answer).getvalue()))
+
+    app.router.add_post('/Gateway.aspx', gateway)
+    return app
+
+
+def load_players(path: str) -> Dict[str, int]:
+    with open(path, newline='', encoding='utf-8') as file:
+        return {name.casefold(): int(player_id) for name, player_id in csv.reader(file)}
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve a stub MSP AMF gateway.")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--players', default=None, help="CSV of username,player id pairs")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every answer")
+    args = parser.parse_args()
+    app = build_app(load_players(args.players) if args.players else {}, args.latency)
+    uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""
+Load test for the API.
+
+Starts `api.app` under uvicorn against temporary databases, seeds them with
+synthetic data and drives a weighted mix of requests from concurrent
+clients, then reports throughput, latency percentiles per operation and the
+time spent in each database function. Results are written to a JSON file
+that a later run can be compared against.
+
+Usage:
+    python -m benchmarks.run [--users 10000] [--reports 1000000] [--duration 30]
+                             [--concurrency 64] [--mix lookup=60,lookup_many=10,report=25,register=5]
+                             [--output results.json] [--compare previous.json]
+
+The rate limiter is switched off for the run.
+"""
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_MIX = 'lookup=60,lookup_many=10,report=25,register=5'
+LOOKUP_BATCH = 50
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"Unknown operation '{name}', expected one of {', '.join(OPERATIONS)}")
+        mix[name.strip()] = int(weight)
+    return mix
+
+
+class QueryTimings:
+    """
+    Wraps the coroutine functions of `mspscammers.database` to time every call.
+    Must be installed before `api` is imported, since the routes import the
+    functions by name.
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+
+    def wrap(self, name: str, function: Callable) -> Callable:
+        timings = self.timings[name]
+
+        @functools.wraps(function)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                timings.append(time.perf_counter() - started)
+        return timed
+
+    def install(self, module) -> None:
+        for name, function in list(vars(module).items()):
+            if inspect.iscoroutinefunction(function) and function.__module__ == module.__name__:
+                setattr(module, name, self.wrap(name, function))
+        module.report_queue.write = self.wrap('_insert_report', module.report_queue.write)
+
+    def reset(self) -> None:
+        for timings in self.timings.values():
+            timings.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {**summarize(timings), 'total_ms': round(sum(timings) * 1000, 3)}
+            for name, timings in sorted(self.timings.items()) if timings
+        }
+
+
+class Workload:
+    """
+    The synthetic traffic: which users, tokens and scammers requests refer to.
+    """
+
+    def __init__(self, tokens: List[str], scammer_ids: List[str], user_id: Callable[[int], str], seed: int):
+        self.tokens = tokens
+        self.scammer_ids = scammer_ids
+        self.user_id = user_id
+        self.rng = random.Random(seed)
+        self.registrations = 0
+
+    def scammer(self) -> str:
+        # Most lookups and reports hit the same popular scammers.
+        return self.scammer_ids[min(int(self.rng.paretovariate(1.2)) - 1, len(self.scammer_ids) - 1)]
+
+    def new_user(self) -> int:
+        self.registrations += 1
+        return len(self.tokens) + self.registrations
+
+
+async def lookup(client, workload: Workload):
+    return await client.get(f'/api/v1/scammers/{workload.scammer()}')
+
+
+async def lookup_many(client, workload: Workload):
+    return await client.post('/api/v1/scammers/lookup', json={
+        'scammer_ids': [workload.scammer() for _ in range(LOOKUP_BATCH)]
+    })
+
+
+async def report(client, workload: Workload):
+    scammer_id = workload.scammer()
+    return await client.post('/api/v1/reporting/report-user', headers={
+        'authorization': workload.rng.choice(workload.tokens)
+    }, json={
+        # The name benchmarks.msp_gateway resolves to the scammer's ID.
+        'username': f'player{scammer_id}',
+        'scammer_id': scammer_id,
+        'description': 'Report sent by the benchmark'
+    })
+
+
+async def register(client, workload: Workload):
+    index = workload.new_user()
+    return await client.post('/api/v1/registration/create', json={
+        'discord_user_id': workload.user_id(index),
+        'discord_username': f'benchmark_user_{index}',
+        'image_url': f'https://cdn.example.com/avatars/{index}.png'
+    })
+
+
+OPERATIONS = {
+    'lookup': lookup,
+    'lookup_many': lookup_many,
+    'report': report,
+    'register': register,
+}
+
+
+async def drive(base_url: str, workload: Workload, mix: Dict[str, int], duration: float,
+                concurrency: int) -> Dict[str, Any]:
+    import httpx
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(client):
+        while time.perf_counter() < deadline:
+            name = workload.rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = await OPERATIONS[name](client, workload)
+                status = str(response.status_code)
+            except httpx.HTTPError as error:
+                status = type(error).__name__
+            latencies[name].append(time.perf_counter() - started)
+            statuses[name][status] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 1),
+        'latency': summarize([value for values in latencies.values() for value in values]),
+        'operations': {
+            name: {
+                **summarize(latencies[name]),
+                'throughput_rps': round(len(latencies[name]) / elapsed, 1),
+                'statuses': dict(statuses[name]),
+            }
+            for name in names if latencies[name]
+        },
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    import uvicorn
+    import mspscammers.database as database
+    from benchmarks.seed import scammer_id, seed, user_id
+
+    timings = QueryTimings()
+    timings.install(database)
+    from api import app
+
+    started = time.perf_counter()
+    tokens, scammers = await seed(args.users, args.reports, args.scammers, args.seed)
+    seed_time = time.perf_counter() - started
+    print(f"Seeded {args.users} users and {args.reports} reports over {scammers} scammers in {seed_time:.1f}s")
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()
+        await asyncio.sleep(0.05)
+
+    try:
+        workload = Workload(tokens, [scammer_id(index) for index in range(scammers)], user_id, args.seed)
+        mix = parse_mix(args.mix)
+        if args.warmup:
+            await drive(f'http://127.0.0.1:{port}', workload, mix, args.warmup, args.concurrency)
+        timings.reset()
+        results = await drive(f'http://127.0.0.1:{port}', workload, mix, args.duration, args.concurrency)
+        queries = timings.summary()
+    finally:
+        server.should_exit = True
+        await serving
+
+    return {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database_mode': database.settings.DATABASE_MODE,
+        },
+        'parameters': {
+            'users': args.users,
+            'reports': args.reports,
+            'scammers': scammers,
+            'duration_s': args.duration,
+            'concurrency': args.concurrency,
+            'mix': args.mix,
+            'seed': args.seed,
+        },
+        'seed_s': round(seed_time, 3),
+        **results,
+        'queries': queries,
+    }
+
+
+def print_results(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    def change(current: float, previous: Optional[float]) -> str:
+        if not previous:
+            return ''
+        return f" ({(current - previous) / previous:+.1%})"
+
+    previous_operations = (baseline or {}).get('operations', {})
+    print(f"\n{results['requests']} requests in {results['elapsed_s']}s: "
+          f"{results['throughput_rps']} req/s{change(results['throughput_rps'], (baseline or {}).get('throughput_rps'))}")
+    print(f"{'operation':<14}{'count':>9}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}  statuses")
+    for name, stats in results['operations'].items():
+        previous = previous_operations.get(name, {})
+        print(f"{name:<14}{stats['count']:>9}{stats['throughput_rps']:>10}{stats['p50_ms']:>10}{stats['p99_ms']:>10}  "
+              f"{stats['statuses']}{change(stats['p99_ms'], previous.get('p99_ms'))}")
+    print(f"\n{'query':<32}{'calls':>9}{'p50 ms':>10}{'p99 ms':>10}{'total ms':>12}")
+    for name, stats in results['queries'].items():
+        print(f"{name:<32}{stats['count']:>9}{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['total_ms']:>12}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the API against synthetic data.")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--reports', type=int, default=1000000)
+    parser.add_argument('--scammers', type=int, default=50000)
+    parser.add_argument('--duration', type=float, default=30, help="seconds of measured traffic")
+    parser.add_argument('--warmup', type=float, default=5, help="seconds of unmeasured traffic first")
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="weighted operations, e.g. lookup=3,report=1")
+    parser.add_argument('--database-mode', choices=('split', 'single'), default='split')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="defaults to benchmarks/results/<timestamp>.json")
+    parser.add_argument('--compare', default=None, help="a previous results file to compare against")
+    args = parser.parse_args()
+    parse_mix(args.mix)
+
+    with tempfile.TemporaryDirectory(prefix='mspscammers-bench-') as directory:
+        # Settings are read at import time, so they are set before anything imports them.
+        os.environ['MSPSCAMMERS_DATABASE_DIR'] = directory
+        os.environ['MSPSCAMMERS_DATABASE_MODE'] = args.database_mode
+        os.environ['MSPSCAMMERS_RATE_LIMIT'] = '0'
+        os.environ.pop('MSPSCAMMERS_SHARED_CACHE_SOCKET', None)
+        results = asyncio.run(benchmark(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+
+    output = args.output or os.path.join(
+        'benchmarks', 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json'
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
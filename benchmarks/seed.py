@@ -0,0 +1,95 @@
+"""
+Fills empty databases with synthetic users and reports for benchmarking.
+
+Reports are bulk inserted before the migrations run, so the indexes and the
+scammer_stats table are built once over the finished tables, the same way
+they would be for an existing deployment being upgraded.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Iterator, List, Tuple
+
+from mspscammers import database
+from mspscammers.token_manager.authtoken import AuthtokenManager
+
+FIRST_USER_ID = 100000000000000000
+FIRST_SCAMMER_ID = 1000000
+# Seeded users register from the address the benchmark client connects from,
+# so their tokens pass the IP check on report requests.
+CLIENT_IP = '127.0.0.1'
+REPORT_SPAN = timedelta(days=90)
+
+
+def user_id(index: int) -> str:
+    return str(FIRST_USER_ID + index)
+
+
+def scammer_id(index: int) -> str:
+    return str(FIRST_SCAMMER_ID + index)
+
+
+def user_rows(tokens: List[str]) -> Iterator[Tuple[str, str, str, str, str]]:
+    for index, auth_token in enumerate(tokens):
+        yield (
+            user_id(index),
+            auth_token,
+            CLIENT_IP,
+            f'seed_user_{index}',
+            f'https://cdn.example.com/avatars/{index}.png',
+        )
+
+
+def report_rows(users: int, reports: int, scammers: int, seed: int) -> Iterator[Tuple[str, ...]]:
+    """
+    Spreads `reports` over the users round-robin; round `n` of a user reports
+    a different scammer each time, so (reporter, scammer) pairs stay unique
+    as long as there are at least `reports / users` scammers.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    for index in range(reports):
+        reporter, rank = index % users, index // users
+        created_at = now - REPORT_SPAN * rng.random()
+        yield (
+            f'scammer_{reporter}',
+            'Synthetic report generated for benchmarking',
+            user_id(reporter),
+            f'10.{reporter >> 16 & 255}.{reporter >> 8 & 255}.{reporter & 255}',
+            scammer_id((reporter * 7919 + rank) % scammers),
+            created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        )
+
+
+async def seed(users: int, reports: int, scammers: int, seed: int = 0) -> Tuple[List[str], int]:
+    """
+    Creates and fills the databases configured in `mspscammers.settings`.
+
+    Returns:
+        Tuple[List[str], int]: The auth tokens of the seeded users, by user
+        index, and the number of scammers the reports were spread over.
+    """
+    scammers = max(scammers, -(-reports // max(users, 1)))
+    await database.open_databases()
+    await database.create_ban_database()
+    await database.create_report_database()
+    await database.create_user_database()
+
+    tokens = AuthtokenManager.create_auth_tokens([user_id(index) for index in range(users)])
+    async with database.users_pool.writer() as db:
+        await db.execute('BEGIN')
+        await db.executemany('''
+            INSERT INTO users (discord_user_id, auth_token, ip_address, discord_username, image_url)
+            VALUES (?, ?, ?, ?, ?)
+        ''', user_rows(tokens))
+        await db.commit()
+
+    async with database.reports_pool.writer() as db:
+        await db.execute('BEGIN')
+        await db.executemany('''
+            INSERT INTO reports (username, description, discord_user_id, ip_address, scammer_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', report_rows(users, reports, scammers, seed))
+        await db.commit()
+
+    await database.migrate_databases()
+    return tokens, scammers
@@ -0,0 +1,81 @@
+from typing import Iterable, Set
+
+from blacksheep import Request
+from mspscammers.metrics import register_collector, sample_family
+from mspscammers.responses import BANNED
+from mspscammers.cache import LOCAL_EVENTS, MISSING, auth_tokens, publish_event
+from mspscammers.token_manager.signed import signed_tokens
+
+
+class BanList:
+    """
+    The set of banned Discord user IDs, held in memory so ban checks never
+    touch the database. Loaded at startup and kept current by `record_ban`.
+    """
+
+    _banned: Set[str]
+
+    def __init__(self):
+        self._banned = set()
+
+    def __contains__(self, discord_user_id: object) -> bool:
+        return discord_user_id in self._banned
+
+    def __len__(self) -> int:
+        return len(self._banned)
+
+    def load(self, discord_user_ids: Iterable[str]) -> None:
+        self._banned = set(discord_user_ids)
+
+    def add(self, discord_user_id: str) -> None:
+        self._banned.add(discord_user_id)
+
+    def discard(self, discord_user_id: str) -> None:
+        self._banned.discard(discord_user_id)
+
+
+ban_list = BanList()
+
+
+@register_collector
+def _ban_metrics():
+    yield from sample_family('mspscammers_banned_users', 'Users on the in-memory ban list.', 'gauge', [((), len(ban_list))])
+
+
+def _apply_ban(discord_user_id: str, banned: bool) -> None:
+    if banned:
+        ban_list.add(discord_user_id)
+    else:
+        ban_list.discard(discord_user_id)
+
+
+LOCAL_EVENTS['ban'] = _apply_ban
+
+
+def record_ban(discord_user_id: str, banned: bool) -> None:
+    """
+    Updates the ban list in this worker and, through the shared cache tier
+    when it is running, in every other worker.
+    """
+    publish_event('ban', discord_user_id, banned)
+
+
+async def ban_enforcement_middleware(request: Request, handler):
+    """
+    Rejects requests whose auth token belongs to a banned user before the
+    route handler runs. Signed tokens are verified in memory; otherwise only
+    the in-memory auth token cache is consulted, and tokens not cached yet
+    are checked by the route once it resolves them.
+    """
+    if len(ban_list):
+        auth_token = request.headers.get_first(b'authorization')
+        if auth_token:
+            auth_token = auth_token.decode('utf-8')
+            if signed_tokens.enabled and signed_tokens.is_signed(auth_token):
+                discord_user_id = signed_tokens.verify(auth_token, request.client_ip)
+            else:
+                owner = auth_tokens.peek(auth_token)
+                discord_user_id = owner[1] if owner is not MISSING and owner is not None else None
+            if discord_user_id is not None and discord_user_id in ban_list:
+                return BANNED()
+    return await handler(request)
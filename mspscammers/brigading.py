@@ -0,0 +1,308 @@
+"""
+Near-duplicate report detection.
+
+Every report description gets a MinHash signature: the description is
+normalised, cut into character shingles and each shingle hashed once with
+blake2b. The hashes are spread over `PERMUTATIONS` bins by their low bits and
+each bin keeps the smallest value (one permutation hashing), empty bins
+borrowing from the next full one. Two signatures agree on about as many bins
+as the Jaccard similarity of the shingle sets, so computing one costs a
+single hash per shingle.
+
+Each scammer keeps the signatures of their recent reports in an LSH index:
+the signature is split into `BANDS` bands, and reports sharing a band are
+compared bin by bin. A new report is a suspect when it is a near-duplicate
+of an earlier one that came from the same network (/24 for IPv4, /64 for
+IPv6), or when enough near-duplicates of it pile up against the scammer to
+look like a coordinated paste. Suspect reports are stored with
+`duplicate_of` set and weigh BRIGADING_WEIGHT times as much.
+
+A report's signature is added provisionally as soon as it is written, so
+reports later in the same write batch are compared with it, and made
+permanent (and sent to the other workers) once its transaction commits.
+
+Reports are clustered by the address they were sent from. Auth tokens only
+verify from the address the reporter registered or last logged in from,
+which is what `users.ip_address` holds, so that address is the reporter's
+registration address as well and needs no lookup in users.db.
+"""
+import hashlib
+import ipaddress
+import re
+import time
+from array import array
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from mspscammers import settings
+from mspscammers.cache import LOCAL_EVENTS, publish_event
+from mspscammers.metrics import register_collector, sample_family
+
+PERMUTATIONS = 32
+BANDS = 8
+ROWS = PERMUTATIONS // BANDS
+SHINGLE = 5
+BAND_BYTES = ROWS * 4
+EMPTY = 0xFFFFFFFF
+
+_WORDS = re.compile(r'\W+')
+
+
+def shingles(description: str) -> Set[str]:
+    text = _WORDS.sub(' ', description.lower()).strip()
+    if len(text) <= SHINGLE:
+        return {text}
+    return {text[index:index + SHINGLE] for index in range(len(text) - SHINGLE + 1)}
+
+
+def signature(description: str) -> bytes:
+    """
+    Returns the MinHash signature of a description, `PERMUTATIONS` 32-bit
+    values packed into bytes so it can be stored and compared cheaply.
+    """
+    bins = [EMPTY] * PERMUTATIONS
+    for shingle in shingles(description):
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+        index = value % PERMUTATIONS
+        value >>= 32
+        if value < bins[index]:
+            bins[index] = value
+    if EMPTY in bins and any(value != EMPTY for value in bins):
+        filled = list(bins)
+        for index, value in enumerate(bins):
+            offset = 1
+            while value == EMPTY:
+                value = bins[(index + offset) % PERMUTATIONS]
+                offset += 1
+            filled[index] = value
+        bins = filled
+    return array('I', bins).tobytes()
+
+
+def similarity(first: bytes, second: bytes) -> float:
+    """
+    Estimates the Jaccard similarity of the descriptions behind two signatures.
+    """
+    first, second = memoryview(first).cast('I'), memoryview(second).cast('I')
+    return sum(a == b for a, b in zip(first, second)) / PERMUTATIONS
+
+
+def network(ip_address: Optional[str]) -> Optional[str]:
+    """
+    Returns the network an address is clustered into, or None if it does not parse.
+    """
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None
+    prefix = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f'{address}/{prefix}', strict=False))
+
+
+class _Entry:
+    __slots__ = ('report_id', 'network', 'signature', 'seen_at')
+
+    def __init__(self, report_id: int, network: Optional[str], signature: bytes, seen_at: float):
+        self.report_id = report_id
+        self.network = network
+        self.signature = signature
+        self.seen_at = seen_at
+
+
+class ScammerSignatures:
+    """
+    The LSH index of one scammer's most recent report signatures.
+    """
+
+    def __init__(self, maxlen: int, window: float):
+        self.maxlen = maxlen
+        self.window = window
+        self.entries: Deque[_Entry] = deque()
+        self.buckets: Dict[bytes, List[_Entry]] = {}
+
+    @staticmethod
+    def _bands(signature: bytes) -> Iterable[bytes]:
+        for band in range(BANDS):
+            yield bytes((band,)) + signature[band * BAND_BYTES:(band + 1) * BAND_BYTES]
+
+    def evict(self, now: float) -> None:
+        while self.entries and (len(self.entries) > self.maxlen or self.entries[0].seen_at < now - self.window):
+            entry = self.entries.popleft()
+            for key in self._bands(entry.signature):
+                bucket = self.buckets[key]
+                bucket.remove(entry)
+                if not bucket:
+                    del self.buckets[key]
+
+    def add(self, entry: _Entry) -> None:
+        self.entries.append(entry)
+        for key in self._bands(entry.signature):
+            self.buckets.setdefault(key, []).append(entry)
+        self.evict(entry.seen_at)
+
+    def remove(self, entry: _Entry) -> None:
+        try:
+            self.entries.remove(entry)
+        except ValueError:
+            # Already evicted.
+            return
+        for key in self._bands(entry.signature):
+            bucket = self.buckets[key]
+            bucket.remove(entry)
+            if not bucket:
+                del self.buckets[key]
+
+    def near_duplicates(self, signature: bytes, threshold: float) -> List[_Entry]:
+        candidates: Dict[int, _Entry] = {}
+        for key in self._bands(signature):
+            for entry in self.buckets.get(key, ()):
+                candidates[id(entry)] = entry
+        return [entry for entry in candidates.values() if similarity(signature, entry.signature) >= threshold]
+
+
+class BrigadingIndex:
+    """
+    Per-scammer signature indexes, least recently reported scammers evicted
+    first once `max_scammers` are tracked.
+    """
+
+    def __init__(self, threshold: float, min_cluster: int, per_scammer: int, window: float, max_scammers: int):
+        """
+        Initializes the BrigadingIndex.
+
+        Args:
+            threshold (float): The estimated Jaccard similarity from which two descriptions are near-duplicates.
+            min_cluster (int): Near-duplicates from any network that make a new report a suspect.
+            per_scammer (int): Signatures kept per scammer.
+            window (float): Seconds a signature is kept for.
+            max_scammers (int): Scammers tracked at once.
+        """
+        self.threshold = threshold
+        self.min_cluster = min_cluster
+        self.per_scammer = per_scammer
+        self.window = window
+        self.max_scammers = max_scammers
+        self.flagged = 0
+        self._scammers: "OrderedDict[str, ScammerSignatures]" = OrderedDict()
+        # Report ID -> (scammer ID, entry) for reports written but not yet committed.
+        self._pending: Dict[int, Tuple[str, _Entry]] = {}
+
+    def check(self, scammer_id: str, ip_address: str, signature: bytes) -> Optional[int]:
+        """
+        Returns the ID of the earlier report a new one looks coordinated
+        with, or None if it looks genuine.
+        """
+        signatures = self._scammers.get(scammer_id)
+        if signatures is None:
+            return None
+        signatures.evict(time.time())
+        matches = signatures.near_duplicates(signature, self.threshold)
+        if not matches:
+            return None
+        cluster = network(ip_address)
+        same_network = [entry for entry in matches if cluster is not None and entry.network == cluster]
+        if same_network:
+            return same_network[0].report_id
+        if len(matches) + 1 >= self.min_cluster:
+            return matches[0].report_id
+        return None
+
+    def add(self, scammer_id: str, report_id: int, ip_address: Optional[str], signature: bytes,
+            seen_at: Optional[float] = None) -> None:
+        pending = self._pending.pop(report_id, None)
+        if pending is not None:
+            if pending[0] == scammer_id and pending[1].signature == signature:
+                # Already indexed while its transaction was open.
+                return
+            self._remove(*pending)
+        self._add(scammer_id, _Entry(report_id, network(ip_address), signature, time.time() if seen_at is None else seen_at))
+
+    def add_pending(self, scammer_id: str, report_id: int, ip_address: Optional[str], signature: bytes) -> None:
+        """
+        Indexes a report whose transaction has not committed yet. It is kept
+        by a later `add` of the same report, or taken out by `discard`.
+        """
+        entry = _Entry(report_id, network(ip_address), signature, time.time())
+        self._pending[report_id] = (scammer_id, entry)
+        self._add(scammer_id, entry)
+
+    def discard(self, report_id: int) -> None:
+        """
+        Takes a pending report whose write was rolled back out of the index.
+        """
+        pending = self._pending.pop(report_id, None)
+        if pending is not None:
+            self._remove(*pending)
+
+    def _add(self, scammer_id: str, entry: _Entry) -> None:
+        signatures = self._scammers.get(scammer_id)
+        if signatures is None:
+            signatures = self._scammers[scammer_id] = ScammerSignatures(self.per_scammer, self.window)
+            if len(self._scammers) > self.max_scammers:
+                self._scammers.popitem(last=False)
+        else:
+            self._scammers.move_to_end(scammer_id)
+        signatures.add(entry)
+
+    def _remove(self, scammer_id: str, entry: _Entry) -> None:
+        signatures = self._scammers.get(scammer_id)
+        if signatures is not None:
+            signatures.remove(entry)
+
+    def load(self, reports: Iterable[Tuple[str, int, Optional[str], bytes, float]]) -> None:
+        """
+        Rebuilds the index from (scammer_id, report_id, ip_address, signature, created_at) rows in ID order.
+        """
+        self._scammers.clear()
+        self._pending.clear()
+        for scammer_id, report_id, ip_address, report_signature, created_at in reports:
+            self.add(scammer_id, report_id, ip_address, report_signature, created_at)
+
+    def __len__(self) -> int:
+        return sum(len(signatures.entries) for signatures in self._scammers.values())
+
+    @property
+    def scammers(self) -> int:
+        return len(self._scammers)
+
+
+def new_index() -> BrigadingIndex:
+    return BrigadingIndex(
+        threshold=settings.BRIGADING_SIMILARITY,
+        min_cluster=settings.BRIGADING_MIN_CLUSTER,
+        per_scammer=settings.BRIGADING_PER_SCAMMER,
+        window=settings.BRIGADING_WINDOW_DAYS * 86400,
+        max_scammers=settings.BRIGADING_MAX_SCAMMERS,
+    )
+
+
+brigading_index = new_index()
+
+
+def _apply_report(scammer_id: str, report_id: int, ip_address: Optional[str], report_signature: str) -> None:
+    brigading_index.add(scammer_id, report_id, ip_address, bytes.fromhex(report_signature))
+
+
+LOCAL_EVENTS['reported'] = _apply_report
+
+
+def record_report(scammer_id: str, report_id: int, ip_address: Optional[str], report_signature: bytes) -> None:
+    """
+    Adds a newly written report's signature to the index in this worker and,
+    through the shared cache tier when it is running, in every other worker.
+    """
+    publish_event('reported', scammer_id, report_id, ip_address, report_signature.hex())
+
+
+def record_flagged() -> None:
+    brigading_index.flagged += 1
+
+
+@register_collector
+def _brigading_metrics():
+    yield from sample_family('mspscammers_brigading_signatures', 'Report signatures in the brigading index.', 'gauge',
+                             [((), len(brigading_index))])
+    yield from sample_family('mspscammers_brigading_scammers', 'Scammers tracked by the brigading index.', 'gauge',
+                             [((), brigading_index.scammers)])
+    yield from sample_family('mspscammers_brigading_flagged_total', 'Reports flagged as coordinated.', 'counter',
+                             [((), brigading_index.flagged)])
@@ -0,0 +1,323 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from mspscammers import settings
+from mspscammers.metrics import register_collector, sample_family
+
+MISSING = object()
+
+# Set by mspscammers.cache.shared when a cross-worker tier is running.
+_shared_tier = None
+
+
+def set_shared_tier(tier) -> None:
+    global _shared_tier
+    _shared_tier = tier
+
+
+class TTLCache:
+    """
+    A bounded least-recently-used cache whose entries expire after a TTL.
+
+    Negative results (None or False) are cached too, but for a shorter TTL,
+    so a lookup that found nothing is retried soon after. Given an `owner`
+    function, the cache also indexes its keys by the owner of their value,
+    so everything one owner holds can be dropped without a full scan.
+    """
+
+    _entries: "OrderedDict[Hashable, Tuple[float, Any]]"
+
+    def __init__(self, name: str, maxsize: int = 10000, ttl: float = 300.0, negative_ttl: float = 5.0,
+                 owner: Optional[Callable[[Any], Hashable]] = None):
+        """
+        Initializes the TTLCache.
+
+        Args:
+            name (str): The name the cache is registered and reported under.
+            maxsize (int): The maximum number of entries before the least recently used is evicted.
+            ttl (float): Seconds a positive result is kept.
+            negative_ttl (float): Seconds a negative result (None or False) is kept.
+            owner (Optional[Callable[[Any], Hashable]]): Returns the owner of a positive value.
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.owner = owner
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._owned: Dict[Hashable, Set[Hashable]] = {}
+        self._inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        # Bumped by every invalidation touching a key while it is being loaded.
+        self._generations: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """
+        Returns the cached value for `key`, or `default` when it is absent or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable) -> Any:
+        """
+        Like `get`, but leaves the counters and the LRU order untouched.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return MISSING
+        return entry[1]
+
+    def _owner_of(self, value: Any) -> Optional[Hashable]:
+        if self.owner is None or value is None or value is False:
+            return None
+        return self.owner(value)
+
+    def _remove(self, key: Hashable) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        owner = self._owner_of(entry[1])
+        if owner is not None:
+            keys = self._owned.get(owner)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._owned[owner]
+        return True
+
+    def set(self, key: Hashable, value: Any) -> None:
+        ttl = self.negative_ttl if value is None or value is False else self.ttl
+        if self.owner is not None:
+            self._remove(key)
+            owner = self._owner_of(value)
+            if owner is not None:
+                self._owned.setdefault(owner, set()).add(key)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        if key in self._generations:
+            self._generations[key] += 1
+        if self._remove(key):
+            self.invalidations += 1
+
+    def invalidate_owner(self, owner: Hashable) -> None:
+        """
+        Drops every entry whose value belongs to `owner`. Needs `owner` to
+        have been given to the cache.
+        """
+        for key in list(self._owned.get(owner, ())):
+            self.invalidate(key)
+        # The owner of a value still being loaded is not known yet.
+        self._bump_inflight()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._owned.clear()
+        self._bump_inflight()
+
+    def _bump_inflight(self) -> None:
+        for key in self._generations:
+            self._generations[key] += 1
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached value for `key`, calling `loader` on a miss.
+        Concurrent misses for the same key share a single `loader` call. A
+        value invalidated while it was being loaded is returned to the callers
+        waiting for it, but not cached.
+        """
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self._generations[key] = 0
+        try:
+            value = MISSING
+            if _shared_tier is not None:
+                value = await _shared_tier.get(self.name, key)
+            if value is MISSING:
+                value = await loader()
+                if _shared_tier is not None and not self._generations[key]:
+                    _shared_tier.set(self.name, key, value)
+        except BaseException as error:
+            future.set_exception(error)
+            # Mark the exception as retrieved when nobody else was waiting.
+            future.exception()
+            raise
+        else:
+            if not self._generations[key]:
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
+            del self._generations[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+
+caches: Dict[str, TTLCache] = {}
+
+
+def register_cache(cache: TTLCache) -> TTLCache:
+    caches[cache.name] = cache
+    return cache
+
+
+# auth token -> (ip_address, discord_user_id, registered_at), or None for an
+# unknown token; indexed by discord user id
+auth_tokens = register_cache(TTLCache(
+    'auth_tokens', maxsize=settings.CACHE_MAXSIZE, ttl=settings.CACHE_TTL, negative_ttl=settings.CACHE_NEGATIVE_TTL,
+    owner=lambda value: value[1],
+))
+# discord username -> whether it is registered
+usernames = register_cache(TTLCache(
+    'usernames', maxsize=settings.CACHE_MAXSIZE, ttl=settings.CACHE_TTL, negative_ttl=settings.CACHE_NEGATIVE_TTL
+))
+# discord user id -> whether it is registered
+user_ids = register_cache(TTLCache(
+    'user_ids', maxsize=settings.CACHE_MAXSIZE, ttl=settings.CACHE_TTL, negative_ttl=settings.CACHE_NEGATIVE_TTL
+))
+# scammer id -> row of scammer_stats, or None for a scammer never reported
+scammer_stats = register_cache(TTLCache(
+    'scammer_stats', maxsize=settings.CACHE_MAXSIZE, ttl=settings.CACHE_TTL, negative_ttl=settings.CACHE_NEGATIVE_TTL
+))
+
+
+def _invalidate_user(registry: Dict[str, TTLCache], discord_user_id: str,
+                     discord_username: Optional[str] = None, auth_token: Optional[str] = None) -> None:
+    if 'user_ids' in registry:
+        registry['user_ids'].invalidate(discord_user_id)
+    if discord_username is not None and 'usernames' in registry:
+        registry['usernames'].invalidate(discord_username)
+    if 'auth_tokens' in registry:
+        if auth_token is not None:
+            registry['auth_tokens'].invalidate(auth_token)
+        registry['auth_tokens'].invalidate_owner(discord_user_id)
+
+
+def _invalidate(registry: Dict[str, TTLCache], name: str, key: Hashable) -> None:
+    if name in registry:
+        registry[name].invalidate(key)
+
+
+def _clear(registry: Dict[str, TTLCache], name: str) -> None:
+    if name in registry:
+        registry[name].clear()
+
+
+# Invalidation events, applied to the local caches and, when a shared tier is
+# running, broadcast to every other worker and applied there too. The hub
+# applies them to its own stores.
+EVENTS: Dict[str, Callable[..., None]] = {
+    'invalidate_user': _invalidate_user,
+    'invalidate': _invalidate,
+    'clear': _clear,
+}
+
+# Side effects of an event on a worker's own in-memory state (indexes, the
+# report feed), run exactly once in every worker and never by the hub.
+LOCAL_EVENTS: Dict[str, Callable[..., None]] = {}
+
+
+def apply_event(registry: Dict[str, TTLCache], event: str, args: list) -> None:
+    # A standalone hub may not have imported the module that registered an event.
+    handler = EVENTS.get(event)
+    if handler is not None:
+        handler(registry, *args)
+
+
+def receive_event(event: str, args: list) -> None:
+    """
+    Applies an event published by this or another worker to this worker's
+    caches and in-memory state.
+    """
+    apply_event(caches, event, args)
+    handler = LOCAL_EVENTS.get(event)
+    if handler is not None:
+        handler(*args)
+
+
+def publish_event(event: str, *args: Any) -> None:
+    receive_event(event, list(args))
+    if _shared_tier is not None:
+        _shared_tier.publish(event, list(args))
+
+
+def invalidate_user(discord_user_id: str, discord_username: Optional[str] = None, auth_token: Optional[str] = None) -> None:
+    """
+    Drops every cached entry derived from a user's row, in this worker and,
+    when the shared tier is running, in every other worker. Called by the
+    database write functions after a user is added, replaced, banned or unbanned.
+
+    Args:
+        discord_user_id (str): The Discord user ID whose entries are stale.
+        discord_username (Optional[str]): A username that may have changed.
+        auth_token (Optional[str]): An auth token that may have changed.
+    """
+    publish_event('invalidate_user', discord_user_id, discord_username, auth_token)
+
+
+def invalidate(name: str, key: Hashable) -> None:
+    publish_event('invalidate', name, key)
+
+
+def clear_cache(name: str) -> None:
+    publish_event('clear', name)
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: cache.stats() for name, cache in caches.items()}
+
+
+@register_collector
+def _cache_metrics():
+    stats = cache_stats()
+    for key, type, help in (
+        ('hits', 'counter', 'Cache lookups answered from memory.'),
+        ('misses', 'counter', 'Cache lookups that had to load the value.'),
+        ('hit_ratio', 'gauge', 'Share of cache lookups answered from memory.'),
+        ('size', 'gauge', 'Entries held in the cache.'),
+        ('evictions', 'counter', 'Entries dropped to stay under the size limit.'),
+    ):
+        name = f'mspscammers_cache_{key}_total' if type == 'counter' else f'mspscammers_cache_{key}'
+        yield from sample_family(name, help, type, (((('cache', cache),), values[key]) for cache, values in stats.items()))
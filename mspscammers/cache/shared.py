@@ -0,0 +1,311 @@
+"""
+A cache tier shared by every worker on a host.
+
+One worker elects itself hub by taking an exclusive lock next to the socket
+path and serves a Unix socket; every worker, the hub included, connects to
+it as a client. Lookups that miss a worker's local cache ask the hub before
+falling back to the database, and invalidation events are broadcast by the
+hub to every other worker. If the hub worker exits, the remaining workers
+race for the lock and one of them takes over.
+
+The hub can also run on its own for local testing:
+
+    python -m mspscammers.cache.shared /tmp/mspscammers-cache.sock
+"""
+import asyncio
+import fcntl
+import itertools
+import json
+import logging
+import os
+import sys
+from typing import Any, Dict, Optional, Set
+
+from mspscammers import settings
+from mspscammers.cache import MISSING, TTLCache, apply_event, caches, receive_event, set_shared_tier
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def _acquire_hub_lock(path: str):
+    lock_file = open(path + '.lock', 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class SharedCacheServer:
+    """
+    The hub: holds one TTLCache per cache name and relays invalidation events.
+    """
+
+    stores: Dict[str, TTLCache]
+    clients: Set[asyncio.StreamWriter]
+
+    def __init__(self):
+        self.stores = {}
+        self.clients = set()
+        self._handlers: Set[asyncio.Task] = set()
+        self._closing = False
+
+    def store(self, name: str) -> TTLCache:
+        if name not in self.stores:
+            local = caches.get(name)
+            self.stores[name] = TTLCache(
+                name, maxsize=settings.CACHE_MAXSIZE, ttl=settings.CACHE_TTL, negative_ttl=settings.CACHE_NEGATIVE_TTL,
+                owner=local.owner if local is not None else None,
+            )
+        return self.stores[name]
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if self._closing:
+            # Accepted just before the hub closed; hang up so the worker looks for the next hub.
+            writer.close()
+            return
+        self.clients.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message['op']
+                if op == 'get':
+                    value = self.store(message['cache']).get(message['key'])
+                    writer.write(_encode({
+                        'op': 'reply',
+                        'id': message['id'],
+                        'found': value is not MISSING,
+                        'value': None if value is MISSING else value,
+                    }))
+                elif op == 'set':
+                    self.store(message['cache']).set(message['key'], message['value'])
+                elif op == 'event':
+                    apply_event(self.stores, message['event'], message['args'])
+                    for client in self.clients:
+                        if client is not writer:
+                            client.write(line)
+        except (ConnectionError, json.JSONDecodeError) as error:
+            logger.warning("Dropping shared cache client: %s", error)
+        finally:
+            self.clients.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def close(self) -> None:
+        self._closing = True
+        for writer in list(self.clients):
+            writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+
+class SharedCacheTier:
+    """
+    A worker's connection to the hub, electing itself hub when there is none.
+    """
+
+    def __init__(self, path: str, timeout: float = 0.05):
+        """
+        Initializes the SharedCacheTier.
+
+        Args:
+            path (str): The Unix socket path shared by the workers.
+            timeout (float): Seconds to wait for the hub before treating a lookup as a miss.
+        """
+        self.path = path
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._ids = itertools.count()
+        self._pending: Dict[int, "asyncio.Future[Any]"] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._hub: Optional[SharedCacheServer] = None
+        self._lock_file = None
+        self._closing = False
+
+    @property
+    def is_hub(self) -> bool:
+        return self._server is not None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    def _try_become_hub(self) -> bool:
+        self._lock_file = _acquire_hub_lock(self.path)
+        return self._lock_file is not None
+
+    async def _serve(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._hub = SharedCacheServer()
+        self._server = await asyncio.start_unix_server(self._hub.handle, path=self.path)
+        logger.info("Serving the shared cache hub on %s", self.path)
+
+    async def _connect(self) -> None:
+        delay = 0.01
+        while not self._closing:
+            if self._server is None and self._try_become_hub():
+                await self._serve()
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 1.0)
+                continue
+            self._writer = writer
+            self._reader_task = asyncio.create_task(self._read(reader))
+            return
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message['op'] == 'reply':
+                    future = self._pending.pop(message['id'], None)
+                    if future is not None and not future.done():
+                        future.set_result(message['value'] if message['found'] else MISSING)
+                elif message['op'] == 'event':
+                    receive_event(message['event'], message['args'])
+        except (ConnectionError, json.JSONDecodeError) as error:
+            logger.warning("Lost the shared cache hub: %s", error)
+        finally:
+            self._disconnected()
+        if not self._closing:
+            await self._connect()
+
+    def _disconnected(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result(MISSING)
+        self._pending.clear()
+        # Invalidations may have been missed while the hub was away.
+        for cache in caches.values():
+            cache.clear()
+
+    def _send(self, message: Dict[str, Any]) -> bool:
+        if self._writer is None:
+            return False
+        try:
+            self._writer.write(_encode(message))
+        except (ConnectionError, RuntimeError):
+            return False
+        return True
+
+    async def get(self, name: str, key: Any) -> Any:
+        """
+        Looks `key` up in the hub's copy of the named cache.
+
+        Returns:
+            Any: The cached value, or MISSING on a miss, a timeout or no hub.
+        """
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        if not self._send({'op': 'get', 'id': request_id, 'cache': name, 'key': key}):
+            del self._pending[request_id]
+            self.misses += 1
+            return MISSING
+        try:
+            value = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            value = MISSING
+        finally:
+            self._pending.pop(request_id, None)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, name: str, key: Any, value: Any) -> None:
+        self._send({'op': 'set', 'cache': name, 'key': key, 'value': value})
+
+    def publish(self, event: str, args: list) -> None:
+        self._send({'op': 'event', 'event': event, 'args': args})
+
+    async def start(self) -> None:
+        await self._connect()
+        set_shared_tier(self)
+
+    async def close(self) -> None:
+        self._closing = True
+        set_shared_tier(None)
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+        self._disconnected()
+        if self._server is not None:
+            await self._hub.close()
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hub': self.is_hub,
+            'connected': self.connected,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+shared_tier: Optional[SharedCacheTier] = None
+
+
+async def start_shared_cache() -> Optional[SharedCacheTier]:
+    """
+    Starts the shared tier when MSPSCAMMERS_SHARED_CACHE_SOCKET is set.
+    """
+    global shared_tier
+    if not settings.SHARED_CACHE_SOCKET:
+        return None
+    shared_tier = SharedCacheTier(settings.SHARED_CACHE_SOCKET, timeout=settings.SHARED_CACHE_TIMEOUT)
+    await shared_tier.start()
+    return shared_tier
+
+
+async def stop_shared_cache() -> None:
+    global shared_tier
+    if shared_tier is not None:
+        await shared_tier.close()
+        shared_tier = None
+
+
+async def _serve_forever(path: str) -> None:
+    lock_file = _acquire_hub_lock(path)
+    if lock_file is None:
+        raise SystemExit(f"A shared cache hub is already serving {path}")
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(SharedCacheServer().handle, path=path)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    asyncio.run(_serve_forever(sys.argv[1] if len(sys.argv) > 1 else settings.SHARED_CACHE_SOCKET))
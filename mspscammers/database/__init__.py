@@ -1,51 +1,107 @@
-import aiosqlite
+import os
 import secrets
 import string
+import time
 from datetime import datetime
 
+from mspscammers import settings
+from mspscammers.bans import record_ban
+from mspscammers.brigading import brigading_index, new_index, record_flagged, record_report, signature as report_signature
+from mspscammers.cache import clear_cache, invalidate, invalidate_user
+from mspscammers.database.batching import WriteQueue
+from mspscammers.database.migrations import run_migrations
+from mspscammers.database.pool import ConnectionPool
+from mspscammers.feed import record_feed_event
+from mspscammers.membership import record_registration
+from mspscammers.metrics import instrument_queries, register_collector, sample_family, timed_query
+from mspscammers.reputation import SQL_FUNCTIONS, report_weight
 from mspscammers.token_manager.authtoken import AuthtokenManager
+from mspscammers.token_manager.signed import record_revocation, signed_tokens
+
+USERS_DB = os.path.join(settings.DATABASE_DIR, 'users.db')
+REPORTS_DB = os.path.join(settings.DATABASE_DIR, 'reports.db')
+BANS_DB = os.path.join(settings.DATABASE_DIR, 'bans.db')
+SINGLE_DB = os.path.join(settings.DATABASE_DIR, 'mspscammers.db')
+
+if settings.DATABASE_MODE == 'single':
+    users_pool = reports_pool = bans_pool = ConnectionPool(
+        SINGLE_DB, readers=settings.DATABASE_READERS, functions=SQL_FUNCTIONS
+    )
+else:
+    reports_pool = ConnectionPool(REPORTS_DB, readers=settings.DATABASE_READERS, functions=SQL_FUNCTIONS)
+    bans_pool = ConnectionPool(BANS_DB, readers=settings.DATABASE_READERS)
+    # users.db readers see the reports and bans tables too, so cross-table
+    # lookups are a single statement in either mode.
+    users_pool = ConnectionPool(USERS_DB, readers=settings.DATABASE_READERS, attach={
+        'reports_db': REPORTS_DB,
+        'bans_db': BANS_DB,
+    })
+
+# Attached files are opened, and switched to WAL, before the pool attaching them.
+POOLS = tuple(dict.fromkeys((reports_pool, bans_pool, users_pool)))
+
+async def open_databases():
+    for pool in POOLS:
+        await pool.open()
+    report_queue.start()
+
+async def close_databases():
+    await report_queue.close()
+    for pool in POOLS:
+        await pool.close()
+
+USERS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS users (
+        discord_user_id TEXT PRIMARY KEY,
+        auth_token TEXT,
+        ip_address TEXT,
+        discord_username TEXT,
+        image_url TEXT
+    )
+'''
+
+REPORTS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT,
+        description TEXT,
+        discord_user_id TEXT,
+        ip_address TEXT,
+        scammer_id TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+BANS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS bans (
+        discord_user_id TEXT PRIMARY KEY,
+        banned_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        reason TEXT
+    )
+'''
+
+async def migrate_databases():
+    await run_migrations(users_pool, 'users')
+    await run_migrations(reports_pool, 'reports')
+    await run_migrations(bans_pool, 'bans')
 
 async def create_user_database():
-    async with aiosqlite.connect('databases/users.db') as db:
-        async with db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                discord_user_id TEXT PRIMARY KEY,
-                auth_token TEXT,
-                ip_address TEXT,
-                discord_username TEXT,
-                image_url TEXT
-            )
-        '''):
+    async with users_pool.writer() as db:
+        async with db.execute(USERS_SCHEMA):
             pass
 
 async def create_report_database():
-    async with aiosqlite.connect('databases/reports.db') as db:
-        async with db.execute('''
-            CREATE TABLE IF NOT EXISTS reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT,
-                description TEXT,
-                discord_user_id TEXT,
-                ip_address TEXT,
-                scammer_id TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        '''):
+    async with reports_pool.writer() as db:
+        async with db.execute(REPORTS_SCHEMA):
             pass
 
 async def create_ban_database():
-    async with aiosqlite.connect('databases/bans.db') as db:
-        async with db.execute('''
-            CREATE TABLE IF NOT EXISTS bans (
-                discord_user_id TEXT PRIMARY KEY,
-                banned_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                reason TEXT
-            )
-        '''):
+    async with bans_pool.writer() as db:
+        async with db.execute(BANS_SCHEMA):
             pass
 
 async def get_user_data(discord_user_id):
-    async with aiosqlite.connect('databases/users.db') as db:
+    async with users_pool.reader() as db:
         async with db.execute('''
             SELECT *
             FROM users
@@ -54,7 +110,7 @@ async def get_user_data(discord_user_id):
             return await cursor.fetchone()
 
 async def get_user_data_json(discord_user_id):
-    async with aiosqlite.connect('databases/users.db') as db:
+    async with users_pool.reader() as db:
         async with db.execute('''
             SELECT *
             FROM users
@@ -73,17 +129,68 @@ async def get_user_data_json(discord_user_id):
                 return None
             
 async def add_user(discord_user_id, ip_address, discord_username, image_url):
-    auth_token = AuthtokenManager.create_auth_token(str(discord_user_id))
-    async with aiosqlite.connect('databases/users.db') as db:
+    if signed_tokens.enabled:
+        auth_token = signed_tokens.issue(str(discord_user_id), ip_address)
+    else:
+        auth_token = AuthtokenManager.create_auth_token(str(discord_user_id))
+    async with users_pool.writer() as db:
+        async with db.execute('''
+            SELECT discord_username, auth_token
+            FROM users
+            WHERE discord_user_id = ?
+        ''', (discord_user_id,)) as cursor:
+            previous = await cursor.fetchone()
         await db.execute('''
-            INSERT OR REPLACE INTO users (discord_user_id, auth_token, ip_address, discord_username, image_url)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO users (discord_user_id, auth_token, ip_address, discord_username, image_url, created_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(discord_user_id) DO UPDATE SET
+                auth_token = excluded.auth_token,
+                ip_address = excluded.ip_address,
+                discord_username = excluded.discord_username,
+                image_url = excluded.image_url
         ''', (discord_user_id, auth_token, ip_address, discord_username, image_url))
         await db.commit()
+    if previous:
+        invalidate_user(discord_user_id, previous[0], previous[1])
+    invalidate_user(discord_user_id, discord_username, auth_token)
+    record_registration(discord_user_id, discord_username)
     return auth_token
 
+async def create_user(discord_user_id, ip_address, discord_username, image_url):
+    if signed_tokens.enabled:
+        auth_token = signed_tokens.issue(str(discord_user_id), ip_address)
+    else:
+        auth_token = AuthtokenManager.create_auth_token(str(discord_user_id))
+    async with users_pool.writer() as db:
+        async with db.execute('''
+            INSERT INTO users (discord_user_id, auth_token, ip_address, discord_username, image_url, created_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT DO NOTHING
+            RETURNING discord_user_id, auth_token, discord_username, image_url
+        ''', (discord_user_id, auth_token, ip_address, discord_username, image_url)) as cursor:
+            row = await cursor.fetchone()
+        await db.commit()
+    if row is None:
+        return None
+    invalidate_user(discord_user_id, discord_username, auth_token)
+    record_registration(discord_user_id, discord_username)
+    return {
+        'discord_user_id': row[0],
+        'auth_token': row[1],
+        'discord_username': row[2],
+        'image_url': row[3]
+    }
+
+async def get_registered_users():
+    async with users_pool.reader() as db:
+        async with db.execute('''
+            SELECT discord_user_id, discord_username
+            FROM users
+        ''') as cursor:
+            return [tuple(row) async for row in cursor]
+
 async def check_user_exists(discord_user_id):
-    async with aiosqlite.connect('databases/users.db') as db:
+    async with users_pool.reader() as db:
         async with db.execute('''
             SELECT COUNT(*) AS count
             FROM users
@@ -92,16 +199,134 @@ async def check_user_exists(discord_user_id):
             count = await cursor.fetchone()
             return count[0] > 0
 
-async def add_report(username, scammer_id, description, discord_user_id, ip_address):
-    async with aiosqlite.connect('databases/reports.db') as db:
+async def _insert_report(db, username, scammer_id, description, discord_user_id, ip_address, registered_at=None,
+                         signature=None):
+    async with db.execute('''
+        SELECT (
+            SELECT reports_count
+            FROM scammer_ip_stats
+            WHERE scammer_id = ? AND ip_address = ?
+        ), (
+            SELECT reports_count
+            FROM reporter_stats
+            WHERE discord_user_id = ?
+        )
+    ''', (scammer_id, ip_address, discord_user_id)) as cursor:
+        same_ip_reports, history = await cursor.fetchone()
+    async with db.execute('''
+        INSERT INTO report_keys (discord_user_id, scammer_id)
+        VALUES (?, ?)
+        ON CONFLICT(discord_user_id, scammer_id) DO NOTHING
+        RETURNING 1
+    ''', (discord_user_id, scammer_id)) as cursor:
+        if await cursor.fetchone() is None:
+            return None
+    same_ip_reports = same_ip_reports or 0
+    history = history or 0
+    if signature is None:
+        signature = report_signature(description)
+    duplicate_of = brigading_index.check(scammer_id, ip_address, signature)
+    reported_at = time.time()
+    weight = report_weight(registered_at, reported_at, history, same_ip_reports + 1)
+    if duplicate_of is not None:
+        weight *= settings.BRIGADING_WEIGHT
+    async with db.execute('''
+        INSERT INTO reports (username, description, discord_user_id, ip_address, scammer_id, weight, signature, duplicate_of)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(discord_user_id, scammer_id) DO NOTHING
+        RETURNING id, created_at
+    ''', (username, description, discord_user_id, ip_address, scammer_id, weight, signature, duplicate_of)) as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        return None
+    report_id, created_at = row
+    # Later reports in the same batch are checked against this one before it
+    # commits; the queue's commit and rollback hooks settle it.
+    brigading_index.add_pending(scammer_id, report_id, ip_address, signature)
+    try:
         await db.execute('''
-            INSERT INTO reports (username, description, discord_user_id, ip_address, scammer_id)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (username, description, discord_user_id, ip_address, scammer_id))
-        await db.commit()
+            INSERT INTO reporter_stats (discord_user_id, reports_count)
+            VALUES (?, 1)
+            ON CONFLICT(discord_user_id) DO UPDATE SET reports_count = reports_count + 1
+        ''', (discord_user_id,))
+        if ip_address is not None:
+            await db.execute('''
+                INSERT INTO scammer_ip_stats (scammer_id, ip_address, reports_count)
+                VALUES (?, ?, 1)
+                ON CONFLICT(scammer_id, ip_address) DO UPDATE SET reports_count = reports_count + 1
+            ''', (scammer_id, ip_address))
+        # Reporters are unique per scammer, so every new report is a new reporter.
+        # The score is brought forward to now before the new weight is added.
+        async with db.execute('''
+            INSERT INTO scammer_stats (
+                scammer_id, reports_count, distinct_reporters, distinct_ips, first_report_at, last_report_at,
+                score, score_at
+            )
+            VALUES (?, 1, 1, 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, ?, ?)
+            ON CONFLICT(scammer_id) DO UPDATE SET
+                reports_count = reports_count + 1,
+                distinct_reporters = distinct_reporters + 1,
+                distinct_ips = distinct_ips + ?,
+                last_report_at = excluded.last_report_at,
+                score = score * reputation_decay(excluded.score_at - score_at) + excluded.score,
+                score_at = excluded.score_at
+            RETURNING reports_count, score
+        ''', (scammer_id, weight, reported_at, 1 if same_ip_reports == 0 else 0)) as cursor:
+            row = await cursor.fetchone()
+        report = dict(zip(REPORT_COLUMNS, (
+            report_id, username, description, discord_user_id, ip_address, scammer_id, created_at, duplicate_of
+        )))
+        return {'reports_count': row[0], 'reputation': round(row[1], 4), 'report': report, 'signature': signature}
+    except BaseException:
+        brigading_index.discard(report_id)
+        raise
+
+def _report_committed(result):
+    # Runs once the report's transaction has committed, so a write rolled
+    # back with its savepoint or its batch never reaches the other workers'
+    # brigading indexes, the stats caches or the feed.
+    if result is None:
+        return
+    report = result.pop('report')
+    signature = result.pop('signature')
+    record_report(report['scammer_id'], report['id'], report['ip_address'], signature)
+    if report['duplicate_of'] is not None:
+        record_flagged()
+    invalidate('scammer_stats', report['scammer_id'])
+    record_feed_event('report', report)
+
+def _report_rolled_back(result):
+    if result is not None:
+        brigading_index.discard(result['report']['id'])
+
+report_queue = WriteQueue(
+    reports_pool, timed_query(_insert_report), max_batch=settings.REPORT_BATCH_SIZE, max_delay=settings.REPORT_BATCH_DELAY,
+    on_commit=_report_committed, on_rollback=_report_rolled_back,
+)
+
+async def add_report(username, scammer_id, description, discord_user_id, ip_address, registered_at=None,
+                     signature=None):
+    async with reports_pool.writer() as db:
+        result = await _insert_report(
+            db, username, scammer_id, description, discord_user_id, ip_address, registered_at, signature
+        )
+        try:
+            await db.commit()
+        except BaseException:
+            _report_rolled_back(result)
+            raise
+    _report_committed(result)
+    return result is not None
+
+async def submit_report(username, scammer_id, description, discord_user_id, ip_address, registered_at=None,
+                        signature=None):
+    # The queue runs _report_committed before answering.
+    return await report_queue.submit(
+        username, scammer_id, description, discord_user_id, ip_address, registered_at, signature
+    )
 
 async def check_ip_auth(ip_address, auth_token):
-    async with aiosqlite.connect('databases/users.db') as db:
+    async with users_pool.reader() as db:
         async with db.execute('''
             SELECT ip_address
             FROM users
@@ -109,8 +334,18 @@ async def check_ip_auth(ip_address, auth_token):
         ''', (ip_address, auth_token)) as cursor:
             return (await cursor.fetchone()) is not None
 
+async def get_auth_token_owner(auth_token):
+    async with users_pool.reader() as db:
+        async with db.execute('''
+            SELECT ip_address, discord_user_id, CAST(strftime('%s', created_at) AS REAL)
+            FROM users
+            WHERE auth_token = ?
+        ''', (auth_token,)) as cursor:
+            row = await cursor.fetchone()
+            return tuple(row) if row else None
+
 async def check_username_exists(discord_username):
-    async with aiosqlite.connect('databases/users.db') as db:
+    async with users_pool.reader() as db:
         async with db.execute('''
             SELECT COUNT(*) AS count
             FROM users
@@ -120,26 +355,42 @@ async def check_username_exists(discord_username):
             return count[0] > 0
 
 async def has_reported(auth_token, scammer_id):
-    async with aiosqlite.connect('databases/users.db') as user_db:
-        async with aiosqlite.connect('databases/reports.db') as report_db:
-            async with user_db.execute('''
-                SELECT discord_user_id
+    async with users_pool.reader() as db:
+        async with db.execute('''
+            SELECT EXISTS (
+                SELECT 1
                 FROM users
-                WHERE auth_token = ?
-            ''', (auth_token,)) as user_cursor:
-                user_row = await user_cursor.fetchone()
-                if user_row is None:
-                    return False
-                async with report_db.execute('''
-                    SELECT COUNT(*) AS count
-                    FROM reports
-                    WHERE discord_user_id = ? AND scammer_id = ?
-                ''', (user_row[0], scammer_id)) as report_cursor:
-                    report_row = await report_cursor.fetchone()
-                    return report_row[0] > 0
+                JOIN report_keys ON report_keys.discord_user_id = users.discord_user_id
+                WHERE users.auth_token = ? AND report_keys.scammer_id = ?
+            )
+        ''', (auth_token, scammer_id)) as cursor:
+            row = await cursor.fetchone()
+            return bool(row[0])
+
+async def authorize_report(auth_token, scammer_id):
+    async with users_pool.reader() as db:
+        async with db.execute('''
+            SELECT users.ip_address,
+                   users.discord_user_id,
+                   CAST(strftime('%s', users.created_at) AS REAL),
+                   EXISTS (
+                       SELECT 1
+                       FROM bans
+                       WHERE bans.discord_user_id = users.discord_user_id
+                   ),
+                   EXISTS (
+                       SELECT 1
+                       FROM report_keys
+                       WHERE report_keys.discord_user_id = users.discord_user_id AND report_keys.scammer_id = ?
+                   )
+            FROM users
+            WHERE users.auth_token = ?
+        ''', (scammer_id, auth_token)) as cursor:
+            row = await cursor.fetchone()
+            return (row[0], row[1], row[2], bool(row[3]), bool(row[4])) if row else None
 
 async def get_discord_user_id(auth_token):
-    async with aiosqlite.connect('databases/users.db') as db:
+    async with users_pool.reader() as db:
         async with db.execute('''
             SELECT discord_user_id
             FROM users
@@ -149,17 +400,49 @@ async def get_discord_user_id(auth_token):
             return row[0] if row else None
 
 async def get_total_reports_for_scammer(scammer_id):
-    async with aiosqlite.connect('databases/reports.db') as db:
+    async with reports_pool.reader() as db:
         async with db.execute('''
-            SELECT COUNT(*) AS count
-            FROM reports
+            SELECT reports_count
+            FROM scammer_stats
             WHERE scammer_id = ?
         ''', (scammer_id,)) as cursor:
             row = await cursor.fetchone()
             return row[0] if row else 0
 
+SCAMMER_STATS_COLUMNS = (
+    'scammer_id', 'reports_count', 'distinct_reporters', 'distinct_ips', 'first_report_at', 'last_report_at',
+    'score', 'score_at'
+)
+
+async def get_scammer_stats(scammer_id):
+    async with reports_pool.reader() as db:
+        async with db.execute('''
+            SELECT scammer_id, reports_count, distinct_reporters, distinct_ips, first_report_at, last_report_at,
+                   score, score_at
+            FROM scammer_stats
+            WHERE scammer_id = ?
+        ''', (scammer_id,)) as cursor:
+            row = await cursor.fetchone()
+            return dict(zip(SCAMMER_STATS_COLUMNS, row)) if row else None
+
+async def get_scammer_stats_many(scammer_ids, chunk_size=500):
+    stats = {}
+    scammer_ids = list(scammer_ids)
+    async with reports_pool.reader() as db:
+        for start in range(0, len(scammer_ids), chunk_size):
+            chunk = scammer_ids[start:start + chunk_size]
+            async with db.execute(f'''
+                SELECT scammer_id, reports_count, distinct_reporters, distinct_ips, first_report_at, last_report_at,
+                       score, score_at
+                FROM scammer_stats
+                WHERE scammer_id IN ({', '.join('?' * len(chunk))})
+            ''', chunk) as cursor:
+                async for row in cursor:
+                    stats[row[0]] = dict(zip(SCAMMER_STATS_COLUMNS, row))
+    return stats
+
 async def get_all_reports():
-    async with aiosqlite.connect('databases/reports.db') as db:
+    async with reports_pool.reader() as db:
         async with db.execute('''
             SELECT *
             FROM reports
@@ -167,8 +450,84 @@ async def get_all_reports():
         ''') as cursor:
             return await cursor.fetchall()
 
+REPORT_COLUMNS = (
+    'id', 'username', 'description', 'discord_user_id', 'ip_address', 'scammer_id', 'created_at', 'duplicate_of'
+)
+
+def _report_filters(scammer_id=None, reporter=None, since=None, until=None):
+    clauses = []
+    params = []
+    if scammer_id is not None:
+        clauses.append('scammer_id = ?')
+        params.append(scammer_id)
+    if reporter is not None:
+        clauses.append('discord_user_id = ?')
+        params.append(reporter)
+    if since is not None:
+        clauses.append('created_at >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('created_at < ?')
+        params.append(until)
+    return clauses, params
+
+async def list_reports(limit=50, before_id=None, scammer_id=None, reporter=None, since=None, until=None):
+    clauses, params = _report_filters(scammer_id, reporter, since, until)
+    if before_id is not None:
+        clauses.append('id < ?')
+        params.append(before_id)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    async with reports_pool.reader() as db:
+        async with db.execute(f'''
+            SELECT id, username, description, discord_user_id, ip_address, scammer_id, created_at, duplicate_of
+            FROM reports
+            {where}
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (*params, limit)) as cursor:
+            return [dict(zip(REPORT_COLUMNS, row)) for row in await cursor.fetchall()]
+
+async def list_reports_after(after_id, scammer_ids=None, limit=500):
+    clauses = ['id > ?']
+    params = [after_id]
+    if scammer_ids:
+        clauses.append(f"scammer_id IN ({', '.join('?' * len(scammer_ids))})")
+        params.extend(scammer_ids)
+    async with reports_pool.reader() as db:
+        async with db.execute(f'''
+            SELECT id, username, description, discord_user_id, ip_address, scammer_id, created_at, duplicate_of
+            FROM reports
+            WHERE {' AND '.join(clauses)}
+            ORDER BY id
+            LIMIT ?
+        ''', (*params, limit)) as cursor:
+            return [dict(zip(REPORT_COLUMNS, row)) for row in await cursor.fetchall()]
+
+async def iter_reports(scammer_id=None, reporter=None, since=None, until=None, batch_size=500):
+    clauses, params = _report_filters(scammer_id, reporter, since, until)
+    clauses.append('id > ?')
+    where = f"WHERE {' AND '.join(clauses)}"
+    after_id = 0
+    while True:
+        # Each batch borrows a reader only for its own query, so a slow
+        # consumer neither holds a pooled connection nor pins a WAL snapshot.
+        async with reports_pool.reader() as db:
+            async with db.execute(f'''
+                SELECT id, username, description, discord_user_id, ip_address, scammer_id, created_at, duplicate_of
+                FROM reports
+                {where}
+                ORDER BY id
+                LIMIT ?
+            ''', (*params, after_id, batch_size)) as cursor:
+                rows = await cursor.fetchmany(batch_size)
+        for row in rows:
+            yield dict(zip(REPORT_COLUMNS, row))
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1][0]
+
 async def get_user_data_from_ip(ip_address):
-    async with aiosqlite.connect('databases/users.db') as db:
+    async with users_pool.reader() as db:
         async with db.execute('''
             SELECT *
             FROM users
@@ -177,15 +536,26 @@ async def get_user_data_from_ip(ip_address):
             return await cursor.fetchone()
 
 async def ban_user(discord_user_id, reason):
-    async with aiosqlite.connect('databases/bans.db') as db:
+    async with bans_pool.writer() as db:
+        async with db.execute('''
+            SELECT COUNT(*)
+            FROM bans
+            WHERE discord_user_id = ?
+        ''', (discord_user_id,)) as cursor:
+            already_banned = (await cursor.fetchone())[0] > 0
         await db.execute('''
             INSERT OR REPLACE INTO bans (discord_user_id, reason)
             VALUES (?, ?)
         ''', (discord_user_id, reason))
         await db.commit()
+    record_ban(discord_user_id, True)
+    invalidate_user(discord_user_id)
+    record_feed_event('ban', {'discord_user_id': discord_user_id, 'reason': reason})
+    if not already_banned:
+        await adjust_reputation(discord_user_id, -1)
 
 async def is_user_banned(discord_user_id):
-    async with aiosqlite.connect('databases/bans.db') as db:
+    async with bans_pool.reader() as db:
         async with db.execute('''
             SELECT COUNT(*) AS count
             FROM bans
@@ -195,9 +565,254 @@ async def is_user_banned(discord_user_id):
             return row[0] > 0
 
 async def unban_user(discord_user_id):
-    async with aiosqlite.connect('databases/bans.db') as db:
-        await db.execute('''
+    async with bans_pool.writer() as db:
+        cursor = await db.execute('''
             DELETE FROM bans
             WHERE discord_user_id = ?
         ''', (discord_user_id,))
-        await db.commit()
\ No newline at end of file
+        unbanned = cursor.rowcount > 0
+        await cursor.close()
+        await db.commit()
+    record_ban(discord_user_id, False)
+    invalidate_user(discord_user_id)
+    if unbanned:
+        record_feed_event('unban', {'discord_user_id': discord_user_id})
+        await adjust_reputation(discord_user_id, 1)
+
+async def get_banned_user_ids():
+    async with bans_pool.reader() as db:
+        async with db.execute('''
+            SELECT discord_user_id
+            FROM bans
+        ''') as cursor:
+            return [row[0] async for row in cursor]
+
+async def list_bans():
+    async with bans_pool.reader() as db:
+        async with db.execute('''
+            SELECT discord_user_id, banned_at, reason
+            FROM bans
+            ORDER BY banned_at DESC
+        ''') as cursor:
+            return [
+                {'discord_user_id': row[0], 'banned_at': row[1], 'reason': row[2]}
+                for row in await cursor.fetchall()
+            ]
+
+async def revoke_tokens(discord_user_id):
+    revoked_before = int(time.time() * 1000)
+    async with bans_pool.writer() as db:
+        await db.execute('''
+            INSERT INTO token_revocations (discord_user_id, revoked_before)
+            VALUES (?, ?)
+            ON CONFLICT(discord_user_id) DO UPDATE SET revoked_before = excluded.revoked_before
+        ''', (discord_user_id, revoked_before))
+        await db.commit()
+    record_revocation(discord_user_id, revoked_before)
+    return revoked_before
+
+async def get_token_revocations():
+    async with bans_pool.reader() as db:
+        async with db.execute('''
+            SELECT discord_user_id, revoked_before
+            FROM token_revocations
+        ''') as cursor:
+            return [tuple(row) async for row in cursor]
+
+async def adjust_reputation(discord_user_id, sign):
+    # Subtracts (sign -1) or adds back (sign 1) a reporter's decayed
+    # contributions to the scores of every scammer they reported.
+    now = time.time()
+    async with reports_pool.writer() as db:
+        async with db.execute('''
+            UPDATE scammer_stats
+            SET score = MAX(score * reputation_decay(? - score_at) + ? * contributions.total, 0),
+                score_at = ?
+            FROM (
+                SELECT scammer_id, SUM(weight * reputation_decay(? - CAST(strftime('%s', created_at) AS REAL))) AS total
+                FROM reports
+                WHERE discord_user_id = ? AND weight IS NOT NULL
+                GROUP BY scammer_id
+            ) AS contributions
+            WHERE scammer_stats.scammer_id = contributions.scammer_id
+            RETURNING scammer_stats.scammer_id
+        ''', (now, sign, now, now, discord_user_id)) as cursor:
+            scammer_ids = [row[0] async for row in cursor]
+        await db.commit()
+    for scammer_id in scammer_ids:
+        invalidate('scammer_stats', scammer_id)
+    return len(scammer_ids)
+
+async def needs_reputation_recompute():
+    async with reports_pool.reader() as db:
+        async with db.execute('''
+            SELECT EXISTS (
+                SELECT 1
+                FROM reports
+                WHERE weight IS NULL
+            )
+        ''') as cursor:
+            row = await cursor.fetchone()
+            return bool(row[0])
+
+async def recompute_reputation():
+    # Rebuilds every report weight and scammer score in a few set-based
+    # statements, using the same functions as the incremental path.
+    async with users_pool.reader() as db:
+        async with db.execute('''
+            SELECT discord_user_id, CAST(strftime('%s', created_at) AS REAL)
+            FROM users
+        ''') as cursor:
+            reporters = [tuple(row) async for row in cursor]
+    banned = [(discord_user_id,) for discord_user_id in await get_banned_user_ids()]
+    now = time.time()
+    async with reports_pool.writer() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        await db.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS reputation_reporters (
+                discord_user_id TEXT PRIMARY KEY,
+                registered_at REAL
+            )
+        ''')
+        await db.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS reputation_banned (
+                discord_user_id TEXT PRIMARY KEY
+            )
+        ''')
+        await db.executemany('''
+            INSERT OR REPLACE INTO reputation_reporters (discord_user_id, registered_at)
+            VALUES (?, ?)
+        ''', reporters)
+        await db.executemany('''
+            INSERT OR IGNORE INTO reputation_banned (discord_user_id)
+            VALUES (?)
+        ''', banned)
+        cursor = await db.execute('''
+            UPDATE reports
+            SET weight = ranked.weight
+            FROM (
+                -- Archived reports still count towards a reporter's history
+                -- and an IP's rank: the counters hold every report written,
+                -- and the ones no longer in reports came first.
+                SELECT reports.id,
+                       reputation_weight(
+                           reputation_reporters.registered_at,
+                           CAST(strftime('%s', reports.created_at) AS REAL),
+                           ROW_NUMBER() OVER (PARTITION BY reports.discord_user_id ORDER BY reports.id) - 1
+                               + MAX(COALESCE(reporter_stats.reports_count, 0)
+                                     - COUNT(*) OVER (PARTITION BY reports.discord_user_id), 0),
+                           ROW_NUMBER() OVER (PARTITION BY reports.scammer_id, reports.ip_address ORDER BY reports.id)
+                               + MAX(COALESCE(scammer_ip_stats.reports_count, 0)
+                                     - COUNT(*) OVER (PARTITION BY reports.scammer_id, reports.ip_address), 0)
+                       ) * CASE WHEN reports.duplicate_of IS NULL THEN 1.0 ELSE ? END AS weight
+                FROM reports
+                LEFT JOIN reputation_reporters ON reputation_reporters.discord_user_id = reports.discord_user_id
+                LEFT JOIN reporter_stats ON reporter_stats.discord_user_id = reports.discord_user_id
+                LEFT JOIN scammer_ip_stats
+                    ON scammer_ip_stats.scammer_id = reports.scammer_id AND scammer_ip_stats.ip_address = reports.ip_address
+            ) AS ranked
+            WHERE reports.id = ranked.id
+        ''', (settings.BRIGADING_WEIGHT,))
+        reports_count = cursor.rowcount
+        await cursor.close()
+        await db.execute('''
+            UPDATE scammer_stats
+            SET score = archived_score * reputation_decay(? - archived_score_at), score_at = ?
+        ''', (now, now))
+        await db.execute('''
+            UPDATE scammer_stats
+            SET score = scammer_stats.score + totals.score
+            FROM (
+                SELECT scammer_id, SUM(weight * reputation_decay(? - CAST(strftime('%s', created_at) AS REAL))) AS score
+                FROM reports
+                WHERE scammer_id IS NOT NULL
+                  AND discord_user_id NOT IN (SELECT discord_user_id FROM reputation_banned)
+                GROUP BY scammer_id
+            ) AS totals
+            WHERE scammer_stats.scammer_id = totals.scammer_id
+        ''', (now,))
+        await db.execute('DROP TABLE reputation_reporters')
+        await db.execute('DROP TABLE reputation_banned')
+        await db.commit()
+    clear_cache('scammer_stats')
+    return reports_count
+
+async def get_report_signatures():
+    async with reports_pool.reader() as db:
+        async with db.execute('''
+            SELECT scammer_id, id, ip_address, signature, CAST(strftime('%s', created_at) AS REAL)
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY scammer_id ORDER BY id DESC) AS position
+                FROM reports
+                WHERE created_at >= datetime('now', ?) AND signature IS NOT NULL AND scammer_id IS NOT NULL
+            )
+            WHERE position <= ?
+            ORDER BY id
+        ''', (f'-{settings.BRIGADING_WINDOW_DAYS} days', settings.BRIGADING_PER_SCAMMER)) as cursor:
+            return [tuple(row) async for row in cursor]
+
+async def backfill_report_signatures(batch_size=1000):
+    # Replays every report without a signature, in ID order, through a
+    # private index holding the signatures already stored, so existing rows
+    # are flagged exactly as they would have been at insert time.
+    index = new_index()
+    index.window = float('inf')
+    async with reports_pool.reader() as db:
+        async with db.execute('''
+            SELECT scammer_id, id, ip_address, signature, CAST(strftime('%s', created_at) AS REAL)
+            FROM reports
+            WHERE signature IS NOT NULL AND scammer_id IS NOT NULL
+            ORDER BY id
+        ''') as cursor:
+            index.load([tuple(row) async for row in cursor])
+    after_id = 0
+    filled = flagged = 0
+    while True:
+        async with reports_pool.reader() as db:
+            async with db.execute('''
+                SELECT id, scammer_id, ip_address, description, CAST(strftime('%s', created_at) AS REAL)
+                FROM reports
+                WHERE signature IS NULL AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (after_id, batch_size)) as cursor:
+                rows = await cursor.fetchall()
+        if not rows:
+            break
+        updates = []
+        for report_id, scammer_id, ip_address, description, created_at in rows:
+            signature = report_signature(description or '')
+            duplicate_of = None
+            if scammer_id is not None:
+                duplicate_of = index.check(scammer_id, ip_address, signature)
+                index.add(scammer_id, report_id, ip_address, signature, created_at)
+            updates.append((signature, duplicate_of, report_id))
+            flagged += duplicate_of is not None
+        async with reports_pool.writer() as db:
+            await db.executemany('''
+                UPDATE reports
+                SET signature = ?, duplicate_of = ?
+                WHERE id = ?
+            ''', updates)
+            await db.commit()
+        filled += len(rows)
+        after_id = rows[-1][0]
+    if filled:
+        await recompute_reputation()
+    return filled, flagged
+
+@register_collector
+def _database_metrics():
+    pools = [(('database', os.path.basename(pool.path)),) for pool in POOLS]
+    yield from sample_family('mspscammers_db_connections_opened_total', 'SQLite connections opened.', 'counter',
+                             ((labels, pool.connections_opened) for labels, pool in zip(pools, POOLS)))
+    yield from sample_family('mspscammers_db_idle_readers', 'Read-only connections not in use.', 'gauge',
+                             ((labels, pool.idle_readers) for labels, pool in zip(pools, POOLS)))
+    yield from sample_family('mspscammers_report_queue_depth', 'Reports waiting to be written.', 'gauge',
+                             [((), report_queue.depth)])
+    yield from sample_family('mspscammers_report_queue_batches_total', 'Report batches committed.', 'counter',
+                             [((), report_queue.batches)])
+    yield from sample_family('mspscammers_report_queue_writes_total', 'Reports written through the queue.', 'counter',
+                             [((), report_queue.writes)])
+
+instrument_queries(globals(), __name__)
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""
+Computes the brigading signatures of reports written before detection
+existed, flags the coordinated ones and rebuilds the reputation scores.
+
+Usage:
+    python -m mspscammers.database.backfill [--batch-size 1000]
+
+Reports are processed in ID order against the signatures already stored, so
+each one is judged as it would have been at insert time. Only rows without a
+signature are touched, so the tool can be stopped and re-run. Restart the API
+afterwards so its in-memory index picks up the new signatures.
+"""
+import argparse
+import asyncio
+
+from mspscammers import database
+
+
+async def backfill(batch_size: int) -> None:
+    await database.open_databases()
+    try:
+        await database.create_ban_database()
+        await database.create_report_database()
+        await database.create_user_database()
+        await database.migrate_databases()
+        filled, flagged = await database.backfill_report_signatures(batch_size=batch_size)
+        print(f"reports: {filled} signed, {flagged} flagged as coordinated")
+    finally:
+        await database.close_databases()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill brigading signatures for existing reports.")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from mspscammers.database.pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+class WriteQueue:
+    """
+    Groups concurrent writes into one transaction.
+
+    Callers await `submit` and get back the result of their own write. A
+    background task collects whatever has queued up, lingering `max_delay`
+    seconds for more, and runs up to `max_batch` writes on the pool's writer
+    connection before a single commit. Each write runs under its own
+    savepoint, so a failing write is rolled back and reported to its caller
+    without affecting the rest of the batch; it has to undo any in-memory
+    side effects of its own before raising.
+    """
+
+    def __init__(self, pool: ConnectionPool, write: Callable[..., Awaitable[Any]],
+                 max_batch: int = 256, max_delay: float = 0.002,
+                 on_commit: Optional[Callable[[Any], None]] = None,
+                 on_rollback: Optional[Callable[[Any], None]] = None):
+        """
+        Initializes the WriteQueue.
+
+        Args:
+            pool (ConnectionPool): The pool whose writer connection runs the batches.
+            write (Callable): A coroutine function called as `write(db, *args)` for each queued write.
+            max_batch (int): The maximum number of writes per transaction.
+            max_delay (float): Seconds to wait for more writes before flushing a batch.
+            on_commit (Optional[Callable]): Called with each write's result once its batch has
+                committed, before its caller is answered, even if the caller has gone away.
+            on_rollback (Optional[Callable]): Called with the result of each write undone because
+                its batch failed to commit.
+        """
+        self.pool = pool
+        self.write = write
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_commit = on_commit
+        self.on_rollback = on_rollback
+        self.batches = 0
+        self.writes = 0
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        Flushes every queued write and stops the background task.
+        """
+        if self._task is None:
+            return
+        self._queue.put_nowait(_CLOSE)
+        task, self._task = self._task, None
+        await task
+
+    async def submit(self, *args: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        if self._task is None:
+            await self._flush([(args, future)])
+        else:
+            self._queue.put_nowait((args, future))
+        return await future
+
+    def _drain(self, batch: List[Tuple[tuple, "asyncio.Future[Any]"]]) -> bool:
+        while len(batch) < self.max_batch and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is _CLOSE:
+                return True
+            batch.append(item)
+        return False
+
+    async def _run(self) -> None:
+        batch: List[Tuple[tuple, "asyncio.Future[Any]"]] = []
+        try:
+            closing = False
+            while not closing:
+                item = await self._queue.get()
+                batch = []
+                if item is _CLOSE:
+                    closing = True
+                else:
+                    batch.append(item)
+                    closing = self._drain(batch)
+                    if not closing and len(batch) < self.max_batch and self.max_delay > 0:
+                        await asyncio.sleep(self.max_delay)
+                        closing = self._drain(batch)
+                if batch:
+                    await self._flush(batch)
+            # Writes queued behind the close marker still get flushed.
+            while not self._queue.empty():
+                batch = []
+                self._drain(batch)
+                if batch:
+                    await self._flush(batch)
+        finally:
+            # Only reached with writes unanswered if the task was cancelled;
+            # their callers get an error instead of waiting forever.
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _CLOSE:
+                    batch.append(item)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError('The write queue stopped before this write was committed'))
+
+    async def _flush(self, batch: List[Tuple[tuple, "asyncio.Future[Any]"]]) -> None:
+        results: List[Tuple[bool, Any]] = []
+        try:
+            async with self.pool.writer() as db:
+                await db.execute('BEGIN IMMEDIATE')
+                for args, _ in batch:
+                    await db.execute('SAVEPOINT queued_write')
+                    try:
+                        results.append((True, await self.write(db, *args)))
+                    except Exception as error:
+                        # Only this write is undone; the rest of the batch still commits.
+                        await db.execute('ROLLBACK TO queued_write')
+                        results.append((False, error))
+                    await db.execute('RELEASE queued_write')
+                await db.commit()
+        except Exception as error:
+            for ok, result in results:
+                if ok:
+                    self._notify(self.on_rollback, result)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for (_, future), (ok, result) in zip(batch, results):
+            if ok:
+                self._notify(self.on_commit, result)
+            if future.done():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    @staticmethod
+    def _notify(callback: Optional[Callable[[Any], None]], result: Any) -> None:
+        if callback is None:
+            return
+        try:
+            callback(result)
+        except Exception:
+            # The write itself is settled either way; its caller still gets its result.
+            logger.exception("Write queue callback failed")
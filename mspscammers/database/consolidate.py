@@ -0,0 +1,72 @@
+"""
+Copies the split users.db, reports.db and bans.db files into the single
+mspscammers.db file used by MSPSCAMMERS_DATABASE_MODE=single.
+
+Usage:
+    python -m mspscammers.database.consolidate [--source-dir databases] [--target-dir databases]
+
+Run it with the API stopped. The source files are migrated to the current
+schema first so the tables line up column for column; rows already present
+in the target are left alone, so the tool can be re-run safely.
+"""
+import argparse
+import asyncio
+import os
+
+from mspscammers.database import BANS_SCHEMA, REPORTS_SCHEMA, USERS_SCHEMA
+from mspscammers.database.migrations import run_migrations
+from mspscammers.database.pool import ConnectionPool
+
+# Logical database name, schema and tables copied for each source file, in order.
+SOURCES = {
+    'users.db': ('users', USERS_SCHEMA, ('users',)),
+    'reports.db': ('reports', REPORTS_SCHEMA, ('reports', 'scammer_stats', 'reporter_stats', 'scammer_ip_stats',
+                                                'report_keys')),
+    'bans.db': ('bans', BANS_SCHEMA, ('bans', 'token_revocations')),
+}
+
+
+async def consolidate(source_dir: str, target_dir: str) -> None:
+    for file_name, (name, _, _) in SOURCES.items():
+        path = os.path.join(source_dir, file_name)
+        if not os.path.exists(path):
+            raise SystemExit(f"Missing source database {path}")
+        source = ConnectionPool(path, readers=1)
+        try:
+            await run_migrations(source, name)
+        finally:
+            await source.close()
+
+    target = ConnectionPool(os.path.join(target_dir, 'mspscammers.db'), readers=1)
+    try:
+        for name, schema, _ in SOURCES.values():
+            async with target.writer() as db:
+                async with db.execute(schema):
+                    pass
+            await run_migrations(target, name)
+
+        async with target.writer() as db:
+            for file_name, (name, _, tables) in SOURCES.items():
+                alias = 'source_' + name
+                await db.execute(f"ATTACH DATABASE ? AS {alias}", (os.path.join(source_dir, file_name),))
+                await db.execute('BEGIN IMMEDIATE')
+                for table in tables:
+                    cursor = await db.execute(f"INSERT OR IGNORE INTO main.{table} SELECT * FROM {alias}.{table}")
+                    print(f"{table}: copied {cursor.rowcount} rows")
+                    await cursor.close()
+                await db.commit()
+                await db.execute(f"DETACH DATABASE {alias}")
+    finally:
+        await target.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Consolidate the split databases into a single file.")
+    parser.add_argument('--source-dir', default='databases')
+    parser.add_argument('--target-dir', default=None, help="defaults to the source directory")
+    args = parser.parse_args()
+    asyncio.run(consolidate(args.source_dir, args.target_dir or args.source_dir))
+
+
+if __name__ == '__main__':
+    main()
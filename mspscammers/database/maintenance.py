@@ -0,0 +1,537 @@
+"""
+Background maintenance of the database files: online backups, archival of
+old reports, incremental vacuum, ANALYZE and WAL checkpoints.
+
+Usage:
+    python -m mspscammers.database.maintenance [--backup] [--archive [--older-than-days N]] [--vacuum]
+    python -m mspscammers.database.maintenance --enable-incremental-vacuum
+
+Without flags every job runs once, the way the API runs them every
+MSPSCAMMERS_MAINTENANCE_INTERVAL seconds. Each job works in small steps and
+pauses between them, for longer whenever reports are queued to be written, so
+it never holds the writer connection for more than a moment.
+
+Backups are copied page by page with SQLite's online backup API into a
+timestamped folder under MSPSCAMMERS_BACKUP_DIR. Archived reports are moved to
+reports-archive.db as zlib-compressed chunks, with a small index of report ID,
+scammer and reporter; the scammer's report count and score keep counting them.
+
+New database files are created with incremental auto-vacuum. Existing files
+need one full VACUUM to switch, which --enable-incremental-vacuum runs; stop
+the API first, as it rewrites every file.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from mspscammers import database, settings
+from mspscammers.cache import invalidate
+from mspscammers.database.pool import ConnectionPool
+from mspscammers.metrics import register_collector, sample_family
+from mspscammers.reputation import decay
+from mspscammers.responses import dumps
+
+logger = logging.getLogger('mspscammers.maintenance')
+
+ARCHIVE_DB = os.path.join(settings.DATABASE_DIR, 'reports-archive.db')
+LOCK_FILE = os.path.join(settings.DATABASE_DIR, 'maintenance.lock')
+BACKUP_NAME_FORMAT = '%Y%m%dT%H%M%SZ'
+# Page-step backups restarted this many times by concurrent writes fall back
+# to copying the file in a single step.
+MAX_BACKUP_RESTARTS = 3
+ANALYSIS_LIMIT = 1000
+
+archive_pool = ConnectionPool(ARCHIVE_DB, readers=1)
+
+ARCHIVE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS report_chunks (
+        id INTEGER PRIMARY KEY,
+        first_report_id INTEGER NOT NULL,
+        last_report_id INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        archived_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        data BLOB NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS archived_reports (
+        id INTEGER PRIMARY KEY,
+        scammer_id TEXT,
+        discord_user_id TEXT,
+        created_at DATETIME,
+        chunk_id INTEGER NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_archived_reports_scammer_id ON archived_reports (scammer_id)',
+    'CREATE INDEX IF NOT EXISTS idx_archived_reports_discord_user_id ON archived_reports (discord_user_id)',
+)
+
+ARCHIVE_COLUMNS = database.REPORT_COLUMNS + ('weight',)
+
+
+class BackupRestarted(Exception):
+    """
+    Raised when writes keep restarting a page-step backup.
+    """
+
+
+async def throttle() -> None:
+    """
+    Pauses between maintenance steps, and for as long as reports are
+    waiting to be written, so report writes go first.
+    """
+    await asyncio.sleep(settings.MAINTENANCE_PAUSE)
+    while database.report_queue.depth > 0:
+        await asyncio.sleep(settings.MAINTENANCE_PAUSE)
+
+
+async def _copy(source: aiosqlite.Connection, path: str, pages: int) -> int:
+    restarts = 0
+    remaining_before = None
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal restarts, remaining_before
+        # A write from another connection makes SQLite start over.
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts > MAX_BACKUP_RESTARTS:
+                raise BackupRestarted(f"{path} restarted {restarts} times")
+        remaining_before = remaining
+
+    if os.path.exists(path):
+        os.remove(path)
+    target = await aiosqlite.connect(path)
+    try:
+        await source.backup(target, pages=pages, progress=progress, sleep=settings.MAINTENANCE_PAUSE)
+    finally:
+        await target.close()
+    return restarts
+
+
+async def backup_file(path: str, target: str) -> int:
+    """
+    Copies the database at `path` to `target` while it stays in use.
+
+    The copy runs on its own connection, BACKUP_PAGES pages at a time with a
+    pause between steps; readers and the writer are never blocked. If writes
+    keep forcing it to start over, the file is copied in one step instead,
+    which holds a read snapshot for the duration of the copy.
+
+    Returns:
+        int: How many times the copy was restarted by concurrent writes.
+    """
+    partial = target + '.partial'
+    source = await aiosqlite.connect(path)
+    try:
+        try:
+            restarts = await _copy(source, partial, settings.BACKUP_PAGES)
+        except BackupRestarted:
+            logger.info("Backup of %s kept restarting; copying it in one step", path)
+            restarts = MAX_BACKUP_RESTARTS + 1
+            await _copy(source, partial, -1)
+    finally:
+        await source.close()
+    os.replace(partial, target)
+    return restarts
+
+
+def _backup_times(directory: str) -> List[Tuple[datetime, str]]:
+    backups = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            try:
+                backups.append((datetime.strptime(name, BACKUP_NAME_FORMAT), os.path.join(directory, name)))
+            except ValueError:
+                continue
+    return sorted(backups)
+
+
+def backup_due(directory: str, interval: float) -> bool:
+    # Read from the folder names, so workers and restarts agree on it.
+    backups = _backup_times(directory)
+    if not backups:
+        return True
+    last = backups[-1][0].replace(tzinfo=timezone.utc).timestamp()
+    return time.time() - last >= interval
+
+
+async def backup_databases(directory: str, keep: int) -> Tuple[str, int]:
+    """
+    Backs every database file up into a new timestamped folder under
+    `directory` and deletes all but the newest `keep` folders.
+
+    Returns:
+        Tuple[str, int]: The new folder and the number of restarted copies.
+    """
+    folder = os.path.join(directory, datetime.now(timezone.utc).strftime(BACKUP_NAME_FORMAT))
+    os.makedirs(folder, exist_ok=True)
+    paths = [pool.path for pool in database.POOLS]
+    if os.path.exists(ARCHIVE_DB):
+        paths.append(ARCHIVE_DB)
+    restarts = 0
+    for path in paths:
+        restarts += await backup_file(path, os.path.join(folder, os.path.basename(path)))
+        await throttle()
+    if keep > 0:
+        for _, old in _backup_times(directory)[:-keep]:
+            shutil.rmtree(old, ignore_errors=True)
+    return folder, restarts
+
+
+async def create_archive_database():
+    async with archive_pool.writer() as db:
+        for statement in ARCHIVE_SCHEMA:
+            async with db.execute(statement):
+                pass
+
+
+async def _archived_ids(report_ids):
+    async with archive_pool.reader() as db:
+        async with db.execute(f'''
+            SELECT id
+            FROM archived_reports
+            WHERE id IN ({', '.join('?' * len(report_ids))})
+        ''', report_ids) as cursor:
+            return {row[0] async for row in cursor}
+
+
+async def _write_chunk(rows):
+    data = zlib.compress(dumps([dict(zip(ARCHIVE_COLUMNS, row[:-1])) for row in rows]), 9)
+    async with archive_pool.writer() as db:
+        async with db.execute('''
+            INSERT INTO report_chunks (first_report_id, last_report_id, rows, data)
+            VALUES (?, ?, ?, ?)
+        ''', (rows[0][0], rows[-1][0], len(rows), data)) as cursor:
+            chunk_id = cursor.lastrowid
+        await db.executemany('''
+            INSERT OR IGNORE INTO archived_reports (id, scammer_id, discord_user_id, created_at, chunk_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(row[0], row[5], row[3], row[6], chunk_id) for row in rows])
+        await db.commit()
+
+
+async def archive_reports(older_than_days, batch_size=500):
+    # Moves reports older than `older_than_days` to the archive, oldest
+    # first. A batch is committed to the archive before it is deleted from
+    # reports in the same transaction as the stats update, so a run stopped
+    # at any point resumes without losing or double-counting a report.
+    await create_archive_database()
+    banned = set(await database.get_banned_user_ids())
+    cutoff = f'-{older_than_days} days'
+    archived = 0
+    while True:
+        async with database.reports_pool.reader() as db:
+            async with db.execute('''
+                SELECT id, username, description, discord_user_id, ip_address, scammer_id, created_at, duplicate_of,
+                       weight, CAST(strftime('%s', created_at) AS REAL)
+                FROM reports
+                WHERE created_at < datetime('now', ?)
+                ORDER BY created_at, id
+                LIMIT ?
+            ''', (cutoff, batch_size)) as cursor:
+                rows = await cursor.fetchall()
+        if not rows:
+            break
+        report_ids = [row[0] for row in rows]
+        already_archived = await _archived_ids(report_ids)
+        new_rows = [row for row in rows if row[0] not in already_archived]
+        if new_rows:
+            await _write_chunk(new_rows)
+
+        # The live score already holds these reports' decayed weight; it is
+        # set aside in archived_score so a recompute from the remaining
+        # reports keeps it. Banned reporters count for nothing, as in the score.
+        now = time.time()
+        counts: Dict[str, int] = defaultdict(int)
+        contributions: Dict[str, float] = defaultdict(float)
+        for row in rows:
+            scammer_id, discord_user_id, weight, created_at = row[5], row[3], row[8], row[9]
+            if scammer_id is None:
+                continue
+            counts[scammer_id] += 1
+            if weight is not None and discord_user_id not in banned:
+                contributions[scammer_id] += weight * decay(now - created_at)
+        async with database.reports_pool.writer() as db:
+            await db.execute('BEGIN IMMEDIATE')
+            await db.executemany('''
+                DELETE FROM reports
+                WHERE id = ?
+            ''', [(report_id,) for report_id in report_ids])
+            await db.executemany('''
+                UPDATE scammer_stats
+                SET archived_reports = archived_reports + ?,
+                    archived_score = archived_score * reputation_decay(? - archived_score_at) + ?,
+                    archived_score_at = ?
+                WHERE scammer_id = ?
+            ''', [(count, now, contributions[scammer_id], now, scammer_id) for scammer_id, count in counts.items()])
+            await db.commit()
+        for scammer_id in counts:
+            invalidate('scammer_stats', scammer_id)
+        archived += len(rows)
+        if len(rows) < batch_size:
+            break
+        await throttle()
+    return archived
+
+async def _execute(pool: ConnectionPool, statement: str) -> list:
+    async with pool.writer() as db:
+        async with db.execute(statement) as cursor:
+            return await cursor.fetchall()
+
+
+async def incremental_vacuum(pool: ConnectionPool) -> int:
+    """
+    Returns free pages to the file system VACUUM_PAGES at a time. Does
+    nothing unless the file uses incremental auto-vacuum.
+
+    Returns:
+        int: The number of pages freed.
+    """
+    if (await _execute(pool, 'PRAGMA auto_vacuum'))[0][0] != 2:
+        return 0
+    freed = 0
+    while True:
+        free = (await _execute(pool, 'PRAGMA freelist_count'))[0][0]
+        if not free:
+            return freed
+        async with pool.writer() as db:
+            # Each step of the statement frees one page; executescript runs
+            # it to completion.
+            await db.executescript(f'PRAGMA incremental_vacuum({settings.VACUUM_PAGES})')
+        freed += min(free, settings.VACUUM_PAGES)
+        await throttle()
+
+
+async def analyze(pool: ConnectionPool) -> None:
+    # analysis_limit samples each index instead of reading all of it, which
+    # keeps ANALYZE to milliseconds on large tables.
+    await _execute(pool, f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+    await _execute(pool, 'ANALYZE')
+
+
+async def checkpoint(pool: ConnectionPool) -> None:
+    # PASSIVE never waits for readers or the writer.
+    await _execute(pool, 'PRAGMA wal_checkpoint(PASSIVE)')
+
+
+async def enable_incremental_vacuum(pool: ConnectionPool) -> None:
+    await _execute(pool, 'PRAGMA auto_vacuum = INCREMENTAL')
+    await _execute(pool, 'VACUUM')
+
+
+def _maintained_pools() -> List[ConnectionPool]:
+    pools = list(database.POOLS)
+    if os.path.exists(ARCHIVE_DB):
+        pools.append(archive_pool)
+    return pools
+
+
+def _lock() -> Optional[object]:
+    # One process at a time: the lock file is held until it is closed. Where
+    # flock is unavailable only the in-process check applies.
+    os.makedirs(os.path.dirname(LOCK_FILE) or '.', exist_ok=True)
+    lock_file = open(LOCK_FILE, 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
+
+
+class Maintenance:
+    """
+    Runs the maintenance jobs in the background every `interval` seconds.
+
+    Every API worker schedules runs, but a lock file lets only one of them
+    run at a time; the others skip that round. Backups are taken when the
+    newest one under BACKUP_DIR is older than `backup_interval`.
+    """
+
+    def __init__(self, interval: float, backup_interval: float):
+        """
+        Initializes the Maintenance scheduler. Nothing runs until `start`.
+
+        Args:
+            interval (float): Seconds between runs; 0 disables the schedule.
+            backup_interval (float): Seconds between backups.
+        """
+        self.interval = interval
+        self.backup_interval = backup_interval
+        self.runs = 0
+        self.failures = 0
+        self.backups = 0
+        self.backup_restarts = 0
+        self.archived = 0
+        self.vacuumed_pages = 0
+        self.last_run_seconds = 0.0
+        self._lock_file = None
+        self._task: Optional[asyncio.Task] = None
+        self._run_task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._lock_file is not None
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._schedule())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._run_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._run_task = None
+        await archive_pool.close()
+
+    def trigger(self, backup: bool = False) -> bool:
+        """
+        Starts a run in the background.
+
+        Args:
+            backup (bool): Take a backup even if one is not due yet.
+
+        Returns:
+            bool: False if a run is already in progress here or in another worker.
+        """
+        if self.running:
+            return False
+        self._lock_file = _lock()
+        if self._lock_file is None:
+            return False
+        self._run_task = asyncio.create_task(self._run(True if backup else None))
+        return True
+
+    async def _schedule(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.trigger():
+                await self._run_task
+
+    async def _run(self, backup: Optional[bool]) -> None:
+        started = time.perf_counter()
+        try:
+            await self.run(backup)
+            self.runs += 1
+        except Exception:
+            self.failures += 1
+            logger.exception("Database maintenance failed")
+        finally:
+            self._lock_file.close()
+            self._lock_file = None
+            self.last_run_seconds = time.perf_counter() - started
+
+    async def run(self, backup: Optional[bool] = None, archive_after_days: Optional[float] = None,
+                  vacuum: bool = True) -> None:
+        """
+        Runs the maintenance jobs once.
+
+        Args:
+            backup (Optional[bool]): Whether to take a backup; None takes one when it is due.
+            archive_after_days (Optional[float]): Age of the reports to archive; 0 archives none.
+            vacuum (bool): Whether to run incremental vacuum, ANALYZE and a WAL checkpoint.
+        """
+        if archive_after_days is None:
+            archive_after_days = settings.ARCHIVE_AFTER_DAYS
+        if backup is None:
+            backup = bool(settings.BACKUP_DIR) and backup_due(settings.BACKUP_DIR, self.backup_interval)
+        if backup:
+            folder, restarts = await backup_databases(settings.BACKUP_DIR, settings.BACKUP_KEEP)
+            self.backups += 1
+            self.backup_restarts += restarts
+            logger.info("Backed the databases up to %s", folder)
+        if archive_after_days > 0:
+            self.archived += await archive_reports(archive_after_days, settings.ARCHIVE_BATCH_SIZE)
+        if vacuum:
+            for pool in _maintained_pools():
+                self.vacuumed_pages += await incremental_vacuum(pool)
+                await analyze(pool)
+                await checkpoint(pool)
+                await throttle()
+
+
+maintenance = Maintenance(settings.MAINTENANCE_INTERVAL, settings.BACKUP_INTERVAL)
+
+
+@register_collector
+def _maintenance_metrics():
+    yield from sample_family('mspscammers_maintenance_running', 'Whether a maintenance run is in progress.', 'gauge',
+                             [((), int(maintenance.running))])
+    yield from sample_family('mspscammers_maintenance_runs_total', 'Maintenance runs completed.', 'counter',
+                             [((), maintenance.runs)])
+    yield from sample_family('mspscammers_maintenance_failures_total', 'Maintenance runs that failed.', 'counter',
+                             [((), maintenance.failures)])
+    yield from sample_family('mspscammers_maintenance_last_run_seconds', 'Duration of the last maintenance run.',
+                             'gauge', [((), maintenance.last_run_seconds)])
+    yield from sample_family('mspscammers_backups_total', 'Online backups taken.', 'counter',
+                             [((), maintenance.backups)])
+    yield from sample_family('mspscammers_backup_restarts_total', 'Backup copies restarted by concurrent writes.',
+                             'counter', [((), maintenance.backup_restarts)])
+    yield from sample_family('mspscammers_archived_reports_total', 'Reports moved to the archive.', 'counter',
+                             [((), maintenance.archived)])
+    yield from sample_family('mspscammers_vacuumed_pages_total', 'Free pages returned by incremental vacuum.',
+                             'counter', [((), maintenance.vacuumed_pages)])
+
+
+async def run_once(backup: bool, archive_after_days: float, vacuum: bool, enable_vacuum: bool) -> None:
+    await database.open_databases()
+    try:
+        await database.create_ban_database()
+        await database.create_report_database()
+        await database.create_user_database()
+        await database.migrate_databases()
+        if enable_vacuum:
+            for pool in _maintained_pools():
+                await enable_incremental_vacuum(pool)
+                print(f"{os.path.basename(pool.path)}: incremental auto-vacuum enabled")
+            return
+        if backup and not settings.BACKUP_DIR:
+            raise SystemExit("Set MSPSCAMMERS_BACKUP_DIR to take backups")
+        await maintenance.run(backup=backup, archive_after_days=archive_after_days, vacuum=vacuum)
+        print(f"backups: {maintenance.backups} ({maintenance.backup_restarts} restarts), "
+              f"reports archived: {maintenance.archived}, pages vacuumed: {maintenance.vacuumed_pages}")
+    finally:
+        await archive_pool.close()
+        await database.close_databases()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run database maintenance once.")
+    parser.add_argument('--backup', action='store_true', help="take a backup into MSPSCAMMERS_BACKUP_DIR")
+    parser.add_argument('--archive', action='store_true', help="archive old reports")
+    parser.add_argument('--older-than-days', type=float, default=settings.ARCHIVE_AFTER_DAYS,
+                        help="age of the reports to archive (default MSPSCAMMERS_ARCHIVE_AFTER_DAYS)")
+    parser.add_argument('--vacuum', action='store_true', help="run incremental vacuum, ANALYZE and a WAL checkpoint")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="switch existing files to incremental auto-vacuum (rewrites them; stop the API first)")
+    args = parser.parse_args()
+    run_all = not (args.backup or args.archive or args.vacuum)
+    asyncio.run(run_once(
+        args.backup or (run_all and bool(settings.BACKUP_DIR)),
+        args.older_than_days if args.archive or run_all else 0, args.vacuum or run_all,
+        args.enable_incremental_vacuum,
+    ))
+
+
+if __name__ == '__main__':
+    main()
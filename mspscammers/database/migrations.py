@@ -0,0 +1,238 @@
+from typing import Dict, List, Tuple
+
+from mspscammers.database.pool import ConnectionPool
+
+# Each database keeps an ordered list of migrations, each migration being a
+# tuple of statements applied in a single transaction. Append new entries to
+# the end of a list; never edit or reorder migrations that have shipped.
+MIGRATIONS: Dict[str, List[Tuple[str, ...]]] = {
+    'users': [
+        (
+            'CREATE INDEX IF NOT EXISTS idx_users_auth_token ON users (auth_token, ip_address)',
+            'CREATE INDEX IF NOT EXISTS idx_users_discord_username ON users (discord_username)',
+            'CREATE INDEX IF NOT EXISTS idx_users_ip_address ON users (ip_address)',
+        ),
+        (
+            # Usernames become unique. Rather than dropping accounts, every
+            # duplicate but the first registered gets its user ID appended.
+            '''
+            UPDATE users
+            SET discord_username = discord_username || '#' || discord_user_id
+            WHERE discord_username IS NOT NULL AND rowid NOT IN (
+                SELECT MIN(rowid)
+                FROM users
+                WHERE discord_username IS NOT NULL
+                GROUP BY discord_username
+            )
+            ''',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_discord_username_unique ON users (discord_username)',
+            'DROP INDEX IF EXISTS idx_users_discord_username',
+        ),
+        (
+            # Registration time, used to weigh reports by account age.
+            # Accounts registered before this stay NULL and count fully.
+            'ALTER TABLE users ADD COLUMN created_at DATETIME',
+        ),
+    ],
+    'reports': [
+        (
+            # Keep only the first report per reporter and scammer so the
+            # unique index below can be created on existing data.
+            '''
+            DELETE FROM reports
+            WHERE id NOT IN (
+                SELECT MIN(id)
+                FROM reports
+                GROUP BY discord_user_id, scammer_id
+            )
+            ''',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_reports_reporter_scammer ON reports (discord_user_id, scammer_id)',
+            'CREATE INDEX IF NOT EXISTS idx_reports_scammer_id ON reports (scammer_id)',
+            'CREATE INDEX IF NOT EXISTS idx_reports_created_at ON reports (created_at)',
+        ),
+        (
+            '''
+            CREATE TABLE IF NOT EXISTS scammer_report_counts (
+                scammer_id TEXT PRIMARY KEY,
+                reports_count INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+            ''',
+            '''
+            INSERT INTO scammer_report_counts (scammer_id, reports_count)
+            SELECT scammer_id, COUNT(*)
+            FROM reports
+            WHERE scammer_id IS NOT NULL
+            GROUP BY scammer_id
+            ''',
+        ),
+        (
+            '''
+            CREATE TABLE IF NOT EXISTS scammer_stats (
+                scammer_id TEXT PRIMARY KEY,
+                reports_count INTEGER NOT NULL DEFAULT 0,
+                distinct_reporters INTEGER NOT NULL DEFAULT 0,
+                distinct_ips INTEGER NOT NULL DEFAULT 0,
+                first_report_at DATETIME,
+                last_report_at DATETIME
+            ) WITHOUT ROWID
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_reports_scammer_ip ON reports (scammer_id, ip_address)',
+            '''
+            INSERT INTO scammer_stats (
+                scammer_id, reports_count, distinct_reporters, distinct_ips, first_report_at, last_report_at
+            )
+            SELECT scammer_id, COUNT(*), COUNT(DISTINCT discord_user_id), COUNT(DISTINCT ip_address),
+                   MIN(created_at), MAX(created_at)
+            FROM reports
+            WHERE scammer_id IS NOT NULL
+            GROUP BY scammer_id
+            ''',
+            'DROP TABLE IF EXISTS scammer_report_counts',
+        ),
+        (
+            # Reputation: each report's weight is fixed when it is written and
+            # scammer_stats keeps the decayed sum as of score_at. Existing
+            # reports are weighed by the recompute run at startup.
+            'ALTER TABLE reports ADD COLUMN weight REAL',
+            'ALTER TABLE scammer_stats ADD COLUMN score REAL NOT NULL DEFAULT 0',
+            'ALTER TABLE scammer_stats ADD COLUMN score_at REAL NOT NULL DEFAULT 0',
+            'CREATE INDEX IF NOT EXISTS idx_reports_weight_missing ON reports (id) WHERE weight IS NULL',
+        ),
+        (
+            # Brigading detection: the MinHash signature of the description
+            # and the earlier report a flagged one was coordinated with.
+            'ALTER TABLE reports ADD COLUMN signature BLOB',
+            'ALTER TABLE reports ADD COLUMN duplicate_of INTEGER',
+            'CREATE INDEX IF NOT EXISTS idx_reports_signature_missing ON reports (id) WHERE signature IS NULL',
+        ),
+        (
+            # Archival: reports moved to reports-archive.db still count in
+            # reports_count, and their decayed contribution to the score is
+            # kept here so a recompute does not lose it.
+            'ALTER TABLE scammer_stats ADD COLUMN archived_reports INTEGER NOT NULL DEFAULT 0',
+            'ALTER TABLE scammer_stats ADD COLUMN archived_score REAL NOT NULL DEFAULT 0',
+            'ALTER TABLE scammer_stats ADD COLUMN archived_score_at REAL NOT NULL DEFAULT 0',
+        ),
+        (
+            # Report counts per reporter and per scammer and IP address, kept
+            # as reports are written, so weighing a new report takes two key
+            # lookups instead of counting earlier reports.
+            '''
+            CREATE TABLE IF NOT EXISTS reporter_stats (
+                discord_user_id TEXT PRIMARY KEY,
+                reports_count INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+            ''',
+            '''
+            INSERT INTO reporter_stats (discord_user_id, reports_count)
+            SELECT discord_user_id, COUNT(*)
+            FROM reports
+            WHERE discord_user_id IS NOT NULL
+            GROUP BY discord_user_id
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS scammer_ip_stats (
+                scammer_id TEXT NOT NULL,
+                ip_address TEXT NOT NULL,
+                reports_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (scammer_id, ip_address)
+            ) WITHOUT ROWID
+            ''',
+            '''
+            INSERT INTO scammer_ip_stats (scammer_id, ip_address, reports_count)
+            SELECT scammer_id, ip_address, COUNT(*)
+            FROM reports
+            WHERE scammer_id IS NOT NULL AND ip_address IS NOT NULL
+            GROUP BY scammer_id, ip_address
+            ''',
+        ),
+        (
+            # Every (reporter, scammer) pair ever reported. Reports move to the
+            # archive but their key stays, so a reporter still cannot report
+            # the same scammer twice.
+            '''
+            CREATE TABLE IF NOT EXISTS report_keys (
+                discord_user_id TEXT NOT NULL,
+                scammer_id TEXT NOT NULL,
+                PRIMARY KEY (discord_user_id, scammer_id)
+            ) WITHOUT ROWID
+            ''',
+            '''
+            INSERT OR IGNORE INTO report_keys (discord_user_id, scammer_id)
+            SELECT discord_user_id, scammer_id
+            FROM reports
+            WHERE discord_user_id IS NOT NULL AND scammer_id IS NOT NULL
+            ''',
+        ),
+    ],
+    'bans': [
+        (
+            '''
+            CREATE TABLE IF NOT EXISTS token_revocations (
+                discord_user_id TEXT PRIMARY KEY,
+                revoked_before INTEGER NOT NULL
+            ) WITHOUT ROWID
+            ''',
+        ),
+    ],
+}
+
+
+async def get_schema_version(pool: ConnectionPool, name: str) -> int:
+    """
+    Returns the number of migrations applied to the named database.
+
+    Args:
+        pool (ConnectionPool): The pool of the database file.
+        name (str): The logical database name, a key of `MIGRATIONS`.
+
+    Returns:
+        int: The applied schema version, 0 for a fresh database.
+    """
+    async with pool.writer() as db:
+        async with db.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        '''):
+            pass
+        async with db.execute('''
+            SELECT version
+            FROM schema_migrations
+            WHERE name = ?
+        ''', (name,)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else 0
+
+
+async def run_migrations(pool: ConnectionPool, name: str) -> int:
+    """
+    Applies every pending migration of the named database, one transaction
+    per migration, recording the new version alongside the changes.
+
+    Versions are tracked per logical database rather than with
+    `PRAGMA user_version`, so several logical databases can share a file.
+
+    Args:
+        pool (ConnectionPool): The pool of the database file.
+        name (str): The logical database name, a key of `MIGRATIONS`.
+
+    Returns:
+        int: The schema version after migrating.
+    """
+    version = await get_schema_version(pool, name)
+    migrations = MIGRATIONS[name]
+    for target, statements in enumerate(migrations[version:], start=version + 1):
+        async with pool.writer() as db:
+            await db.execute('BEGIN IMMEDIATE')
+            for statement in statements:
+                await db.execute(statement)
+            await db.execute('''
+                INSERT INTO schema_migrations (name, version)
+                VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET version = excluded.version
+            ''', (name, target))
+            await db.commit()
+        version = target
+    return version
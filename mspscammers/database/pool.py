@@ -0,0 +1,150 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+import aiosqlite
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA busy_timeout = 5000",
+    # Checkpointed WAL files are truncated back to this size instead of
+    # staying as large as the biggest burst of writes.
+    "PRAGMA journal_size_limit = 67108864",
+)
+
+# Only takes effect on a new database file; existing files are converted by
+# `python -m mspscammers.database.maintenance --enable-incremental-vacuum`.
+WRITER_PRAGMAS = (
+    "PRAGMA auto_vacuum = INCREMENTAL",
+)
+
+
+class ConnectionPool:
+    """
+    A long-lived set of aiosqlite connections to a single database file.
+
+    Writes go through one writer connection guarded by a lock, reads are
+    spread over a queue of read-only connections. Statements are reused
+    through sqlite3's per-connection statement cache.
+    """
+
+    def __init__(self, path: str, readers: int = 4, cached_statements: int = 256,
+                 attach: Optional[Dict[str, str]] = None,
+                 functions: Optional[Dict[str, Tuple[int, Callable[..., Any]]]] = None):
+        """
+        Initializes the ConnectionPool. No connection is opened until
+        `open` is called or the pool is first used.
+
+        Args:
+            path (str): The path of the SQLite database file.
+            readers (int): The number of read-only connections to keep open.
+            cached_statements (int): The size of each connection's prepared statement cache.
+            attach (Optional[Dict[str, str]]): Other database files, by schema name, attached
+                to the reader connections so queries can join across files.
+            functions (Optional[Dict[str, Tuple[int, Callable]]]): Python functions, by SQL name,
+                registered on every connection as (number of arguments, function).
+        """
+        self.path = path
+        self.attach = attach or {}
+        self.functions = functions or {}
+        self.readers = readers
+        self.cached_statements = cached_statements
+        self.connections_opened = 0
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    @property
+    def idle_readers(self) -> int:
+        return self._readers.qsize()
+
+    async def _connect(self, readonly: bool) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.path, cached_statements=self.cached_statements)
+        self.connections_opened += 1
+        for name, (num_params, function) in self.functions.items():
+            await db.create_function(name, num_params, function, deterministic=True)
+        if not readonly:
+            # auto_vacuum has to be set before journal_mode writes the header.
+            for pragma in WRITER_PRAGMAS:
+                async with db.execute(pragma):
+                    pass
+        for pragma in PRAGMAS:
+            async with db.execute(pragma):
+                pass
+        if readonly:
+            for name, path in self.attach.items():
+                async with db.execute("ATTACH DATABASE ? AS " + name, (path,)):
+                    pass
+            async with db.execute("PRAGMA query_only = 1"):
+                pass
+        return db
+
+    async def open(self) -> None:
+        """
+        Opens the writer and reader connections. Safe to call more than once.
+        """
+        if self._writer is not None:
+            return
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # The writer is opened first so the file is already in WAL mode
+            # by the time the read-only connections attach to it.
+            writer = await self._connect(readonly=False)
+            for _ in range(self.readers):
+                self._readers.put_nowait(await self._connect(readonly=True))
+            self._writer = writer
+
+    async def close(self) -> None:
+        """
+        Waits for in-flight queries to finish and closes every connection.
+        """
+        if self._writer is None:
+            return
+        async with self._write_lock:
+            for _ in range(self.readers):
+                db = await self._readers.get()
+                await db.close()
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Borrows a read-only connection for the duration of the block.
+        """
+        await self.open()
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Holds the writer connection exclusively for the duration of the block.
+        A transaction left open by a failing block is rolled back so the
+        shared connection is clean for the next caller.
+        """
+        await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+                raise
@@ -0,0 +1,131 @@
+import asyncio
+import random
+from typing import Any, Dict, Optional
+
+import httpx
+
+from mspscammers import settings
+
+
+class DiscordError(Exception):
+    """
+    Raised when Discord rejects a request or cannot be reached.
+
+    Args:
+        message (str): What went wrong.
+        status (int): The HTTP status Discord answered with, 0 if it was not reached.
+    """
+
+    def __init__(self, message: str, status: int = 0):
+        super().__init__(message)
+        self.status = status
+
+
+class DiscordClient:
+    """
+    The OAuth2 calls the API makes to Discord.
+
+    Every call goes through one long-lived httpx.AsyncClient, so connections
+    and their TLS sessions are kept alive and reused across logins. Network
+    errors, rate limits and server errors are retried with exponential
+    backoff and jitter.
+    """
+
+    def __init__(self, api_url: str, client_id: str, client_secret: str, redirect_uri: str,
+                 timeout: float = 5.0, retries: int = 3, backoff: float = 0.25):
+        """
+        Initializes the DiscordClient. The HTTP client is created by `start`.
+
+        Args:
+            api_url (str): The base URL of the Discord API.
+            client_id (str): The OAuth2 application ID.
+            client_secret (str): The OAuth2 application secret.
+            redirect_uri (str): The redirect URI the authorization code was issued for.
+            timeout (float): Seconds allowed for each attempt.
+            retries (int): Attempts after the first before giving up.
+            backoff (float): Seconds before the first retry, doubled for each one after.
+        """
+        self.api_url = api_url.rstrip('/')
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+                headers={'user-agent': 'MSP-Scammers-API'},
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    def _delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        if response is not None and response.status_code == 429:
+            retry_after = response.headers.get('retry-after')
+            try:
+                return min(float(retry_after), 10.0)
+            except (TypeError, ValueError):
+                pass
+        return self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def _request(self, method: str, path: str, **kwargs: Any) -> Dict[str, Any]:
+        self.start()
+        response = None
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self._client.request(method, path, **kwargs)
+            except httpx.TransportError as error:
+                response = None
+                if attempt == self.retries:
+                    raise DiscordError(f"Discord could not be reached: {error!r}")
+            else:
+                if response.status_code < 400:
+                    return response.json()
+                if response.status_code != 429 and response.status_code < 500:
+                    raise DiscordError(f"Discord answered {response.status_code}", response.status_code)
+                if attempt == self.retries:
+                    raise DiscordError(f"Discord answered {response.status_code}", response.status_code)
+            await asyncio.sleep(self._delay(attempt, response))
+
+    async def exchange_code(self, code: str) -> str:
+        """
+        Exchanges an authorization code for an access token.
+        """
+        data = await self._request('POST', '/oauth2/token', data={
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': self.redirect_uri,
+        })
+        if 'access_token' not in data:
+            raise DiscordError("Discord did not return an access token", 502)
+        return data['access_token']
+
+    async def get_user(self, access_token: str) -> Dict[str, Any]:
+        """
+        Returns the Discord user the access token belongs to.
+        """
+        # Every login brings a fresh access token, so there is nothing to cache here.
+        return await self._request('GET', '/users/@me', headers={'authorization': f'Bearer {access_token}'})
+
+
+def avatar_url(user: Dict[str, Any]) -> str:
+    if user.get('avatar'):
+        return f"https://cdn.discordapp.com/avatars/{user['id']}/{user['avatar']}.png"
+    return f"https://cdn.discordapp.com/embed/avatars/{(int(user['id']) >> 22) % 6}.png"
+
+
+discord_client = DiscordClient(
+    settings.DISCORD_API_URL, settings.DISCORD_CLIENT_ID, settings.DISCORD_CLIENT_SECRET,
+    settings.DISCORD_REDIRECT_URI, timeout=settings.DISCORD_TIMEOUT, retries=settings.DISCORD_RETRIES,
+)
@@ -0,0 +1,129 @@
+"""
+The live report feed.
+
+Committed reports, bans and unbans are published once to `report_feed`,
+encoded once, and fanned out to every subscriber's bounded queue. A
+subscriber that lets its queue fill up is dropped rather than slowing the
+publisher down; it reconnects with the ID of the last report it saw and the
+reports it missed are replayed from the reports table before it goes live
+again. Ban events are delivered live only.
+"""
+import asyncio
+from typing import Any, Dict, Iterable, Optional, Set
+
+from mspscammers import settings
+from mspscammers.cache import LOCAL_EVENTS, publish_event
+from mspscammers.metrics import register_collector, sample_family
+from mspscammers.responses import dumps
+
+
+class FeedEvent:
+    """
+    One event, encoded once for every subscriber.
+
+    Args:
+        type (str): 'report', 'ban' or 'unban'.
+        data (Dict[str, Any]): The report row or the ban.
+    """
+
+    __slots__ = ('id', 'type', 'scammer_id', 'payload')
+
+    def __init__(self, type: str, data: Dict[str, Any]):
+        self.type = type
+        self.id = data['id'] if type == 'report' else None
+        self.scammer_id = data.get('scammer_id')
+        self.payload = dumps({'type': type, 'data': data}).decode('utf-8')
+
+    def sse(self) -> bytes:
+        event_id = f'id: {self.id}\n' if self.id is not None else ''
+        return f'{event_id}event: {self.type}\ndata: {self.payload}\n\n'.encode('utf-8')
+
+
+class Subscription:
+    """
+    A subscriber's bounded queue of events, optionally limited to reports
+    against some scammers.
+    """
+
+    def __init__(self, scammer_ids: Optional[Set[str]], maxsize: int):
+        self.scammer_ids = scammer_ids
+        self.queue: "asyncio.Queue[FeedEvent]" = asyncio.Queue(maxsize)
+        self.dropped = False
+
+    def wants(self, event: FeedEvent) -> bool:
+        return event.type != 'report' or self.scammer_ids is None or event.scammer_id in self.scammer_ids
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[FeedEvent]:
+        """
+        Returns the next event, or None once `timeout` passes without one.
+        A dropped subscription still returns what it had queued.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class ReportFeed:
+    """
+    The in-process broadcast hub every subscriber of this worker reads from.
+    """
+
+    def __init__(self, max_queue: int):
+        self.max_queue = max_queue
+        self.published = 0
+        self.dropped = 0
+        self._subscribers: Set[Subscription] = set()
+
+    def subscribe(self, scammer_ids: Optional[Iterable[str]] = None) -> Subscription:
+        subscription = Subscription(set(scammer_ids) if scammer_ids else None, self.max_queue)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscribers.discard(subscription)
+
+    def publish(self, event: FeedEvent) -> None:
+        self.published += 1
+        for subscription in list(self._subscribers):
+            if not subscription.wants(event):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # The subscriber keeps what it has queued and is told to
+                # reconnect; missed reports are replayed from the table.
+                subscription.dropped = True
+                self._subscribers.discard(subscription)
+                self.dropped += 1
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+
+report_feed = ReportFeed(max_queue=settings.FEED_QUEUE_SIZE)
+
+
+def _apply_feed_event(type: str, data: Dict[str, Any]) -> None:
+    report_feed.publish(FeedEvent(type, data))
+
+
+LOCAL_EVENTS['feed'] = _apply_feed_event
+
+
+def record_feed_event(type: str, data: Dict[str, Any]) -> None:
+    """
+    Publishes a committed report or ban to the subscribers of this worker
+    and, through the shared cache tier when it is running, of every other worker.
+    """
+    publish_event('feed', type, data)
+
+
+@register_collector
+def _feed_metrics():
+    yield from sample_family('mspscammers_feed_subscribers', 'Connected report feed subscribers.', 'gauge',
+                             [((), len(report_feed))])
+    yield from sample_family('mspscammers_feed_events_total', 'Events published to the report feed.', 'counter',
+                             [((), report_feed.published)])
+    yield from sample_family('mspscammers_feed_dropped_total', 'Subscribers dropped for falling behind.', 'counter',
+                             [((), report_feed.dropped)])
@@ -1,7 +1,32 @@
 import hashlib
+import hmac
 import functools
+from typing import Iterable, List, Union
 
-def create_sha256_hash(input_string: str) -> str:
+HashInput = Union[str, List[str]]
+
+@functools.singledispatch
+def to_bytes(input_string) -> bytes:
+    """
+    Encode the input of a hash function to bytes.
+
+    Parameters:
+    input_string (str or list of str): The input string or list of strings to encode.
+
+    Returns:
+    bytes: The UTF-8 encoding of the input, with the strings of a list concatenated.
+    """
+    raise TypeError(f"Cannot hash a value of type {type(input_string).__name__}")
+
+@to_bytes.register
+def _(input_string: str) -> bytes:
+    return input_string.encode('utf-8')
+
+@to_bytes.register
+def _(input_strings: list) -> bytes:
+    return b''.join(input_string.encode('utf-8') for input_string in input_strings)
+
+def create_sha256_hash(input_string: HashInput) -> str:
     """
     Create a SHA-256 hash for the given input string or list of strings.
 
@@ -13,41 +38,76 @@ def create_sha256_hash(input_string: str) -> str:
 
     Usage:
     >>> create_sha256_hash("example")
-    'eccbc87e4b5ce2fe28308fd9f2a7baf36e752668'
+    '50d858e0985ecc7f60418aaf0cc5ab587f42c2570a884095a9e8ccacd0f6545c'
 
     >>> create_sha256_hash(["example1", "example2"])
-    'c0e889cb0b2788ebb77b92c8e0e86a2026c07454'
+    '61582c7a77310473fb51ae98809281d12b852b2a6c764bb440a88bbb2eee01f4'
+    """
+    return hashlib.sha256(to_bytes(input_string)).hexdigest()
+
+def create_sha256_hashes(input_strings: Iterable[HashInput]) -> List[str]:
+    """
+    Create SHA-256 hashes for many inputs at once.
+
+    Parameters:
+    input_strings (iterable of str or list of str): The inputs to hash.
+
+    Returns:
+    list of str: The SHA-256 hash of each input, in order.
+    """
+    sha256 = hashlib.sha256
+    # Strings, the common case, skip the dispatcher.
+    return [
+        sha256(input_string.encode('utf-8') if type(input_string) is str else to_bytes(input_string)).hexdigest()
+        for input_string in input_strings
+    ]
+
+def create_hmac_sha256(input_string: HashInput, key: bytes) -> str:
     """
+    Create a keyed HMAC-SHA-256 for the given input string or list of strings.
+
+    Unlike a bare hash, the result can only be produced, and so only be
+    verified, by someone holding the key.
 
-    @functools.singledispatch
-    def hash_string(input_string: str) -> str:
-        """
-        Create a SHA-256 hash for the given input string.
+    Parameters:
+    input_string (str or list of str): The input string or list of strings to sign.
+    key (bytes): The secret key.
+
+    Returns:
+    str: The hex encoded HMAC of the input.
+    """
+    return hmac.new(key, to_bytes(input_string), hashlib.sha256).hexdigest()
 
-        Parameters:
-        input_string (str): The input string to hash.
+def create_hmac_sha256_hashes(input_strings: Iterable[HashInput], key: bytes) -> List[str]:
+    """
+    Create keyed HMAC-SHA-256s for many inputs at once. The key is processed
+    once and the keyed state copied for each input.
 
-        Returns:
-        str: The SHA-256 hash of the input string.
-        """
-        sha256_hash = hashlib.sha256()
-        sha256_hash.update(input_string.encode('utf-8'))
-        return sha256_hash.hexdigest()
+    Parameters:
+    input_strings (iterable of str or list of str): The inputs to sign.
+    key (bytes): The secret key.
 
-    @hash_string.register
-    def _(input_strings: list) -> str:
-        """
-        Create a SHA-256 hash for the given list of strings.
+    Returns:
+    list of str: The hex encoded HMAC of each input, in order.
+    """
+    keyed = hmac.new(key, digestmod=hashlib.sha256)
+    hashes = []
+    for input_string in input_strings:
+        mac = keyed.copy()
+        mac.update(input_string.encode('utf-8') if type(input_string) is str else to_bytes(input_string))
+        hashes.append(mac.hexdigest())
+    return hashes
 
-        Parameters:
-        input_strings (list of str): The list of input strings to hash.
+def verify_hmac_sha256(input_string: HashInput, key: bytes, expected: str) -> bool:
+    """
+    Check an HMAC by recomputing it, in constant time.
 
-        Returns:
-        str: The SHA-256 hash of the concatenated input strings.
-        """
-        sha256_hash = hashlib.sha256()
-        for input_string in input_strings:
-            sha256_hash.update(input_string.encode('utf-8'))
-        return sha256_hash.hexdigest()
+    Parameters:
+    input_string (str or list of str): The signed input.
+    key (bytes): The secret key.
+    expected (str): The hex encoded HMAC to check.
 
-    return hash_string(input_string)
+    Returns:
+    bool: Whether `expected` is the HMAC of the input under the key.
+    """
+    return hmac.compare_digest(create_hmac_sha256(input_string, key), expected)
@@ -0,0 +1,143 @@
+import hashlib
+import math
+from typing import Iterable, List, Set, Tuple
+
+from mspscammers.cache import LOCAL_EVENTS, publish_event
+from mspscammers.metrics import register_collector, sample_family
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter over strings. Membership tests can return false
+    positives, at about `error_rate` once `capacity` keys are added, but
+    never false negatives.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+        Initializes the BloomFilter.
+
+        Args:
+            capacity (int): The number of keys the filter is sized for.
+            error_rate (float): The false positive rate at capacity.
+        """
+        capacity = max(capacity, 1024)
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        for index in range(self.hashes):
+            yield (first + index * second) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class MembershipIndex:
+    """
+    Answers "might this key be registered?" without touching the database.
+
+    Keys loaded at startup live in a Bloom filter, a few bits each. Keys
+    added since are kept exactly in a set until there are `fold_at` of them,
+    then moved into a new filter of their own, so the index keeps its error
+    rate as it grows. A negative answer is definite for everything this
+    worker has loaded or been told about, so only possible hits need a
+    database read; the unique constraints catch the rest.
+    """
+
+    def __init__(self, name: str, error_rate: float = 0.01, fold_at: int = 10000):
+        """
+        Initializes the MembershipIndex.
+
+        Args:
+            name (str): The name the index is reported under.
+            error_rate (float): The false positive rate of each Bloom filter.
+            fold_at (int): The number of recent keys kept exactly before they are moved into a filter.
+        """
+        self.name = name
+        self.error_rate = error_rate
+        self.fold_at = fold_at
+        self.loaded = False
+        self._filters: List[BloomFilter] = []
+        self._recent: Set[str] = set()
+
+    def load(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        bloom = BloomFilter(len(keys), self.error_rate)
+        for key in keys:
+            bloom.add(key)
+        self._filters = [bloom]
+        self._recent = set()
+        self.loaded = True
+
+    def add(self, key: str) -> None:
+        self._recent.add(key)
+        if len(self._recent) >= self.fold_at:
+            bloom = BloomFilter(len(self._recent), self.error_rate)
+            for recent in self._recent:
+                bloom.add(recent)
+            self._filters.append(bloom)
+            self._recent = set()
+
+    def might_contain(self, key: str) -> bool:
+        """
+        Returns False only for keys certainly not registered, as far as this
+        worker knows; True means the database has to be asked. Before the
+        index is loaded every key is a possible hit.
+        """
+        if not self.loaded or key in self._recent:
+            return True
+        return any(key in bloom for bloom in self._filters)
+
+    def __len__(self) -> int:
+        return sum(bloom.count for bloom in self._filters) + len(self._recent)
+
+    @property
+    def memory(self) -> int:
+        return sum(len(bloom._bits) for bloom in self._filters)
+
+
+usernames_index = MembershipIndex('usernames')
+user_ids_index = MembershipIndex('user_ids')
+
+
+def load_registrations(users: Iterable[Tuple[str, str]]) -> None:
+    users = list(users)
+    user_ids_index.load(discord_user_id for discord_user_id, _ in users)
+    usernames_index.load(discord_username for _, discord_username in users if discord_username is not None)
+
+
+def _apply_registration(discord_user_id: str, discord_username: str) -> None:
+    user_ids_index.add(discord_user_id)
+    usernames_index.add(discord_username)
+
+
+LOCAL_EVENTS['registered'] = _apply_registration
+
+
+def record_registration(discord_user_id: str, discord_username: str) -> None:
+    """
+    Adds a newly written user to the indexes in this worker and, through the
+    shared cache tier when it is running, in every other worker.
+    """
+    publish_event('registered', discord_user_id, discord_username)
+
+
+@register_collector
+def _membership_metrics():
+    indexes = (usernames_index, user_ids_index)
+    yield from sample_family('mspscammers_membership_keys', 'Keys in the registration indexes.', 'gauge',
+                             (((('index', index.name),), len(index)) for index in indexes))
+    yield from sample_family('mspscammers_membership_filter_bytes', 'Memory used by the Bloom filters.', 'gauge',
+                             (((('index', index.name),), index.memory) for index in indexes))
@@ -0,0 +1,186 @@
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from mspscammers import settings
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+slow_query_log = logging.getLogger('mspscammers.slow_queries')
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+class Histogram:
+    """
+    A fixed-bucket latency histogram. Observing a value is one bisect and
+    three additions; the cumulative bucket counts Prometheus expects are
+    only computed when the metrics are scraped.
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: Labels) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield f"{name}_bucket{format_labels(labels + (('le', repr(bound)),))} {cumulative}"
+        yield f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {self.count}"
+        yield f"{name}_sum{format_labels(labels)} {self.sum}"
+        yield f"{name}_count{format_labels(labels)} {self.count}"
+
+
+class HistogramFamily:
+    """
+    Histograms sharing a metric name, one per set of label values.
+    """
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._histograms: Dict[Tuple[str, ...], Histogram] = {}
+
+    def labels(self, *values: str) -> Histogram:
+        histogram = self._histograms.get(values)
+        if histogram is None:
+            histogram = self._histograms[values] = Histogram()
+        return histogram
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for values, histogram in sorted(self._histograms.items()):
+            yield from histogram.render(self.name, tuple(zip(self.label_names, values)))
+
+
+class CounterFamily:
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.values: Dict[Tuple[str, ...], int] = {}
+
+    def inc(self, *values: str) -> None:
+        self.values[values] = self.values.get(values, 0) + 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for values, count in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(tuple(zip(self.label_names, values)))} {count}"
+
+
+def sample_family(name: str, help: str, type: str, samples: Iterable[Tuple[Labels, Any]]) -> Iterable[str]:
+    """
+    Renders a gauge or counter whose values are read from elsewhere at scrape time.
+    """
+    yield f"# HELP {name} {help}"
+    yield f"# TYPE {name} {type}"
+    for labels, value in samples:
+        yield f"{name}{format_labels(labels)} {value}"
+
+
+query_latency = HistogramFamily(
+    'mspscammers_query_duration_seconds', 'Time spent in database functions.', ('query',)
+)
+request_latency = HistogramFamily(
+    'mspscammers_request_duration_seconds', 'Time spent in route handlers.', ('handler',)
+)
+responses = CounterFamily(
+    'mspscammers_responses_total', 'Responses sent by route handlers, by status code.', ('handler', 'status')
+)
+
+collectors: List[Callable[[], Iterable[str]]] = []
+
+
+def register_collector(collector: Callable[[], Iterable[str]]) -> Callable[[], Iterable[str]]:
+    """
+    Registers a function yielding metric lines, called on every scrape.
+    Modules register their own so this one depends on none of them.
+    """
+    collectors.append(collector)
+    return collector
+
+
+def render() -> str:
+    lines: List[str] = []
+    for family in (query_latency, request_latency, responses):
+        lines.extend(family.render())
+    for collector in collectors:
+        lines.extend(collector())
+    return '\n'.join(lines) + '\n'
+
+
+def timed_query(function: Callable[..., Awaitable[Any]], name: Optional[str] = None) -> Callable[..., Awaitable[Any]]:
+    name = name or function.__name__
+    histogram = query_latency.labels(name)
+
+    @functools.wraps(function)
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            histogram.observe(elapsed)
+            if settings.SLOW_QUERY_MS and elapsed * 1000 >= settings.SLOW_QUERY_MS:
+                slow_query_log.warning("%s took %.1f ms", name, elapsed * 1000)
+    return timed
+
+
+def instrument_queries(namespace: Dict[str, Any], module_name: str) -> None:
+    """
+    Replaces every public coroutine function defined in a module with a
+    timed one. Called at the bottom of the module, before anything imports
+    the functions by name.
+    """
+    for name, function in list(namespace.items()):
+        if not name.startswith('_') and inspect.iscoroutinefunction(function) and function.__module__ == module_name:
+            namespace[name] = timed_query(function)
+
+
+def timed_route(handler: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Records the latency and response status of a route handler.
+    """
+    name = handler.__name__
+    histogram = request_latency.labels(name)
+
+    @functools.wraps(handler)
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        status = '500'
+        try:
+            response = await handler(*args, **kwargs)
+            status = str(response.status)
+            return response
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            responses.inc(name, status)
+    return timed
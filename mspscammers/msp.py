@@ -0,0 +1,229 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+import httpx
+import pyamf
+from pyamf import remoting
+
+from mspscammers import settings
+from mspscammers.cache import MISSING, TTLCache, register_cache
+from mspscammers.metrics import register_collector, sample_family
+
+logger = logging.getLogger('mspscammers.msp')
+
+# casefolded username -> MSP player ID, or None for a name with no player
+players = register_cache(TTLCache(
+    'msp_players', maxsize=settings.CACHE_MAXSIZE, ttl=settings.MSP_PROFILE_TTL, negative_ttl=settings.MSP_NEGATIVE_TTL
+))
+
+
+class MSPError(Exception):
+    """
+    Raised when the MSP gateway cannot be reached or answers with an error.
+    """
+
+
+def encode_lookups(method: str, usernames: List[str]) -> bytes:
+    """
+    Encodes one AMF3 remoting envelope calling `method` once per username,
+    the bodies targeted `/1`, `/2`, ... in order.
+    """
+    envelope = remoting.Envelope(amfVersion=pyamf.AMF3)
+    for index, username in enumerate(usernames, 1):
+        envelope[f'/{index}'] = remoting.Request(method, body=[username])
+    return remoting.encode(envelope).getvalue()
+
+
+def decode_lookups(data: bytes, count: int) -> List[Optional[int]]:
+    """
+    Decodes the gateway's answer to `encode_lookups` into one player ID per
+    username, None where the player does not exist.
+
+    Raises:
+        MSPError: If the envelope cannot be decoded or a call failed.
+    """
+    try:
+        envelope = remoting.decode(data)
+    except (pyamf.BaseError, EOFError, IOError) as error:
+        raise MSPError(f"Undecodable AMF response: {error!r}")
+    results: List[Optional[int]] = [None] * count
+    for target, message in envelope:
+        index = int(target.strip('/').split('/')[0]) - 1
+        if not 0 <= index < count:
+            continue
+        if message.status != remoting.STATUS_OK:
+            raise MSPError(f"MSP gateway call {target} failed: {message.body!r}")
+        body = message.body
+        # Unknown names come back as 0, -1 or null depending on the service.
+        results[index] = body if isinstance(body, int) and not isinstance(body, bool) and body > 0 else None
+    return results
+
+
+class ProfileResolver:
+    """
+    Resolves MSP usernames to player IDs through the AMF gateway.
+
+    Lookups are coalesced: concurrent calls for the same name share one
+    request, and the names requested within `batch_delay` of each other
+    travel together as the bodies of a single AMF envelope. At most
+    `concurrency` envelopes are in flight at once over one pooled
+    httpx.AsyncClient, and answers are kept in the `msp_players` cache.
+    """
+
+    def __init__(self, gateway_url: str, method: str, timeout: float = 5.0, concurrency: int = 8,
+                 batch_size: int = 50, batch_delay: float = 0.005):
+        """
+        Initializes the ProfileResolver. The HTTP client is created by `start`.
+
+        Args:
+            gateway_url (str): The AMF gateway URL; an empty string disables the resolver.
+            method (str): The remoting target that takes a username and returns a player ID.
+            timeout (float): Seconds allowed for each envelope.
+            concurrency (int): Envelopes allowed in flight at once.
+            batch_size (int): Usernames per envelope.
+            batch_delay (float): Seconds a lookup waits for others to share its envelope.
+        """
+        self.gateway_url = gateway_url
+        self.method = method
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.envelopes_sent = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[str, "asyncio.Future[Optional[int]]"] = {}
+        self._pending: List[str] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.gateway_url)
+
+    def start(self) -> None:
+        if self._client is None and self.enabled:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.concurrency, keepalive_expiry=60),
+                headers={'content-type': remoting.CONTENT_TYPE, 'user-agent': 'MSP-Scammers-API'},
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    @staticmethod
+    def _key(username: str) -> str:
+        return username.strip().casefold()
+
+    async def _send(self, usernames: List[str]) -> List[Optional[int]]:
+        self.start()
+        async with self._semaphore:
+            try:
+                response = await self._client.post(self.gateway_url, content=encode_lookups(self.method, usernames))
+            except httpx.HTTPError as error:
+                raise MSPError(f"MSP gateway could not be reached: {error!r}")
+            self.envelopes_sent += 1
+        if response.status_code != 200:
+            raise MSPError(f"MSP gateway answered {response.status_code}")
+        return decode_lookups(response.content, len(usernames))
+
+    async def _lookup(self, keys: List[str]) -> None:
+        try:
+            results = await self._send(keys)
+        except Exception as error:
+            if not isinstance(error, MSPError):
+                error = MSPError(f"MSP lookup failed: {error!r}")
+            for key in keys:
+                future = self._inflight.pop(key)
+                future.set_exception(error)
+                # Mark the exception as retrieved when nobody was waiting.
+                future.exception()
+            return
+        for key, player_id in zip(keys, results):
+            players.set(key, player_id)
+            self._inflight.pop(key).set_result(player_id)
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        pending, self._pending = self._pending, []
+        for start in range(0, len(pending), self.batch_size):
+            task = asyncio.ensure_future(self._lookup(pending[start:start + self.batch_size]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _enqueue(self, key: str) -> "asyncio.Future[Optional[int]]":
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._inflight[key] = loop.create_future()
+            self._pending.append(key)
+            if len(self._pending) >= self.batch_size:
+                if self._flush_handle is not None:
+                    self._flush_handle.cancel()
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_delay, self._flush)
+        return future
+
+    async def resolve(self, username: str) -> Optional[int]:
+        """
+        Returns the player ID of `username`, or None if no such player exists.
+
+        Raises:
+            MSPError: If the gateway could not answer.
+        """
+        key = self._key(username)
+        player_id = players.get(key)
+        if player_id is not MISSING:
+            return player_id
+        return await asyncio.shield(self._enqueue(key))
+
+    async def resolve_many(self, usernames: Iterable[str]) -> Dict[str, Optional[int]]:
+        """
+        Resolves many usernames at once, keyed by the names as given. Names
+        the gateway could not answer for are left out.
+        """
+        usernames = list(dict.fromkeys(usernames))
+        results = await asyncio.gather(*(self.resolve(username) for username in usernames), return_exceptions=True)
+        return {
+            username: result for username, result in zip(usernames, results)
+            if not isinstance(result, BaseException)
+        }
+
+
+msp_resolver = ProfileResolver(
+    settings.MSP_GATEWAY_URL, settings.MSP_RESOLVE_METHOD, timeout=settings.MSP_TIMEOUT,
+    concurrency=settings.MSP_CONCURRENCY, batch_size=settings.MSP_BATCH_SIZE, batch_delay=settings.MSP_BATCH_DELAY,
+)
+
+
+@register_collector
+def _msp_metrics():
+    yield from sample_family('mspscammers_msp_envelopes_total', 'AMF envelopes sent to the MSP gateway.', 'counter',
+                             [((), msp_resolver.envelopes_sent)])
+
+
+async def check_player(username: str, scammer_id: str) -> Optional[str]:
+    """
+    Checks a reported username against the reported player ID.
+
+    Returns:
+        Optional[str]: Why the report names no real player, or None if it does
+        or the gateway could not be asked, in which case the report is let through.
+    """
+    if not msp_resolver.enabled:
+        return None
+    try:
+        player_id = await msp_resolver.resolve(username)
+    except MSPError as error:
+        logger.warning("Could not check MSP player %r: %s", username, error)
+        return None
+    if player_id is None:
+        return f"No MSP player is named '{username}'"
+    if str(player_id) != scammer_id:
+        return f"'{username}' is not the MSP player {scammer_id}"
+    return None
@@ -0,0 +1,167 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from blacksheep import Request
+from mspscammers import settings
+from mspscammers.metrics import register_collector, sample_family
+from mspscammers.responses import RATE_LIMITED
+
+
+class TokenBuckets:
+    """
+    Token buckets for many clients sharing one limit.
+
+    Each client's bucket is two floats, its tokens and when they were last
+    counted, kept in least-recently-used order. A bucket left alone long
+    enough to refill completely is indistinguishable from a new one, so idle
+    buckets are evicted from the old end as new ones are touched; past
+    `max_buckets` the oldest are dropped regardless.
+    """
+
+    def __init__(self, requests: int, period: float, max_buckets: int = 100000):
+        """
+        Initializes the TokenBuckets.
+
+        Args:
+            requests (int): The burst size, refilled evenly over `period`.
+            period (float): The number of seconds it takes to refill an empty bucket.
+            max_buckets (int): The maximum number of clients tracked at once.
+        """
+        self.capacity = float(requests)
+        self.rate = requests / period
+        self.period = period
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[Hashable, List[float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: Hashable, now: Optional[float] = None) -> float:
+        """
+        Takes one token from the client's bucket.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise the number of seconds
+            until the bucket holds a token again.
+        """
+        wait = self.wait(key, now)
+        if not wait:
+            self.charge(key)
+        return wait
+
+    def wait(self, key: Hashable, now: Optional[float] = None) -> float:
+        """
+        Refills the client's bucket without taking a token from it.
+
+        Returns:
+            float: 0 if the bucket holds a token, otherwise the number of
+            seconds until it does.
+        """
+        if now is None:
+            now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._evict(now)
+            bucket = self._buckets[key] = [self.capacity, now]
+        else:
+            self._buckets.move_to_end(key)
+        bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return (1 - bucket[0]) / self.rate
+        return 0.0
+
+    def charge(self, key: Hashable) -> None:
+        """
+        Takes one token from a bucket `wait` has just found holding one.
+        """
+        self._buckets[key][0] -= 1
+
+    def _evict(self, now: float) -> None:
+        buckets = self._buckets
+        while buckets:
+            key = next(iter(buckets))
+            if len(buckets) < self.max_buckets and now - buckets[key][1] < self.period:
+                break
+            buckets.popitem(last=False)
+
+
+class RateLimit:
+    """
+    The per-IP and per-token buckets guarding one route.
+    """
+
+    def __init__(self, requests: int, period: float, max_buckets: int = 100000):
+        self.by_ip = TokenBuckets(requests, period, max_buckets)
+        self.by_token = TokenBuckets(requests, period, max_buckets)
+
+    def take(self, request: Request) -> float:
+        # Both buckets are checked before either is charged, so a request
+        # turned away by one does not use up the client's other allowance.
+        now = time.monotonic()
+        wait = self.by_ip.wait(request.client_ip, now)
+        auth_token = request.headers.get_first(b'authorization')
+        if auth_token:
+            wait = max(wait, self.by_token.wait(auth_token, now))
+        if not wait:
+            self.by_ip.charge(request.client_ip)
+            if auth_token:
+                self.by_token.charge(auth_token)
+        return wait
+
+
+def parse_limit(value: str) -> Tuple[int, float]:
+    """
+    Parses a `<requests>/<seconds>` limit.
+
+    Raises:
+        ValueError: If the limit is malformed or either number is not positive.
+    """
+    requests, _, period = value.partition('/')
+    try:
+        requests, period = int(requests), float(period or 1)
+    except ValueError:
+        raise ValueError(f"Rate limit {value!r} is not of the form <requests>/<seconds>")
+    if requests <= 0 or not period > 0:
+        raise ValueError(f"Rate limit {value!r} must allow at least one request over a positive number of seconds")
+    return requests, period
+
+
+def build_limits() -> Dict[Tuple[str, str], RateLimit]:
+    return {
+        (method, path): RateLimit(*parse_limit(limit), max_buckets=settings.RATE_LIMIT_MAX_BUCKETS)
+        for method, path, limit in (
+            ('POST', '/api/v1/reporting/report-user', settings.RATE_LIMIT_REPORTS),
+            ('POST', '/api/v1/registration/create', settings.RATE_LIMIT_REGISTRATION),
+        )
+    }
+
+
+limits = build_limits()
+
+
+@register_collector
+def _rate_limit_metrics():
+    samples = []
+    for (method, path), limit in limits.items():
+        samples.append(((('route', f'{method} {path}'), ('key', 'ip')), len(limit.by_ip)))
+        samples.append(((('route', f'{method} {path}'), ('key', 'token')), len(limit.by_token)))
+    yield from sample_family('mspscammers_rate_limit_buckets', 'Clients tracked by the rate limiter.', 'gauge', samples)
+
+
+async def rate_limit_middleware(request: Request, handler):
+    """
+    Answers 429 with a Retry-After header once a client runs out of tokens
+    for a limited route. Runs before any other middleware, so a rejected
+    request never reads its body or touches the database.
+    """
+    limit = limits.get((request.method, request.path))
+    if limit is not None:
+        wait = limit.take(request)
+        if wait:
+            response = RATE_LIMITED()
+            response.add_header(b'retry-after', str(math.ceil(wait)).encode('ascii'))
+            return response
+    return await handler(request)
@@ -0,0 +1,76 @@
+"""
+Scammer reputation scoring.
+
+A scammer's score is the sum of the weights of the reports against them,
+each decaying exponentially with the report's age. A report's weight is
+fixed when it is written:
+
+    weight = account_factor * history_factor / ip_rank
+
+- account_factor grows linearly from REPUTATION_NEW_ACCOUNT_WEIGHT for a
+  brand new reporter account to 1 once it is REPUTATION_NEW_ACCOUNT_DAYS old;
+  accounts registered before ages were recorded count fully.
+- history_factor is 1 / (1 + n / REPUTATION_HISTORY_SCALE) where n is the
+  number of reports the reporter had filed before this one.
+- ip_rank is 1 for the first reporter of a scammer from an IP address, 2 for
+  the second and so on, so reports from a shared address add up slowly.
+
+Reports by banned reporters count for nothing; banning and unbanning
+subtracts and adds back their contributions.
+
+Because decay is exponential, the sum can be kept as a single value `score`
+valid at time `score_at`: it is brought forward by multiplying with the decay
+over the elapsed time, so adding a report, applying a ban or reading the
+current score are all O(1) per scammer. The same functions are registered on
+the SQLite connections so the bulk recompute uses exactly the same formula.
+"""
+import math
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from mspscammers import settings
+
+SECONDS_PER_DAY = 86400.0
+
+
+def decay(seconds: float) -> float:
+    """
+    Returns the share of a report's weight left after `seconds`.
+    """
+    return math.pow(0.5, max(seconds, 0.0) / (settings.REPUTATION_HALF_LIFE_DAYS * SECONDS_PER_DAY))
+
+
+def report_weight(registered_at: Optional[float], reported_at: float, history: int, ip_rank: int) -> float:
+    """
+    Returns the weight of a report when it is written.
+
+    Args:
+        registered_at (Optional[float]): When the reporter registered, as a Unix timestamp; None if unknown.
+        reported_at (float): When the report was written, as a Unix timestamp.
+        history (int): The number of reports the reporter filed before this one.
+        ip_rank (int): 1 + the number of earlier reporters of this scammer from the same IP address.
+    """
+    if registered_at is None:
+        account_factor = 1.0
+    else:
+        age_days = max(reported_at - registered_at, 0.0) / SECONDS_PER_DAY
+        ramp = min(age_days / settings.REPUTATION_NEW_ACCOUNT_DAYS, 1.0) if settings.REPUTATION_NEW_ACCOUNT_DAYS else 1.0
+        account_factor = settings.REPUTATION_NEW_ACCOUNT_WEIGHT + (1.0 - settings.REPUTATION_NEW_ACCOUNT_WEIGHT) * ramp
+    history_factor = 1.0 / (1.0 + history / settings.REPUTATION_HISTORY_SCALE)
+    return account_factor * history_factor / max(ip_rank, 1)
+
+
+def current_score(score: float, score_at: float, now: Optional[float] = None) -> float:
+    """
+    Brings a stored score forward to `now`.
+    """
+    if now is None:
+        now = time.time()
+    return score * decay(now - score_at)
+
+
+# Registered on every database connection, as name -> (number of arguments, function).
+SQL_FUNCTIONS: Dict[str, Tuple[int, Callable[..., Any]]] = {
+    'reputation_decay': (1, decay),
+    'reputation_weight': (4, report_weight),
+}
@@ -1,4 +1,132 @@
-from typing import Awaitable, Tuple, Optional
+from typing import Any, Awaitable, Dict, List, Optional, Tuple, Type
+
+try:
+    import orjson
+
+    def loads(data: bytes) -> Any:
+        return orjson.loads(data)
+except ImportError:
+    import json
+
+    def loads(data: bytes) -> Any:
+        return json.loads(data)
+
+_UNPARSED = object()
+
+async def read_json(request) -> Any:
+    """
+    Parses the request body as JSON once and keeps the result on the request,
+    so later calls from middlewares, validators and handlers are free.
+
+    Raises:
+        ValueError: If the body is not valid JSON.
+    """
+    data = getattr(request, '_parsed_json', _UNPARSED)
+    if data is _UNPARSED:
+        body = await request.read()
+        data = loads(body) if body else None
+        request._parsed_json = data
+    return data
+
+class Field:
+    """
+    A single body field: its type, whether it is required and its length limits.
+    """
+
+    def __init__(self, name: str, kind: Type = str, required: bool = True, min_length: Optional[int] = None,
+                 max_length: Optional[int] = None, coerce_from: Tuple[Type, ...] = (), items: Optional[Type] = None):
+        """
+        Initializes the Field.
+
+        Args:
+            name (str): The key of the field in the JSON body.
+            kind (Type): The expected type of the value.
+            required (bool): Whether a missing or null value is an error.
+            min_length (Optional[int]): The minimum length of a string or list value.
+            max_length (Optional[int]): The maximum length of a string or list value.
+            coerce_from (Tuple[Type, ...]): Other accepted types, converted with `kind(value)`.
+            items (Optional[Type]): The expected type of every element of a list value.
+        """
+        self.name = name
+        self.kind = kind
+        self.required = required
+        self.min_length = 1 if min_length is None and required and kind in (str, list) else min_length
+        self.max_length = max_length
+        self.coerce_from = coerce_from
+        self.items = items
+
+    def check(self, value: Any) -> Tuple[Any, Optional[str]]:
+        if isinstance(value, bool) and self.kind is not bool:
+            return value, f"Field '{self.name}' must be of type {self.kind.__name__}"
+        if not isinstance(value, self.kind):
+            if not isinstance(value, self.coerce_from):
+                return value, f"Field '{self.name}' must be of type {self.kind.__name__}"
+            value = self.kind(value)
+        if self.min_length is not None and len(value) < self.min_length:
+            if self.min_length == 1:
+                return value, f"Field '{self.name}' must not be empty"
+            return value, f"Field '{self.name}' must be at least {self.min_length} long"
+        if self.max_length is not None and len(value) > self.max_length:
+            return value, f"Field '{self.name}' must be at most {self.max_length} long"
+        if self.items is not None and not all(isinstance(item, self.items) for item in value):
+            return value, f"Field '{self.name}' must only contain values of type {self.items.__name__}"
+        return value, None
+
+class Schema:
+    """
+    A declarative description of a JSON object body, validated in one pass.
+    """
+
+    def __init__(self, *fields: Field, loc: Tuple[str, ...] = ("body",)):
+        """
+        Initializes the Schema.
+
+        Args:
+            *fields (Field): The fields of the body.
+            loc (Tuple[str, ...]): The prefix of the `loc` reported for each field error.
+        """
+        self.fields = fields
+        self.loc = loc
+
+    def error(self, loc: List[str], message: str) -> Dict[str, Any]:
+        return {"loc": [*self.loc, *loc], "msg": message, "type": "value_error"}
+
+    def validate(self, data: Any) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Validates a decoded body against the schema.
+
+        Returns:
+            Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]: The validated
+            fields and an empty list, or None and the `{"detail": [...]}` errors.
+        """
+        if not isinstance(data, dict):
+            return None, [self.error([], "Request body must be a JSON object")]
+        values = {}
+        errors = []
+        for field in self.fields:
+            value = data.get(field.name)
+            if value is None:
+                if field.required:
+                    errors.append(self.error([field.name], f"Field '{field.name}' is required"))
+                else:
+                    values[field.name] = None
+                continue
+            value, message = field.check(value)
+            if message is not None:
+                errors.append(self.error([field.name], message))
+            else:
+                values[field.name] = value
+        return (None, errors) if errors else (values, errors)
+
+    async def parse(self, request) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Reads, decodes and validates the request body, decoding it at most once per request.
+        """
+        try:
+            data = await read_json(request)
+        except ValueError:
+            return None, [self.error([], "Request body is not valid JSON")]
+        return self.validate(data)
 
 class RequestValidator:
     def __init__(self, request: Awaitable, required_fields: Tuple[str,...]):
@@ -6,8 +134,8 @@ class RequestValidator:
         self.required_fields = required_fields
 
     async def validate(self) -> Tuple[bool, Optional[str]]:
-        data = await self.request.json()
+        data = await read_json(self.request)
         for field in self.required_fields:
-            if not data.get(field):
+            if not isinstance(data, dict) or not data.get(field):
                 return False, f"Missing or empty field: {field}"
         return True, None
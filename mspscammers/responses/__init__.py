@@ -1,5 +1,87 @@
-from typing import Dict, Any
-import json
+from typing import Any, AsyncIterable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from blacksheep import Response
+from blacksheep.contents import Content, StreamedContent
+
+try:
+    import orjson
+
+    def dumps(data: Any) -> bytes:
+        return orjson.dumps(data)
+except ImportError:
+    import json
+
+    def dumps(data: Any) -> bytes:
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+JSON_TYPE = b'application/json'
+
+Headers = Optional[List[Tuple[bytes, bytes]]]
+
+def json_response(data: Any, status: int = 200, headers: Headers = None) -> Response:
+    return Response(status, headers, Content(JSON_TYPE, dumps(data)))
+
+def error_detail(loc: Sequence[str], message: str, type: str = "value_error") -> Dict[str, Any]:
+    return {"loc": list(loc), "msg": message, "type": type}
+
+def error_response(status: int, loc: Sequence[str], message: str, type: str = "value_error") -> Response:
+    return json_response({"detail": [error_detail(loc, message, type)]}, status=status)
+
+class StaticResponse:
+    """
+    A response whose body never changes, encoded once when it is declared.
+    Calling it returns a fresh Response around the shared payload, so
+    middlewares can still add headers to it.
+    """
+
+    def __init__(self, status: int, data: Any):
+        """
+        Initializes the StaticResponse.
+
+        Args:
+            status (int): The HTTP status code.
+            data (Any): The JSON body, encoded immediately.
+        """
+        self.status = status
+        self.body = dumps(data)
+        self.content = Content(JSON_TYPE, self.body)
+
+    def __call__(self) -> Response:
+        return Response(self.status, None, self.content)
+
+def static_error(status: int, loc: Sequence[str], message: str, type: str = "value_error") -> StaticResponse:
+    return StaticResponse(status, {"detail": [error_detail(loc, message, type)]})
+
+MISSING_AUTH_TOKEN = static_error(401, ["header", "authorization"], "Authentication token is missing")
+INVALID_AUTH_TOKEN = static_error(401, ["header", "authorization"], "Authentication token doesn't match IP address")
+MODERATOR_REQUIRED = static_error(401, ["header", "authorization"], "A moderator token is required")
+BANNED = static_error(403, ["header", "authorization"], "You are banned", "value_error.banned")
+REPORTING_BANNED = static_error(403, ["header", "authorization"], "You are banned from reporting", "value_error.banned")
+ACCOUNT_BANNED = static_error(403, ["discord_user_id"], "This Discord account is banned", "value_error.banned")
+ALREADY_REPORTED = static_error(409, ["body"], "You have already reported this user", "value_error.conflict")
+RATE_LIMITED = static_error(429, [], "Too many requests, slow down", "value_error.rate_limited")
+
+VALIDATION_CACHE_SIZE = 512
+
+_validation_errors: Dict[Tuple[Tuple[Any, ...], ...], StaticResponse] = {}
+
+def validation_error(errors: List[Dict[str, Any]], status: int = 400) -> Response:
+    """
+    Builds the `{"detail": [...]}` response for schema errors. Schema messages
+    only depend on the field that failed, so each distinct set of errors
+    (a missing field, an over-long value, ...) is encoded once and reused.
+    """
+    key = (status, *((tuple(error["loc"]), error["msg"], error["type"]) for error in errors))
+    response = _validation_errors.get(key)
+    if response is None:
+        response = StaticResponse(status, {"detail": errors})
+        if len(_validation_errors) < VALIDATION_CACHE_SIZE:
+            _validation_errors[key] = response
+    return response()
+
+def stream(content_type: bytes, provider: Callable[[], AsyncIterable[bytes]], status: int = 200,
+           headers: Headers = None) -> Response:
+    return Response(status, headers, StreamedContent(content_type, provider))
 
 class ResponseBuilder:
     def __init__(self, status_code: int):
@@ -14,8 +96,8 @@ class ResponseBuilder:
         self.data = {"error": message}
         return self
 
-    def build(self):
-        return json(self.data, status=self.status_code)
+    def build(self) -> Response:
+        return json_response(self.data, status=self.status_code)
 
 async def bad_request(message):
     return ResponseBuilder(400).set_error(message).build()
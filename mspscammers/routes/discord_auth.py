@@ -1,26 +1,148 @@
 import aiofiles
-from typing import Dict
-from blacksheep import Application, Request
-from blacksheep.server.responses import html, redirect
+import asyncio
+import gzip
+import hashlib
+import os
+import secrets
+import sqlite3
+from typing import Dict, Optional
+from blacksheep import Application, Cookie, Request, Response
+from blacksheep.contents import Content
+from blacksheep.server.responses import redirect
 from urllib.parse import quote_plus
+from mspscammers import database, settings
+from mspscammers.bans import ban_list
+from mspscammers.discord import DiscordError, avatar_url, discord_client
+from mspscammers.metrics import timed_route
+from mspscammers.responses import ACCOUNT_BANNED, error_response, json_response
+
+STATE_COOKIE = "discord_oauth_state"
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HTML_TYPE = b"text/html; charset=utf-8"
+
+class Template:
+    """
+    A template read into memory with everything a response needs precomputed:
+    the encoded body, its ETag and compressed variants.
+    """
+
+    def __init__(self, body: bytes, mtime: float):
+        """
+        Initializes the Template.
+
+        Args:
+            body (bytes): The UTF-8 encoded template.
+            mtime (float): The modification time of the file it was read from.
+        """
+        self.mtime = mtime
+        self.etag = b'"' + hashlib.sha256(body).hexdigest()[:32].encode("ascii") + b'"'
+        self.variants: Dict[str, Content] = {"identity": Content(HTML_TYPE, body)}
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants["gzip"] = Content(HTML_TYPE, compressed)
+        if brotli is not None:
+            compressed = brotli.compress(body, mode=brotli.MODE_TEXT)
+            if len(compressed) < len(body):
+                self.variants["br"] = Content(HTML_TYPE, compressed)
+
+    def not_modified(self, request: Request) -> bool:
+        if_none_match = request.headers.get_first(b"if-none-match")
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == b"*":
+            return True
+        return any(tag.strip().removeprefix(b"W/") == self.etag for tag in if_none_match.split(b","))
+
+    def encoding_for(self, request: Request) -> str:
+        accept_encoding = request.headers.get_first(b"accept-encoding")
+        if not accept_encoding:
+            return "identity"
+        accepted = set()
+        for item in accept_encoding.decode("latin-1").split(","):
+            coding, _, params = item.strip().partition(";")
+            if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                accepted.add(coding.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+    def response(self, request: Request) -> Response:
+        if self.not_modified(request):
+            return Response(304, [(b"etag", self.etag), (b"vary", b"accept-encoding")], None)
+        encoding = self.encoding_for(request)
+        headers = [(b"etag", self.etag), (b"vary", b"accept-encoding")]
+        if encoding != "identity":
+            headers.append((b"content-encoding", encoding.encode("ascii")))
+        return Response(200, headers, self.variants[encoding])
 
 class TemplateCache:
     """
-    A simple template cache for reading HTML templates asynchronously.
+    A template cache for serving HTML templates from memory.
     """
 
-    _cache: Dict[str, str]
+    _cache: Dict[str, Template]
 
-    def __init__(self):
+    def __init__(self, directory: str = "templates"):
         """
         Initializes the TemplateCache.
+
+        Args:
+            directory (str): The directory the HTML templates are read from.
         """
+        self.directory = directory
         self._cache = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def _load(self, file_name: str) -> Template:
+        path = os.path.join(self.directory, file_name)
+        mtime = os.stat(path).st_mtime
+        async with aiofiles.open(path, "rb") as file:
+            body = await file.read()
+        template = self._cache[file_name] = Template(body, mtime)
+        return template
+
+    async def preload(self) -> None:
+        """
+        Reads and precomputes every HTML template in the directory, so no
+        request waits on the file system.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for file_name in sorted(os.listdir(self.directory)):
+            if file_name.endswith(".html"):
+                await self._load(file_name)
+
+    async def get_template(self, file_name: str) -> Template:
+        """
+        Returns a template, reading it on first use if it was not preloaded.
+        Concurrent first reads of the same file wait for a single read.
+
+        Args:
+            file_name (str): The name of the HTML template file.
+
+        Returns:
+            Template: The loaded template.
+        """
+        template = self._cache.get(file_name)
+        if template is not None:
+            return template
+        lock = self._locks.setdefault(file_name, asyncio.Lock())
+        async with lock:
+            template = self._cache.get(file_name)
+            if template is None:
+                template = await self._load(file_name)
+            return template
 
     async def read_template(self, file_name: str) -> str:
         """
-        Reads an HTML template from the file system asynchronously,
-        caching it for subsequent reads.
+        Returns the content of an HTML template.
 
         Args:
             file_name (str): The name of the HTML template file.
@@ -28,10 +150,52 @@ class TemplateCache:
         Returns:
             str: The content of the HTML template.
         """
-        if file_name not in self._cache:
-            async with aiofiles.open(f"./templates/{file_name}", "r", encoding="utf-8") as file:
-                self._cache[file_name] = await file.read()
-        return self._cache[file_name]
+        template = await self.get_template(file_name)
+        return template.variants["identity"].body.decode("utf-8")
+
+    async def render(self, request: Request, file_name: str) -> Response:
+        """
+        Serves a template, honoring If-None-Match and Accept-Encoding.
+
+        Args:
+            request (Request): The HTTP request.
+            file_name (str): The name of the HTML template file.
+
+        Returns:
+            Response: A 304 or the template in the best encoding the client accepts.
+        """
+        return (await self.get_template(file_name)).response(request)
+
+    async def _watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for file_name, template in list(self._cache.items()):
+                try:
+                    if os.stat(os.path.join(self.directory, file_name)).st_mtime != template.mtime:
+                        await self._load(file_name)
+                except OSError:
+                    continue
+            # Pick up templates added while running too.
+            if os.path.isdir(self.directory):
+                for file_name in os.listdir(self.directory):
+                    if file_name.endswith(".html") and file_name not in self._cache:
+                        await self._load(file_name)
+
+    def start_watcher(self, interval: float = 1.0) -> None:
+        """
+        Starts polling the templates for changes and reloading them; for development.
+        """
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch(interval))
+
+    async def stop_watcher(self) -> None:
+        if self._watcher is not None:
+            watcher, self._watcher = self._watcher, None
+            watcher.cancel()
+            try:
+                await watcher
+            except asyncio.CancelledError:
+                pass
 
 
 def register_discord_routes(app: Application) -> None:
@@ -43,10 +207,12 @@ def register_discord_routes(app: Application) -> None:
     """
     app.router.add_get("/discord/connect", connect)
     app.router.add_get("/discord/app/login", login)
+    app.router.add_get("/discord/callback", callback)
 
-cache = TemplateCache()
+cache = TemplateCache(settings.TEMPLATES_DIR)
 
-async def connect(request: Request) -> html:
+@timed_route
+async def connect(request: Request) -> Response:
     """
     Handles requests to the /discord/connect route by rendering the discordlogin.html template.
 
@@ -54,22 +220,73 @@ async def connect(request: Request) -> html:
         request (Request): The HTTP request.
 
     Returns:
-        html: The rendered HTML response.
+        Response: The rendered HTML response.
     """
-    return html(await cache.read_template(file_name="discordlogin.html"))
+    return await cache.render(request, file_name="discordlogin.html")
 
+@timed_route
 async def login(request: Request) -> redirect:
-    CLIENT_ID = "1200476142554062941"
-    REDIRECT_URI = "https://msp-scammers.fr/discord/callback"
     SCOPE = "identify"
     RESPONSE_TYPE = "code"
-    
+    state = secrets.token_urlsafe(16)
+
     authorization_url = (
-        f"https://discord.com/api/oauth2/authorize"
-        f"?client_id={CLIENT_ID}"
-        f"&redirect_uri={quote_plus(REDIRECT_URI)}"
+        f"{settings.DISCORD_AUTHORIZE_URL}"
+        f"?client_id={settings.DISCORD_CLIENT_ID}"
+        f"&redirect_uri={quote_plus(settings.DISCORD_REDIRECT_URI)}"
         f"&response_type={RESPONSE_TYPE}"
         f"&scope={SCOPE}"
+        f"&state={state}"
     )
 
-    return redirect(authorization_url)
+    response = redirect(authorization_url)
+    response.set_cookie(Cookie(STATE_COOKIE, state, http_only=True, secure=True, max_age=600, path="/discord"))
+    return response
+
+@timed_route
+async def callback(request: Request) -> Response:
+    """
+    Handles the redirect back from Discord: checks the OAuth state, exchanges
+    the authorization code, fetches the Discord user and registers it, or
+    issues it a new auth token if it is already registered.
+
+    Args:
+        request (Request): The HTTP request.
+
+    Returns:
+        Response: The registered user's data, as the registration route returns it.
+    """
+    code = request.query.get("code", [None])[0]
+    state = request.query.get("state", [None])[0]
+    expected_state = request.cookies.get(STATE_COOKIE)
+    if not expected_state or not state or not secrets.compare_digest(state, expected_state):
+        return error_response(400, ["query", "state"], "OAuth state does not match, start the login again")
+    if not code:
+        return error_response(400, ["query", "code"], "Field 'code' is required")
+
+    try:
+        access_token = await discord_client.exchange_code(code)
+        user = await discord_client.get_user(access_token)
+    except DiscordError as error:
+        # Rate limits are retried by the client; one still standing means Discord is busy, not that the code is bad.
+        if 400 <= error.status < 500 and error.status != 429:
+            return error_response(400, ["query", "code"], "Discord rejected the authorization code")
+        return error_response(502, ["discord"], "Discord is unavailable, try again later")
+
+    discord_user_id = str(user["id"])
+    if discord_user_id in ban_list:
+        return ACCOUNT_BANNED()
+
+    try:
+        await database.add_user(discord_user_id, request.client_ip, user["username"], avatar_url(user))
+    except sqlite3.IntegrityError:
+        # Another account still holds the name this user has on Discord now.
+        return error_response(409, ["username"], f"Username '{user['username']}' already exists")
+    user_data = await database.get_user_data_json(discord_user_id)
+    response = json_response({
+        "success": True,
+        "message": "Logged in with Discord",
+        "user_data": user_data
+    })
+    response.set_cookie(Cookie(STATE_COOKIE, "", http_only=True, secure=True, max_age=0, path="/discord"))
+    return response
@@ -0,0 +1,117 @@
+from contextlib import aclosing
+from typing import AsyncIterable, List, Optional
+
+from blacksheep import Application, Request, Response
+from blacksheep.server.websocket import WebSocket, WebSocketDisconnectError
+from mspscammers import settings
+from mspscammers.database import list_reports_after
+from mspscammers.feed import FeedEvent, report_feed
+from mspscammers.metrics import timed_route
+from mspscammers.responses import MODERATOR_REQUIRED, stream
+from mspscammers.routes.moderation import QueryError, bad_query, is_moderator, query_int
+
+REPLAY_BATCH_SIZE = 500
+MAX_FEED_SCAMMER_IDS = 1000
+KEEPALIVE = object()
+
+def feed_filters(request: Request) -> List[str]:
+    scammer_ids = request.query.get("scammer_id") or []
+    if len(scammer_ids) > MAX_FEED_SCAMMER_IDS:
+        raise QueryError("scammer_id", f"At most {MAX_FEED_SCAMMER_IDS} 'scammer_id' values are allowed")
+    return scammer_ids
+
+def last_event_id(request: Request) -> Optional[int]:
+    # EventSource sends the Last-Event-ID header when it reconnects; other
+    # clients can pass the query parameter instead.
+    header = request.headers.get_first(b"last-event-id")
+    if header is not None:
+        try:
+            return max(int(header), 0)
+        except ValueError:
+            raise QueryError("last_event_id", "'Last-Event-ID' must be an integer")
+    return query_int(request, "last_event_id", None, 0)
+
+async def feed_events(scammer_ids: List[str], after_id: Optional[int]) -> AsyncIterable[object]:
+    """
+    Yields the reports after `after_id` from the table, then live events,
+    and `KEEPALIVE` whenever the feed stays idle. Ends when the subscriber
+    is dropped for falling behind.
+    """
+    # Subscribe before replaying so nothing committed meanwhile is missed;
+    # live reports the replay already covered are skipped.
+    subscription = report_feed.subscribe(scammer_ids)
+    replayed_up_to = 0
+    try:
+        while after_id is not None:
+            rows = await list_reports_after(after_id, scammer_ids, REPLAY_BATCH_SIZE)
+            for row in rows:
+                yield FeedEvent("report", row)
+                after_id = replayed_up_to = row["id"]
+            if len(rows) < REPLAY_BATCH_SIZE:
+                break
+        while not (subscription.dropped and subscription.queue.empty()):
+            event = await subscription.get(settings.FEED_KEEPALIVE)
+            if event is None:
+                yield KEEPALIVE
+            elif event.id is None or event.id > replayed_up_to:
+                yield event
+    finally:
+        report_feed.unsubscribe(subscription)
+
+async def disconnected(request: Request) -> bool:
+    try:
+        return await request.is_disconnected()
+    except TypeError:
+        # Not bound to an ASGI connection, e.g. under the test client.
+        return False
+
+@timed_route
+async def event_stream(request: Request) -> Response:
+    if not is_moderator(request):
+        return MODERATOR_REQUIRED()
+    try:
+        scammer_ids = feed_filters(request)
+        after_id = last_event_id(request)
+    except QueryError as error:
+        return bad_query(error.field, str(error))
+
+    async def provider() -> AsyncIterable[bytes]:
+        yield f"retry: {int(settings.FEED_KEEPALIVE * 1000)}\n\n".encode("utf-8")
+        async with aclosing(feed_events(scammer_ids, after_id)) as events:
+            async for event in events:
+                if event is KEEPALIVE:
+                    if await disconnected(request):
+                        return
+                    yield b": keepalive\n\n"
+                else:
+                    yield event.sse()
+
+    return stream(b"text/event-stream", provider, headers=[
+        (b"cache-control", b"no-cache"),
+        (b"x-accel-buffering", b"no"),
+    ])
+
+async def event_socket(websocket: WebSocket) -> None:
+    if not is_moderator(websocket):
+        await websocket.close(1008, "Moderator token required")
+        return
+    try:
+        scammer_ids = feed_filters(websocket)
+        after_id = last_event_id(websocket)
+    except QueryError as error:
+        await websocket.close(1008, str(error))
+        return
+
+    await websocket.accept()
+    try:
+        async with aclosing(feed_events(scammer_ids, after_id)) as events:
+            async for event in events:
+                await websocket.send_text('{"type":"keepalive"}' if event is KEEPALIVE else event.payload)
+        await websocket.close(1013, "Subscriber fell behind; reconnect with last_event_id")
+    except (WebSocketDisconnectError, OSError):
+        # The client went away; leaving the loop ends the subscription.
+        pass
+
+def register_feed_routes(app: Application) -> None:
+    app.router.add_get("/api/v1/events", event_stream)
+    app.router.add_ws("/api/v1/events/ws", event_socket)
@@ -0,0 +1,15 @@
+from blacksheep import Application, Request, Response
+from blacksheep.contents import Content
+from mspscammers.metrics import render
+from mspscammers.responses import MODERATOR_REQUIRED
+from mspscammers.routes.moderation import is_moderator
+
+PROMETHEUS_TYPE = b"text/plain; version=0.0.4; charset=utf-8"
+
+async def get_metrics(request: Request) -> Response:
+    if not is_moderator(request):
+        return MODERATOR_REQUIRED()
+    return Response(200, None, Content(PROMETHEUS_TYPE, render().encode("utf-8")))
+
+def register_metrics_routes(app: Application) -> None:
+    app.router.add_get("/metrics", get_metrics)
@@ -0,0 +1,203 @@
+import csv
+import io
+import secrets
+from datetime import datetime, timezone
+from typing import AsyncIterable, Optional
+
+from blacksheep import Application, Request, Response
+from mspscammers import settings
+from mspscammers.metrics import timed_route
+from mspscammers.requests import Field, Schema
+from mspscammers.responses import MODERATOR_REQUIRED, dumps, error_response, json_response, stream, validation_error
+from mspscammers.database import (REPORT_COLUMNS, ban_user, iter_reports, list_bans, list_reports, recompute_reputation,
+                                  revoke_tokens, unban_user)
+from mspscammers.database.maintenance import maintenance
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 500
+
+BAN_SCHEMA = Schema(
+    Field("discord_user_id", str, max_length=32, coerce_from=(int,)),
+    Field("reason", str, required=False, max_length=500),
+)
+
+class QueryError(ValueError):
+    def __init__(self, field: str, message: str):
+        super().__init__(message)
+        self.field = field
+
+def is_moderator(request: Request) -> bool:
+    if not settings.ADMIN_TOKEN:
+        return False
+    token = request.headers.get_first(b'authorization')
+    return token is not None and secrets.compare_digest(token, settings.ADMIN_TOKEN.encode('utf-8'))
+
+def bad_query(field: str, message: str) -> Response:
+    return error_response(400, ["query", field], message)
+
+def query_value(request: Request, name: str) -> Optional[str]:
+    values = request.query.get(name)
+    return values[0] if values else None
+
+def query_int(request: Request, name: str, default: Optional[int], minimum: int, maximum: Optional[int] = None) -> Optional[int]:
+    value = query_value(request, name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise QueryError(name, f"'{name}' must be an integer")
+    if number < minimum or (maximum is not None and number > maximum):
+        raise QueryError(name, f"'{name}' is out of range")
+    return number
+
+def query_timestamp(request: Request, name: str) -> Optional[str]:
+    """
+    Parses an ISO 8601 query parameter into the UTC `YYYY-MM-DD HH:MM:SS`
+    form SQLite's CURRENT_TIMESTAMP stores in `created_at`.
+    """
+    value = query_value(request, name)
+    if value is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise QueryError(name, f"'{name}' must be an ISO 8601 timestamp")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def report_filters(request: Request) -> dict:
+    return {
+        "scammer_id": query_value(request, "scammer_id"),
+        "reporter": query_value(request, "reporter"),
+        "since": query_timestamp(request, "since"),
+        "until": query_timestamp(request, "until"),
+    }
+
+@timed_route
+async def get_reports(request: Request) -> Response:
+    if not is_moderator(request):
+        return MODERATOR_REQUIRED()
+    try:
+        limit = query_int(request, "limit", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+        before_id = query_int(request, "cursor", None, 1)
+        filters = report_filters(request)
+    except QueryError as error:
+        return bad_query(error.field, str(error))
+
+    reports = await list_reports(limit=limit + 1, before_id=before_id, **filters)
+    next_cursor = None
+    if len(reports) > limit:
+        reports = reports[:limit]
+        next_cursor = reports[-1]["id"]
+    return json_response({"reports": reports, "next_cursor": next_cursor})
+
+async def jsonl_lines(filters: dict) -> AsyncIterable[bytes]:
+    async for report in iter_reports(batch_size=EXPORT_BATCH_SIZE, **filters):
+        yield dumps(report) + b'\n'
+
+async def csv_lines(filters: dict) -> AsyncIterable[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(REPORT_COLUMNS)
+    rows = 0
+    async for report in iter_reports(batch_size=EXPORT_BATCH_SIZE, **filters):
+        writer.writerow(report.values())
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+EXPORT_FORMATS = {
+    "jsonl": (b"application/x-ndjson", jsonl_lines),
+    "csv": (b"text/csv; charset=utf-8", csv_lines),
+}
+
+@timed_route
+async def export_reports(request: Request) -> Response:
+    if not is_moderator(request):
+        return MODERATOR_REQUIRED()
+    export_format = query_value(request, "format") or "jsonl"
+    if export_format not in EXPORT_FORMATS:
+        return bad_query("format", "'format' must be 'jsonl' or 'csv'")
+    try:
+        filters = report_filters(request)
+    except QueryError as error:
+        return bad_query(error.field, str(error))
+
+    content_type, lines = EXPORT_FORMATS[export_format]
+
+    async def provider() -> AsyncIterable[bytes]:
+        async for chunk in lines(filters):
+            yield chunk
+
+    return stream(content_type, provider, headers=[
+        (b"content-disposition", f'attachment; filename="reports.{export_format}"'.encode('utf-8'))
+    ])
+
+@timed_route
+async def get_bans(request: Request) -> Response:
+    if not is_moderator(request):
+        return MODERATOR_REQUIRED()
+    return json_response({"bans": await list_bans()})
+
+@timed_route
+async def create_ban(request: Request) -> Response:
+    if not is_moderator(request):
+        return MODERATOR_REQUIRED()
+    data, errors = await BAN_SCHEMA.parse(request)
+    if errors:
+        return validation_error(errors)
+    await ban_user(data["discord_user_id"], data["reason"])
+    return json_response({"success": True, "message": "User banned", "discord_user_id": data["discord_user_id"]}, status=201)
+
+@timed_route
+async def delete_ban(request: Request) -> Response:
+    if not is_moderator(request):
+        return MODERATOR_REQUIRED()
+    discord_user_id = request.route_values["discord_user_id"]
+    await unban_user(discord_user_id)
+    return json_response({"success": True, "message": "User unbanned", "discord_user_id": discord_user_id})
+
+@timed_route
+async def delete_tokens(request: Request) -> Response:
+    if not is_moderator(request):
+        return MODERATOR_REQUIRED()
+    discord_user_id = request.route_values["discord_user_id"]
+    revoked_before = await revoke_tokens(discord_user_id)
+    return json_response({
+        "success": True,
+        "message": "Signed tokens revoked",
+        "discord_user_id": discord_user_id,
+        "revoked_before": revoked_before
+    })
+
+@timed_route
+async def recompute_scores(request: Request) -> Response:
+    if not is_moderator(request):
+        return MODERATOR_REQUIRED()
+    reports_count = await recompute_reputation()
+    return json_response({"success": True, "message": "Reputation recomputed", "reports_count": reports_count})
+
+@timed_route
+async def run_maintenance(request: Request) -> Response:
+    if not is_moderator(request):
+        return MODERATOR_REQUIRED()
+    backup = query_value(request, "backup") in ("1", "true")
+    if not maintenance.trigger(backup=backup):
+        return error_response(409, ["maintenance"], "A maintenance run is already in progress")
+    return json_response({"success": True, "message": "Maintenance started", "backup": backup}, status=202)
+
+def register_moderation_routes(app: Application) -> None:
+    app.router.add_get("/api/v1/reports", get_reports)
+    app.router.add_get("/api/v1/reports/export", export_reports)
+    app.router.add_get("/api/v1/admin/bans", get_bans)
+    app.router.add_post("/api/v1/admin/bans", create_ban)
+    app.router.add_delete("/api/v1/admin/bans/{discord_user_id}", delete_ban)
+    app.router.add_delete("/api/v1/admin/tokens/{discord_user_id}", delete_tokens)
+    app.router.add_post("/api/v1/admin/reputation/recompute", recompute_scores)
+    app.router.add_post("/api/v1/admin/maintenance", run_maintenance)
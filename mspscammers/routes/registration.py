@@ -1,97 +1,72 @@
-from blacksheep import Application, Request
-from blacksheep.server.responses import json
+from blacksheep import Application, Request, Response
 from mspscammers import database as db
-from typing import Awaitable, Callable
-
-from typing import Dict, Awaitable, Callable
+from mspscammers.bans import ban_list
+from mspscammers.cache import usernames, user_ids
+from mspscammers.membership import usernames_index, user_ids_index
+from mspscammers.metrics import timed_route
+from mspscammers.requests import Field, Schema
+from mspscammers.responses import ACCOUNT_BANNED, error_response, json_response, validation_error
 
 class DatabaseCache:
-    _cache: Dict[str, Dict[str, bool]]
-
-    def __init__(self):
-        self._cache = {}
-
+    # Only possible hits in the membership indexes are looked up; a miss there
+    # means the name or ID was never registered.
     async def check_username_exists_cached(self, username: str) -> bool:
-        if "username" not in self._cache:
-            self._cache["username"] = {}
-
-        if username not in self._cache["username"]:
-            self._cache["username"][username] = await db.check_username_exists(username)
-
-        return self._cache["username"][username]
+        if not usernames_index.might_contain(username):
+            return False
+        return await usernames.get_or_load(username, lambda: db.check_username_exists(username))
 
     async def check_user_exists_cached(self, user_id: str) -> bool:
-        if "user_id" not in self._cache:
-            self._cache["user_id"] = {}
-
-        if user_id not in self._cache["user_id"]:
-            self._cache["user_id"][user_id] = await db.check_user_exists(user_id)
+        if not user_ids_index.might_contain(user_id):
+            return False
+        return await user_ids.get_or_load(user_id, lambda: db.check_user_exists(user_id))
 
-        return self._cache["user_id"][user_id]
-    
     def update_cache(self, user_id: str, username: str) -> None:
-        if "username" not in self._cache:
-            self._cache["username"] = {}
-        if "user_id" not in self._cache:
-            self._cache["user_id"] = {}
-        self._cache["username"][username] = True
-        self._cache["user_id"][user_id] = True
+        usernames.set(username, True)
+        user_ids.set(user_id, True)
 
 cache  = DatabaseCache()
 
-async def create_account(request: Request) -> Awaitable[json]:
-    data: dict = await request.json()
-
-    required_fields = ['discord_user_id', 'discord_username', 'image_url']
-    missing_fields = [{"loc": [field], "msg": f"Field '{field}' is required", "type": "value_error"} for field in required_fields if field not in data]
-    if missing_fields:
-        error_response = {"detail": missing_fields}
-        return json(data=error_response, status=400)
-
-    username_exists = await cache.check_username_exists_cached(data['discord_username'])
-    user_exists = await cache.check_user_exists_cached(data['discord_user_id'])
-
-    if username_exists:
-        error_response = {
-            "detail": [
-                {
-                    "loc": ["username"],
-                    "msg": f"Username '{data['discord_username']}' already exists",
-                    "type": "value_error"
-                }]
-            }
-        return json(data=error_response, status=409)
-    elif user_exists:
-        error_response = {
-            "detail": [
-                {
-                    "loc": ["discord_user_id"],
-                    "msg": f"Discord user ID '{str(data['discord_user_id'])}' already exists",
-                    "type": "value_error"
-                }
-            ]
-        }
-        return json(data=error_response, status=409)
-
-    await db.add_user(data['discord_user_id'], request.client_ip, data['discord_username'], data['image_url'])
-    user_data = await db.get_user_data_json(data['discord_user_id'])
-
-    if user_data:
-        cache.update_cache(user_id=data['discord_user_id'], username=data['discord_username'])
-
-    if user_data:
-        success_response = {
-            'success': True,
-            'message': 'Account created successfully',
-            'user_data': user_data
-        }
-        return json(data=success_response, status=201)
-    else:
-        error_response = {
-            'error': 'Internal Server Error',
-            'message': 'Failed to create account'
-        }
-        return json(data=error_response, status=500)
+ACCOUNT_SCHEMA = Schema(
+    Field('discord_user_id', str, max_length=32, coerce_from=(int,)),
+    Field('discord_username', str, max_length=64),
+    Field('image_url', str, max_length=2048),
+    loc=(),
+)
+
+def username_taken(data: dict) -> Response:
+    return error_response(409, ["username"], f"Username '{data['discord_username']}' already exists")
+
+def user_id_taken(data: dict) -> Response:
+    return error_response(409, ["discord_user_id"], f"Discord user ID '{data['discord_user_id']}' already exists")
+
+@timed_route
+async def create_account(request: Request) -> Response:
+    data, errors = await ACCOUNT_SCHEMA.parse(request)
+    if errors:
+        return validation_error(errors)
+
+    if data['discord_user_id'] in ban_list:
+        return ACCOUNT_BANNED()
+
+    if await cache.check_username_exists_cached(data['discord_username']):
+        return username_taken(data)
+    if await cache.check_user_exists_cached(data['discord_user_id']):
+        return user_id_taken(data)
+
+    user_data = await db.create_user(data['discord_user_id'], request.client_ip, data['discord_username'], data['image_url'])
+    if user_data is None:
+        # Registered by another worker since this one's indexes last heard of it.
+        if await db.check_username_exists(data['discord_username']):
+            return username_taken(data)
+        return user_id_taken(data)
+
+    cache.update_cache(user_id=data['discord_user_id'], username=data['discord_username'])
+    success_response = {
+        'success': True,
+        'message': 'Account created successfully',
+        'user_data': user_data
+    }
+    return json_response(success_response, status=201)
 
 def register_registration_routes(app: Application) -> None:
     app.router.add_post("/api/v1/registration/create", create_account)
@@ -1,104 +1,101 @@
-from blacksheep import Application, Request, Response
-from blacksheep.server.responses import json
+from blacksheep import Application, Request
 from blacksheep.server.authorization import auth
-from mspscammers.database import (
-    check_ip_auth, get_discord_user_id, has_reported,
-    add_report, get_total_reports_for_scammer
-)
-from typing import Dict
+from mspscammers.bans import ban_list
+from mspscammers.brigading import signature
+from mspscammers.cache import MISSING, auth_tokens as auth_token_cache
+from mspscammers.database import authorize_report, get_auth_token_owner, submit_report
+from mspscammers.metrics import timed_route
+from mspscammers.msp import check_player
+from mspscammers.token_manager.signed import signed_tokens
+from mspscammers.requests import Field, Schema
+from mspscammers.responses import (ALREADY_REPORTED, INVALID_AUTH_TOKEN, MISSING_AUTH_TOKEN, REPORTING_BANNED,
+                                   error_response, json_response, validation_error)
+from typing import Optional
 
-auth_token_cache: Dict[str, str] = {}
+REPORT_SCHEMA = Schema(
+    Field('username', str, max_length=64),
+    Field('scammer_id', str, max_length=64, coerce_from=(int,)),
+    Field('description', str, max_length=2000),
+)
 
-async def validate_auth_token(request: Request) -> bool:
+async def validate_auth_token(request: Request, scammer_id: Optional[str] = None) -> bool:
     auth_token = request.headers.get_first(b'authorization')
     if not auth_token:
-        await unauthorized(request, 'Authentication token is missing')
         return False
 
     auth_token = auth_token.decode('utf-8')
-    if auth_token not in auth_token_cache:
-        is_valid = await check_ip_auth(request.client_ip, auth_token)
-        if not is_valid:
-            await unauthorized(request, "Authentication token doesn't match IP address")
-            return False
-        auth_token_cache[auth_token] = request.client_ip
-    else:
-        if auth_token_cache[auth_token] != request.client_ip:
-            await unauthorized(request, "Authentication token doesn't match IP address")
-            return False
-
-    request.discordid = await get_discord_user_id(auth_token)
-    return True
-
-async def validate_request(request: Request, required_fields: list) -> bool:
-    data = await request.json()
-    for field in required_fields:
-        if field not in data:
-            await bad_request(request, f"Missing required field: {field}")
+    request.banned = False
+    request.already_reported = False
+    if signed_tokens.enabled and signed_tokens.is_signed(auth_token):
+        # Signed tokens are verified in memory; a repeated report is caught
+        # by the insert instead of a lookup up front.
+        discord_user_id = signed_tokens.verify(auth_token, request.client_ip)
+        if discord_user_id is None:
             return False
-    return True
-
-async def unauthorized(request: Request, message: str) -> Response:
-    return json({
-        "detail": [
-            {
-                "loc": ["header", "authorization"],
-                "msg": message,
-                "type": "value_error"
-            }
-        ]
-    }, status=401)
+        request.discordid = discord_user_id
+        # A token is issued at registration or a later login, so its age
+        # never overstates the account's.
+        request.registered_at = signed_tokens.issued_at(auth_token)
+        request.banned = discord_user_id in ban_list
+        return True
 
-async def bad_request(request: Request, message: str) -> Response:
-    return json({
-        "detail": [
-            {
-                "loc": ["body"],
-                "msg": message,
-                "type": "value_error"
-            }
-        ]
-    }, status=400)
+    owner = auth_token_cache.get(auth_token)
+    if owner is MISSING and scammer_id is not None:
+        # One statement resolves the token and the reporter's ban and
+        # duplicate-report state while the cache is cold.
+        row = await authorize_report(auth_token, scammer_id)
+        owner = row[:3] if row else None
+        auth_token_cache.set(auth_token, owner)
+        if row:
+            request.banned, request.already_reported = row[3], row[4]
+    elif owner is MISSING:
+        owner = await auth_token_cache.get_or_load(auth_token, lambda: get_auth_token_owner(auth_token))
 
-async def conflict(request: Request, message: str) -> Response:
-    return json({
-        "detail": [
-            {
-                "loc": ["body"],
-                "msg": message,
-                "type": "value_error.conflict"
-            }
-        ]
-    }, status=409)
+    if owner is None or owner[0] != request.client_ip:
+        return False
 
-async def success(request: Request, message: str, data: dict) -> Response:
-    return json({
-        "success": True,
-        "message": message,
-        **data
-    }, status=200)
+    request.discordid = owner[1]
+    request.registered_at = owner[2]
+    request.banned = request.banned or owner[1] in ban_list
+    return True
 
+@timed_route
 async def report_user(request: Request):
     try:
-        if not await validate_auth_token(request):
-            return
-    
-        if not await validate_request(request, ['username', 'scammer_id', 'description']):
-            return await bad_request(request, "'username', 'scammer_id' or 'description' is missing.")
+        if not request.headers.get_first(b'authorization'):
+            return MISSING_AUTH_TOKEN()
+
+        data, errors = await REPORT_SCHEMA.parse(request)
+        if errors:
+            return validation_error(errors)
 
-        data = await request.json()
+        if not await validate_auth_token(request, data['scammer_id']):
+            return INVALID_AUTH_TOKEN()
+        if request.banned:
+            return REPORTING_BANNED()
+        if request.already_reported:
+            return ALREADY_REPORTED()
 
-        if await has_reported(request.discordid, data['scammer_id']):
-            return await conflict(request, 'You have already reported this user')
+        # Concurrent reports share one gateway round trip and known players
+        # come from the cache, so this rarely waits on the network.
+        problem = await check_player(data['username'], data['scammer_id'])
+        if problem is not None:
+            return error_response(400, ['body', 'username'], problem, 'value_error.player')
 
-        await add_report(
+        result = await submit_report(
             data['username'], data['scammer_id'], data['description'],
-            request.discordid, request.client_ip
+            request.discordid, request.client_ip, request.registered_at, signature(data['description'])
         )
-        reports_count = await get_total_reports_for_scammer(data['scammer_id'])
-        return await success(request, 'Report submitted successfully', {'reports_count': reports_count})
+        if result is None:
+            return ALREADY_REPORTED()
+
+        return json_response({
+            "success": True,
+            "message": "Report submitted successfully",
+            **result
+        })
     except Exception as error:
-        return json({"error": f"Something bad happened: {error}"}, status=500)
+        return json_response({"error": f"Something bad happened: {error}"}, status=500)
     
 def register_reporting_routes(app: Application) -> None:
     app.router.add_post("/api/v1/reporting/report-user", report_user)
@@ -0,0 +1,68 @@
+from blacksheep import Application, Request, Response
+from mspscammers.cache import MISSING, scammer_stats as scammer_stats_cache
+from mspscammers.database import get_scammer_stats, get_scammer_stats_many
+from mspscammers.metrics import timed_route
+from mspscammers.reputation import current_score
+from mspscammers.requests import Field, Schema
+from mspscammers.responses import json_response, validation_error
+from typing import Any, Dict, Optional
+
+MAX_LOOKUP_IDS = 1000
+
+LOOKUP_SCHEMA = Schema(
+    Field("scammer_ids", list, min_length=0, max_length=MAX_LOOKUP_IDS, items=str),
+)
+
+def scammer_summary(scammer_id: str, stats: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if stats is None:
+        return {
+            "scammer_id": scammer_id,
+            "reported": False,
+            "reports_count": 0,
+            "distinct_reporters": 0,
+            "distinct_ips": 0,
+            "first_report_at": None,
+            "last_report_at": None,
+            "reputation": 0.0
+        }
+    summary = {"scammer_id": scammer_id, "reported": True, **stats}
+    # The stored score is as of score_at; decay it to now on the way out.
+    summary["reputation"] = round(current_score(summary.pop("score"), summary.pop("score_at")), 4)
+    return summary
+
+@timed_route
+async def get_scammer(request: Request) -> Response:
+    scammer_id = request.route_values["scammer_id"]
+    stats = await scammer_stats_cache.get_or_load(scammer_id, lambda: get_scammer_stats(scammer_id))
+    return json_response(scammer_summary(scammer_id, stats))
+
+@timed_route
+async def lookup_scammers(request: Request) -> Response:
+    data, errors = await LOOKUP_SCHEMA.parse(request)
+    if errors:
+        return validation_error(errors)
+    scammer_ids = data["scammer_ids"]
+
+    results: Dict[str, Optional[Dict[str, Any]]] = {}
+    missing = []
+    for scammer_id in dict.fromkeys(scammer_ids):
+        stats = scammer_stats_cache.get(scammer_id)
+        if stats is MISSING:
+            missing.append(scammer_id)
+        else:
+            results[scammer_id] = stats
+
+    if missing:
+        found = await get_scammer_stats_many(missing)
+        for scammer_id in missing:
+            stats = found.get(scammer_id)
+            scammer_stats_cache.set(scammer_id, stats)
+            results[scammer_id] = stats
+
+    return json_response({
+        "scammers": [scammer_summary(scammer_id, stats) for scammer_id, stats in results.items()]
+    })
+
+def register_scammer_routes(app: Application) -> None:
+    app.router.add_get("/api/v1/scammers/{scammer_id}", get_scammer)
+    app.router.add_post("/api/v1/scammers/lookup", lookup_scammers)
@@ -0,0 +1,108 @@
+import os
+
+DATABASE_DIR = os.environ.get("MSPSCAMMERS_DATABASE_DIR", "databases")
+# "split" keeps users, reports and bans in their own files, "single" keeps them in one.
+DATABASE_MODE = os.environ.get("MSPSCAMMERS_DATABASE_MODE", "split")
+DATABASE_READERS = int(os.environ.get("MSPSCAMMERS_DATABASE_READERS", "4"))
+
+CACHE_MAXSIZE = int(os.environ.get("MSPSCAMMERS_CACHE_MAXSIZE", "50000"))
+CACHE_TTL = float(os.environ.get("MSPSCAMMERS_CACHE_TTL", "300"))
+CACHE_NEGATIVE_TTL = float(os.environ.get("MSPSCAMMERS_CACHE_NEGATIVE_TTL", "5"))
+
+SHARED_CACHE_SOCKET = os.environ.get("MSPSCAMMERS_SHARED_CACHE_SOCKET", "")
+SHARED_CACHE_TIMEOUT = float(os.environ.get("MSPSCAMMERS_SHARED_CACHE_TIMEOUT", "0.05"))
+
+ADMIN_TOKEN = os.environ.get("MSPSCAMMERS_ADMIN_TOKEN", "")
+
+REPORT_BATCH_SIZE = int(os.environ.get("MSPSCAMMERS_REPORT_BATCH_SIZE", "256"))
+REPORT_BATCH_DELAY = float(os.environ.get("MSPSCAMMERS_REPORT_BATCH_DELAY", "0.002"))
+
+# Token bucket limits as "<requests>/<seconds>". Set MSPSCAMMERS_RATE_LIMIT=0 to turn
+# the limiter off, e.g. for benchmarks.
+RATE_LIMIT_ENABLED = os.environ.get("MSPSCAMMERS_RATE_LIMIT", "1") != "0"
+RATE_LIMIT_REPORTS = os.environ.get("MSPSCAMMERS_RATE_LIMIT_REPORTS", "10/60")
+RATE_LIMIT_REGISTRATION = os.environ.get("MSPSCAMMERS_RATE_LIMIT_REGISTRATION", "5/3600")
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get("MSPSCAMMERS_RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+# Database calls slower than this many milliseconds are logged; 0 turns the log off.
+SLOW_QUERY_MS = float(os.environ.get("MSPSCAMMERS_SLOW_QUERY_MS", "0"))
+
+# Secret key for HMAC auth tokens. Tokens are plain SHA-256 hashes of the Discord
+# user ID while it is unset; existing tokens keep working after it is set.
+AUTH_TOKEN_SECRET = os.environ.get("MSPSCAMMERS_AUTH_TOKEN_SECRET", "")
+
+# Comma separated "<version>:<secret>" keys for signed auth tokens, the signing key
+# first. When set, new users get signed tokens that are verified without a database
+# lookup; keep retired keys listed until the tokens they signed should stop working.
+AUTH_SIGNING_KEYS = os.environ.get("MSPSCAMMERS_AUTH_SIGNING_KEYS", "")
+# Seconds a signed token stays valid for; 0 for no expiry.
+AUTH_TOKEN_MAX_AGE = float(os.environ.get("MSPSCAMMERS_AUTH_TOKEN_MAX_AGE", "0"))
+
+DISCORD_CLIENT_ID = os.environ.get("MSPSCAMMERS_DISCORD_CLIENT_ID", "1200476142554062941")
+DISCORD_CLIENT_SECRET = os.environ.get("MSPSCAMMERS_DISCORD_CLIENT_SECRET", "")
+DISCORD_REDIRECT_URI = os.environ.get("MSPSCAMMERS_DISCORD_REDIRECT_URI", "https://msp-scammers.fr/discord/callback")
+# Point these at a local stub to test the OAuth flow without Discord.
+DISCORD_AUTHORIZE_URL = os.environ.get("MSPSCAMMERS_DISCORD_AUTHORIZE_URL", "https://discord.com/api/oauth2/authorize")
+DISCORD_API_URL = os.environ.get("MSPSCAMMERS_DISCORD_API_URL", "https://discord.com/api/v10")
+DISCORD_TIMEOUT = float(os.environ.get("MSPSCAMMERS_DISCORD_TIMEOUT", "5"))
+DISCORD_RETRIES = int(os.environ.get("MSPSCAMMERS_DISCORD_RETRIES", "3"))
+
+TEMPLATES_DIR = os.environ.get("MSPSCAMMERS_TEMPLATES_DIR", "templates")
+# Reload templates when their files change; meant for development.
+TEMPLATES_RELOAD = os.environ.get("MSPSCAMMERS_TEMPLATES_RELOAD", "0") == "1"
+
+# Reputation scoring. Reports lose half their weight every half-life, accounts
+# younger than REPUTATION_NEW_ACCOUNT_DAYS start at REPUTATION_NEW_ACCOUNT_WEIGHT,
+# and a reporter with REPUTATION_HISTORY_SCALE reports counts half as much as a
+# first-time one. Changing these needs POST /api/v1/admin/reputation/recompute.
+REPUTATION_HALF_LIFE_DAYS = float(os.environ.get("MSPSCAMMERS_REPUTATION_HALF_LIFE_DAYS", "180"))
+REPUTATION_NEW_ACCOUNT_DAYS = float(os.environ.get("MSPSCAMMERS_REPUTATION_NEW_ACCOUNT_DAYS", "30"))
+REPUTATION_NEW_ACCOUNT_WEIGHT = float(os.environ.get("MSPSCAMMERS_REPUTATION_NEW_ACCOUNT_WEIGHT", "0.25"))
+REPUTATION_HISTORY_SCALE = float(os.environ.get("MSPSCAMMERS_REPUTATION_HISTORY_SCALE", "100"))
+
+# Brigading detection. Reports whose descriptions are estimated at least
+# BRIGADING_SIMILARITY alike are near-duplicates; one is flagged when its
+# near-duplicate came from the same network, or when BRIGADING_MIN_CLUSTER of
+# them pile up against a scammer. Flagged reports weigh BRIGADING_WEIGHT.
+BRIGADING_SIMILARITY = float(os.environ.get("MSPSCAMMERS_BRIGADING_SIMILARITY", "0.8"))
+BRIGADING_MIN_CLUSTER = int(os.environ.get("MSPSCAMMERS_BRIGADING_MIN_CLUSTER", "3"))
+BRIGADING_WEIGHT = float(os.environ.get("MSPSCAMMERS_BRIGADING_WEIGHT", "0.1"))
+# Signatures kept in memory per scammer, for how long, and for how many scammers.
+BRIGADING_PER_SCAMMER = int(os.environ.get("MSPSCAMMERS_BRIGADING_PER_SCAMMER", "200"))
+BRIGADING_WINDOW_DAYS = float(os.environ.get("MSPSCAMMERS_BRIGADING_WINDOW_DAYS", "30"))
+BRIGADING_MAX_SCAMMERS = int(os.environ.get("MSPSCAMMERS_BRIGADING_MAX_SCAMMERS", "100000"))
+
+# Live report feed. Subscribers that let this many events pile up are
+# disconnected; both endpoints send a keepalive after FEED_KEEPALIVE idle seconds.
+FEED_QUEUE_SIZE = int(os.environ.get("MSPSCAMMERS_FEED_QUEUE_SIZE", "1000"))
+FEED_KEEPALIVE = float(os.environ.get("MSPSCAMMERS_FEED_KEEPALIVE", "15"))
+
+# MSP player checks. When a gateway URL is set, the username of every report
+# is resolved through the AMF gateway and must belong to the reported player.
+MSP_GATEWAY_URL = os.environ.get("MSPSCAMMERS_MSP_GATEWAY_URL", "")
+MSP_RESOLVE_METHOD = os.environ.get(
+    "MSPSCAMMERS_MSP_RESOLVE_METHOD", "MovieStarPlanet.WebService.UserSession.AMFUserSessionService.GetActorIdFromName"
+)
+MSP_TIMEOUT = float(os.environ.get("MSPSCAMMERS_MSP_TIMEOUT", "5"))
+MSP_CONCURRENCY = int(os.environ.get("MSPSCAMMERS_MSP_CONCURRENCY", "8"))
+MSP_BATCH_SIZE = int(os.environ.get("MSPSCAMMERS_MSP_BATCH_SIZE", "50"))
+MSP_BATCH_DELAY = float(os.environ.get("MSPSCAMMERS_MSP_BATCH_DELAY", "0.005"))
+MSP_PROFILE_TTL = float(os.environ.get("MSPSCAMMERS_MSP_PROFILE_TTL", "3600"))
+MSP_NEGATIVE_TTL = float(os.environ.get("MSPSCAMMERS_MSP_NEGATIVE_TTL", "300"))
+
+# Background maintenance: every MAINTENANCE_INTERVAL seconds (0 turns it off) one
+# worker archives old reports, frees unused pages, refreshes query planner
+# statistics and checkpoints the WAL, pausing MAINTENANCE_PAUSE seconds between
+# small steps and for as long as reports are waiting to be written.
+MAINTENANCE_INTERVAL = float(os.environ.get("MSPSCAMMERS_MAINTENANCE_INTERVAL", "3600"))
+MAINTENANCE_PAUSE = float(os.environ.get("MSPSCAMMERS_MAINTENANCE_PAUSE", "0.05"))
+VACUUM_PAGES = int(os.environ.get("MSPSCAMMERS_VACUUM_PAGES", "256"))
+# Reports older than this many days move to reports-archive.db; 0 keeps them all.
+ARCHIVE_AFTER_DAYS = float(os.environ.get("MSPSCAMMERS_ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("MSPSCAMMERS_ARCHIVE_BATCH_SIZE", "500"))
+# Online backups into timestamped folders under BACKUP_DIR, every BACKUP_INTERVAL
+# seconds, keeping the newest BACKUP_KEEP. Unset BACKUP_DIR to turn them off.
+BACKUP_DIR = os.environ.get("MSPSCAMMERS_BACKUP_DIR", "")
+BACKUP_INTERVAL = float(os.environ.get("MSPSCAMMERS_BACKUP_INTERVAL", "86400"))
+BACKUP_KEEP = int(os.environ.get("MSPSCAMMERS_BACKUP_KEEP", "7"))
+BACKUP_PAGES = int(os.environ.get("MSPSCAMMERS_BACKUP_PAGES", "256"))
@@ -1,15 +1,20 @@
-from mspscammers.hashing import create_sha256_hash
+import hmac
+from typing import Iterable, List
+
+from mspscammers import settings
+from mspscammers.hashing import create_hmac_sha256, create_hmac_sha256_hashes, create_sha256_hash, create_sha256_hashes
 
 class AuthtokenManager(type):
     """
     A metaclass for managing authentication tokens.
 
-    This metaclass dynamically adds the `create_auth_token` method to classes that use it.
+    This metaclass dynamically adds the `create_auth_token`, `create_auth_tokens` and
+    `verify_auth_token` methods to classes that use it.
     """
 
     def __new__(cls, name, bases, attrs):
         """
-        Create a new class with the `create_auth_token` method added.
+        Create a new class with the token methods added.
 
         Parameters:
         cls (type): The metaclass.
@@ -18,9 +23,11 @@ class AuthtokenManager(type):
         attrs (dict): The attributes of the class being created.
 
         Returns:
-        type: The newly created class with the `create_auth_token` method added.
+        type: The newly created class with the token methods added.
         """
         attrs['create_auth_token'] = cls.create_auth_token
+        attrs['create_auth_tokens'] = cls.create_auth_tokens
+        attrs['verify_auth_token'] = cls.verify_auth_token
         return super().__new__(cls, name, bases, attrs)
 
     @staticmethod
@@ -28,16 +35,50 @@ class AuthtokenManager(type):
         """
         Create an authentication token for the given Discord user ID.
 
-        This method generates a SHA-1 hash of the provided Discord user ID.
+        When `MSPSCAMMERS_AUTH_TOKEN_SECRET` is set the token is an HMAC-SHA-256 of the
+        Discord user ID under that secret, so it cannot be derived from the ID alone and
+        can be verified by recomputing it. Without a secret it is a plain SHA-256 hash
+        of the ID, as tokens issued before the secret existed are.
 
         Parameters:
         discord_user_id (str): The Discord user ID for which to create an auth token.
 
         Returns:
-        str: The SHA-1 hash of the Discord user ID, serving as the authentication token.
-        
+        str: The hex encoded token.
+
         Usage:
         >>> AuthtokenManager.create_auth_token("1234567890")
-        'e807f1fcf82d132f9bb018ca6738a19f0b0e6f89'
+        'c775e7b757ede630cd0aa1113bd102661ab38829ca52a6422ab782862f268646'
         """
+        if settings.AUTH_TOKEN_SECRET:
+            return create_hmac_sha256(discord_user_id, settings.AUTH_TOKEN_SECRET.encode('utf-8'))
         return create_sha256_hash(discord_user_id)
+
+    @staticmethod
+    def create_auth_tokens(discord_user_ids: Iterable[str]) -> List[str]:
+        """
+        Create authentication tokens for many Discord user IDs at once.
+
+        Parameters:
+        discord_user_ids (iterable of str): The Discord user IDs.
+
+        Returns:
+        list of str: The token of each Discord user ID, in order.
+        """
+        if settings.AUTH_TOKEN_SECRET:
+            return create_hmac_sha256_hashes(discord_user_ids, settings.AUTH_TOKEN_SECRET.encode('utf-8'))
+        return create_sha256_hashes(discord_user_ids)
+
+    @staticmethod
+    def verify_auth_token(discord_user_id: str, auth_token: str) -> bool:
+        """
+        Check that a token belongs to a Discord user ID by recomputing it, in constant time.
+
+        Parameters:
+        discord_user_id (str): The Discord user ID the token claims to belong to.
+        auth_token (str): The token to check.
+
+        Returns:
+        bool: Whether the token is the one issued for the Discord user ID.
+        """
+        return hmac.compare_digest(AuthtokenManager.create_auth_token(discord_user_id), auth_token)
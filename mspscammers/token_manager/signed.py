@@ -0,0 +1,160 @@
+import base64
+import hashlib
+import hmac
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from mspscammers import settings
+from mspscammers.cache import LOCAL_EVENTS, publish_event
+
+
+def parse_keys(value: str) -> Dict[str, bytes]:
+    """
+    Parses `MSPSCAMMERS_AUTH_SIGNING_KEYS`, a comma separated list of
+    `<version>:<secret>` pairs with the signing key first.
+    """
+    keys = {}
+    for pair in value.split(','):
+        version, _, secret = pair.strip().partition(':')
+        if not version or not secret or '.' in version:
+            raise ValueError(f"Invalid signing key {pair.strip()!r}, expected '<version>:<secret>'")
+        keys[version] = secret.encode('utf-8')
+    return keys
+
+
+def _b36(number: int) -> str:
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    encoded = ''
+    while True:
+        number, digit = divmod(number, 36)
+        encoded = digits[digit] + encoded
+        if not number:
+            return encoded
+
+
+def _split(auth_token: str) -> Optional[Tuple[str, str, str, str]]:
+    version, _, rest = auth_token.partition('.')
+    parts = rest.rsplit('.', 2)
+    if len(parts) != 3 or not all(parts):
+        return None
+    return version, parts[0], parts[1], parts[2]
+
+
+class SignedTokens:
+    """
+    Issues and verifies stateless auth tokens.
+
+    A token reads `<key version>.<discord user id>.<issued at>.<signature>`.
+    Only the user ID may itself contain dots, so it is whatever lies between
+    the first separator and the last two.
+    The signature is a truncated HMAC-SHA-256 over the other three parts and
+    the IP address the token was issued to, so a token only verifies from
+    that address and checking one needs no database lookup. Keys are looked
+    up by version, so old keys can stay listed after the signing key rotates
+    until the tokens they signed are no longer wanted.
+    """
+
+    SIGNATURE_BYTES = 16
+
+    def __init__(self, keys: Dict[str, bytes], max_age: float = 0):
+        """
+        Initializes the SignedTokens.
+
+        Args:
+            keys (Dict[str, bytes]): Secrets by key version, the signing key first.
+            max_age (float): Seconds a token stays valid for; 0 for no expiry.
+        """
+        self.keys = keys
+        self.version = next(iter(keys), None)
+        self.max_age = max_age
+        self._revoked: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.version is not None
+
+    @staticmethod
+    def is_signed(auth_token: str) -> bool:
+        # Database tokens are hex digests and never contain a dot.
+        return '.' in auth_token
+
+    def _signature(self, key: bytes, claims: str, ip_address: str) -> str:
+        digest = hmac.new(key, f'{claims}|{ip_address}'.encode('utf-8'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:self.SIGNATURE_BYTES]).rstrip(b'=').decode('ascii')
+
+    def issue(self, discord_user_id: str, ip_address: str, issued_at: Optional[int] = None) -> str:
+        if not self.enabled:
+            raise RuntimeError("No signing key is configured")
+        if issued_at is None:
+            issued_at = int(time.time() * 1000)
+        claims = f'{self.version}.{discord_user_id}.{_b36(issued_at)}'
+        return f'{claims}.{self._signature(self.keys[self.version], claims, ip_address)}'
+
+    def verify(self, auth_token: str, ip_address: str) -> Optional[str]:
+        """
+        Checks a token against the client's IP address.
+
+        Returns:
+            Optional[str]: The Discord user ID the token was issued to, or None
+            if it is malformed, forged, bound to another IP, expired or revoked.
+        """
+        parts = _split(auth_token)
+        if parts is None:
+            return None
+        version, discord_user_id, issued_at, signature = parts
+        key = self.keys.get(version)
+        if key is None:
+            return None
+        claims = f'{version}.{discord_user_id}.{issued_at}'
+        if not hmac.compare_digest(self._signature(key, claims, ip_address), signature):
+            return None
+        issued_at = int(issued_at, 36)
+        if self.max_age and issued_at + self.max_age * 1000 < time.time() * 1000:
+            return None
+        if issued_at < self._revoked.get(discord_user_id, 0):
+            return None
+        return discord_user_id
+
+    @staticmethod
+    def issued_at(auth_token: str) -> Optional[float]:
+        """
+        Returns when a verified token was issued, as a Unix timestamp.
+        """
+        parts = _split(auth_token)
+        if parts is None:
+            return None
+        try:
+            return int(parts[2], 36) / 1000
+        except ValueError:
+            return None
+
+    def revoke(self, discord_user_id: str, revoked_before: int) -> None:
+        self._revoked[discord_user_id] = max(revoked_before, self._revoked.get(discord_user_id, 0))
+
+    def load_revocations(self, revocations: Iterable[Tuple[str, int]]) -> None:
+        self._revoked = dict(revocations)
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+
+signed_tokens = SignedTokens(
+    parse_keys(settings.AUTH_SIGNING_KEYS) if settings.AUTH_SIGNING_KEYS else {},
+    max_age=settings.AUTH_TOKEN_MAX_AGE,
+)
+
+
+def _apply_revocation(discord_user_id: str, revoked_before: int) -> None:
+    signed_tokens.revoke(discord_user_id, revoked_before)
+
+
+LOCAL_EVENTS['revoke_tokens'] = _apply_revocation
+
+
+def record_revocation(discord_user_id: str, revoked_before: int) -> None:
+    """
+    Rejects the user's tokens issued before `revoked_before` (Unix time in
+    milliseconds) in this worker and, through the shared cache tier when it
+    is running, in every other worker.
+    """
+    publish_event('revoke_tokens', discord_user_id, revoked_before)
@@ -0,0 +1,35 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# Settings are read once at import, so the databases are pointed at a scratch
+# directory before anything from mspscammers is imported.
+os.environ["MSPSCAMMERS_DATABASE_DIR"] = tempfile.mkdtemp(prefix="mspscammers-test-")
+
+
+@pytest.fixture(scope="session")
+def run():
+    # The database pools and the report queue are module globals bound to the
+    # loop they were first used on, so every test using them shares one loop.
+    with asyncio.Runner() as runner:
+        yield runner.run
+
+
+@pytest.fixture(scope="session")
+def database(run):
+    import mspscammers.database as database
+    from mspscammers.database import maintenance
+
+    async def setup():
+        await database.open_databases()
+        await database.create_ban_database()
+        await database.create_report_database()
+        await database.create_user_database()
+        await database.migrate_databases()
+
+    run(setup())
+    yield database
+    run(maintenance.archive_pool.close())
+    run(database.close_databases())
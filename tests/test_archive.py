@@ -0,0 +1,27 @@
+from mspscammers.database import maintenance
+
+
+async def _re_report_after_archival(database):
+    assert await database.add_report("s", "700", "stole my rares", "1", "10.0.0.1")
+    async with database.reports_pool.writer() as db:
+        await db.execute("UPDATE reports SET created_at = datetime('now', '-400 days') WHERE scammer_id = '700'")
+        await db.commit()
+    before = await database.get_scammer_stats("700")
+
+    assert await maintenance.archive_reports(365) == 1
+    assert await database.get_total_reports_for_scammer("700") == 1
+
+    # The report is gone from reports, but its reporter still cannot file it again.
+    assert not await database.add_report("s", "700", "stole my rares again", "1", "10.0.0.1")
+    assert await database.submit_report("s", "700", "and again", "1", "10.0.0.1") is None
+    after = await database.get_scammer_stats("700")
+    for field in ("reports_count", "distinct_reporters", "distinct_ips", "score"):
+        assert after[field] == before[field], field
+
+    # Another reporter is still welcome.
+    assert await database.add_report("s", "700", "took my items", "2", "10.0.0.2")
+    assert await database.get_total_reports_for_scammer("700") == 2
+
+
+def test_re_report_after_archival(run, database):
+    run(_re_report_after_archival(database))
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from mspscammers.database.batching import _CLOSE, WriteQueue
+from mspscammers.database.pool import ConnectionPool
+
+
+async def _insert(db, value):
+    if value < 0:
+        raise ValueError(value)
+    await db.execute('INSERT INTO items (value) VALUES (?)', (value,))
+    if value == 13:
+        # Fails after the row is written, so only the savepoint can undo it.
+        raise RuntimeError('unlucky')
+    return value
+
+
+async def _with_queue(test, **options):
+    with tempfile.TemporaryDirectory() as directory:
+        pool = ConnectionPool(os.path.join(directory, 'test.db'), readers=1)
+        await pool.open()
+        async with pool.writer() as db:
+            await db.execute('CREATE TABLE items (value INTEGER)')
+            await db.commit()
+        queue = WriteQueue(pool, _insert, **options)
+        try:
+            await test(pool, queue)
+        finally:
+            await queue.close()
+            await pool.close()
+
+
+async def _values(pool):
+    async with pool.reader() as db:
+        async with db.execute('SELECT value FROM items ORDER BY value') as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+def test_failing_write_is_rolled_back_alone():
+    async def test(pool, queue):
+        queue.start()
+        results = await asyncio.gather(
+            *(queue.submit(value) for value in (1, -1, 2, 13, 3)),
+            return_exceptions=True,
+        )
+        assert results[0::2] == [1, 2, 3]
+        assert isinstance(results[1], ValueError)
+        assert isinstance(results[3], RuntimeError)
+        assert queue.batches == 1
+        assert await _values(pool) == [1, 2, 3]
+
+    asyncio.run(_with_queue(test, max_delay=0.01))
+
+
+def test_submit_without_running_queue_writes_directly():
+    async def test(pool, queue):
+        assert await queue.submit(5) == 5
+        with pytest.raises(ValueError):
+            await queue.submit(-5)
+        assert await _values(pool) == [5]
+
+    asyncio.run(_with_queue(test))
+
+
+def test_close_flushes_writes_queued_behind_the_marker():
+    async def test(pool, queue):
+        pending = []
+        queue._queue.put_nowait(_CLOSE)
+        for value in (1, 2):
+            future = asyncio.get_running_loop().create_future()
+            queue._queue.put_nowait(((value,), future))
+            pending.append(future)
+        queue.start()
+        assert await asyncio.wait_for(asyncio.gather(*pending), 1) == [1, 2]
+        assert await _values(pool) == [1, 2]
+
+    asyncio.run(_with_queue(test))
+
+
+def test_cancelled_queue_fails_pending_writes():
+    async def test(pool, queue):
+        queue.start()
+        pending = [asyncio.ensure_future(queue.submit(value)) for value in (1, 2)]
+        await asyncio.sleep(0)
+        queue._task.cancel()
+        results = await asyncio.wait_for(asyncio.gather(*pending, return_exceptions=True), 1)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        queue._task = None
+
+    asyncio.run(_with_queue(test, max_delay=0.5))
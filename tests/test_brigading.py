@@ -0,0 +1,168 @@
+import asyncio
+
+import aiosqlite
+
+from mspscammers import brigading, settings
+from mspscammers.brigading import BrigadingIndex, network, signature, similarity
+
+PASTE = "He asked me to trade my diamond rare outfit and then blocked me after I sent everything over"
+
+
+def _index(**options):
+    values = dict(threshold=0.8, min_cluster=3, per_scammer=10, window=3600, max_scammers=2)
+    values.update(options)
+    return BrigadingIndex(**values)
+
+
+def test_signature_similarity():
+    first = signature(PASTE)
+    assert len(first) == brigading.PERMUTATIONS * 4
+    assert signature(PASTE.upper() + "!!") == first
+    assert similarity(first, signature(PASTE + " quickly")) >= 0.8
+    assert similarity(first, signature("Sold me a fake rare and logged off")) < 0.3
+    assert signature("") == signature("   ")
+
+
+def test_network():
+    assert network("10.0.0.7") == "10.0.0.0/24"
+    assert network("2001:db8::1") == "2001:db8::/64"
+    assert network(None) is None
+    assert network("not an address") is None
+
+
+def test_same_network_near_duplicate_is_flagged():
+    index = _index()
+    assert index.check("5", "10.0.0.1", signature(PASTE)) is None
+    index.add("5", 1, "10.0.0.1", signature(PASTE))
+    assert index.check("5", "10.0.0.2", signature(PASTE)) == 1
+    # From elsewhere, one near-duplicate is not yet a cluster.
+    assert index.check("5", "192.168.1.1", signature(PASTE)) is None
+    # Other scammers and other descriptions are unaffected.
+    assert index.check("6", "10.0.0.2", signature(PASTE)) is None
+    assert index.check("5", "10.0.0.2", signature("Sold me a fake rare and logged off")) is None
+
+
+def test_cluster_from_many_networks_is_flagged():
+    index = _index()
+    index.add("5", 1, "10.0.0.1", signature(PASTE))
+    index.add("5", 2, "10.0.1.1", signature(PASTE))
+    assert index.check("5", "10.0.2.1", signature(PASTE)) in (1, 2)
+
+
+def test_old_and_excess_signatures_are_evicted():
+    index = _index(per_scammer=2, window=100)
+    index.add("5", 1, "10.0.0.1", signature(PASTE), seen_at=0)
+    index.add("5", 2, "10.0.1.1", signature("something else entirely"), seen_at=50)
+    index.add("5", 3, "10.0.2.1", signature("and a third one"), seen_at=60)
+    assert len(index) == 2
+    index.add("6", 4, "10.0.0.1", signature(PASTE))
+    index.add("7", 5, "10.0.0.1", signature(PASTE))
+    assert index.scammers == 2
+    assert index.check("5", "10.0.0.2", signature(PASTE)) is None
+
+
+def test_pending_reports_are_kept_or_discarded():
+    index = _index()
+    index.add_pending("5", 1, "10.0.0.1", signature(PASTE))
+    # Pending reports are already compared with.
+    assert index.check("5", "10.0.0.2", signature(PASTE)) == 1
+
+    index.discard(1)
+    assert len(index) == 0
+    assert index.check("5", "10.0.0.2", signature(PASTE)) is None
+
+    index.add_pending("5", 2, "10.0.0.1", signature(PASTE))
+    # Committing adds nothing twice.
+    index.add("5", 2, "10.0.0.1", signature(PASTE))
+    assert len(index) == 1
+    index.discard(2)
+    assert len(index) == 1
+
+    # A pending ID reused by another report is replaced, not confirmed.
+    index.add_pending("5", 3, "10.0.0.1", signature(PASTE))
+    index.add("6", 3, "10.0.9.1", signature("something else entirely"))
+    assert len(index) == 2
+    assert index.check("5", "10.0.0.2", signature(PASTE)) == 2
+    assert not index._pending
+
+
+async def _reports(database, scammer_id):
+    async with database.reports_pool.reader() as db:
+        async with db.execute(
+            "SELECT id, duplicate_of, weight FROM reports WHERE scammer_id = ? ORDER BY id", (scammer_id,)
+        ) as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+
+async def _burst(database, scammer_id, reporters):
+    return await asyncio.gather(*(
+        database.submit_report("s", scammer_id, PASTE, f"{scammer_id}-{index}", f"10.{scammer_id}.0.{index}")
+        for index in reporters
+    ), return_exceptions=True)
+
+
+def test_reports_in_one_batch_are_compared(run, database):
+    batches = database.report_queue.batches
+    results = run(_burst(database, "91", range(10)))
+    assert all(isinstance(result, dict) for result in results)
+    assert database.report_queue.batches == batches + 1
+
+    rows = run(_reports(database, "91"))
+    assert len(rows) == 10
+    first_id = rows[0][0]
+    assert rows[0][1] is None
+    assert all(duplicate_of == first_id for _, duplicate_of, _ in rows[1:])
+    assert all(weight < rows[0][2] * settings.BRIGADING_WEIGHT * 1.01 for _, _, weight in rows[1:])
+    assert brigading.brigading_index.check("91", "10.91.0.200", signature(PASTE)) is not None
+    assert not brigading.brigading_index._pending
+
+
+def test_rolled_back_batch_leaves_nothing_indexed(run, database, monkeypatch):
+    async def fail(self):
+        raise aiosqlite.OperationalError("disk I/O error")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(aiosqlite.Connection, "commit", fail)
+        results = run(_burst(database, "92", range(3)))
+        assert all(isinstance(result, aiosqlite.OperationalError) for result in results)
+
+    assert run(_reports(database, "92")) == []
+    assert not brigading.brigading_index._pending
+    assert brigading.brigading_index.check("92", "10.92.0.1", signature(PASTE)) is None
+
+    # The reports can be sent again, and are judged as if the failed batch never happened.
+    run(_burst(database, "92", range(1)))
+    assert [duplicate_of for _, duplicate_of, _ in run(_reports(database, "92"))] == [None]
+
+
+async def _execute(database, sql):
+    async with database.reports_pool.writer() as db:
+        await db.execute(sql)
+        await db.commit()
+
+
+def test_failing_write_in_a_batch_is_not_indexed(run, database):
+    # The second reporter's write fails after its report row was inserted.
+    run(_execute(database, """
+        CREATE TRIGGER fail_report BEFORE INSERT ON scammer_ip_stats WHEN NEW.ip_address = '10.93.0.1'
+        BEGIN SELECT RAISE(ABORT, 'failed after insert'); END
+    """))
+    try:
+        results = run(_burst(database, "93", range(3)))
+    finally:
+        run(_execute(database, "DROP TRIGGER fail_report"))
+    assert isinstance(results[1], aiosqlite.IntegrityError)
+    rows = run(_reports(database, "93"))
+    assert len(rows) == 2
+    assert rows[1][1] == rows[0][0]
+    # Only the two committed reports are indexed.
+    assert len(brigading.brigading_index._scammers["93"].entries) == 2
+    assert not brigading.brigading_index._pending
+
+
+def test_direct_report_is_indexed_once(run, database):
+    assert run(database.add_report("s", "94", PASTE, "94-0", "10.94.0.1"))
+    assert run(database.add_report("s", "94", PASTE, "94-1", "10.94.0.2"))
+    rows = run(_reports(database, "94"))
+    assert rows[1][1] == rows[0][0]
+    assert len(brigading.brigading_index._scammers["94"].entries) == 2
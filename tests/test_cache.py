@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+from mspscammers import cache
+from mspscammers.cache import MISSING, TTLCache
+
+
+def _auth_cache():
+    return TTLCache('test_auth', maxsize=3, ttl=60, negative_ttl=1, owner=lambda value: value[1])
+
+
+def test_lru_eviction_and_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    entries = TTLCache('test', maxsize=2, ttl=10, negative_ttl=1)
+    entries.set('a', 1)
+    entries.set('b', None)
+    entries.set('c', 3)
+    assert entries.get('a') is MISSING
+    assert entries.evictions == 1
+
+    now[0] += 2
+    # Negative results expire sooner than positive ones.
+    assert entries.get('b') is MISSING
+    assert entries.get('c') == 3
+    now[0] += 10
+    assert entries.get('c') is MISSING
+    assert entries.expirations == 2
+
+
+def test_invalidate_owner_drops_only_that_owners_entries():
+    entries = _auth_cache()
+    entries.set('token-1', ('10.0.0.1', 'alice'))
+    entries.set('token-2', ('10.0.0.2', 'alice'))
+    entries.set('token-3', ('10.0.0.3', 'bob'))
+    entries.invalidate_owner('alice')
+    assert entries.peek('token-1') is MISSING
+    assert entries.peek('token-2') is MISSING
+    assert entries.peek('token-3') == ('10.0.0.3', 'bob')
+    assert entries._owned == {'bob': {'token-3'}}
+
+    # Replacing or evicting an entry keeps the owner index in step.
+    entries.set('token-3', ('10.0.0.3', 'carol'))
+    assert entries._owned == {'carol': {'token-3'}}
+    for index in range(4):
+        entries.set(f'other-{index}', ('10.0.0.4', 'dave'))
+    assert 'carol' not in entries._owned
+    assert len(entries._owned['dave']) == 3
+
+
+def test_concurrent_misses_share_one_load():
+    entries = _auth_cache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ('10.0.0.1', 'alice')
+
+    async def run():
+        return await asyncio.gather(*(entries.get_or_load('token', loader) for _ in range(5)))
+
+    assert asyncio.run(run()) == [('10.0.0.1', 'alice')] * 5
+    assert len(calls) == 1
+    assert entries.peek('token') == ('10.0.0.1', 'alice')
+
+
+def test_failed_load_is_not_cached():
+    entries = _auth_cache()
+
+    async def loader():
+        raise RuntimeError('database is locked')
+
+    async def run():
+        results = await asyncio.gather(*(entries.get_or_load('token', loader) for _ in range(2)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    asyncio.run(run())
+    assert entries.peek('token') is MISSING
+    assert not entries._inflight
+
+
+def _invalidated_during_load(invalidate):
+    entries = _auth_cache()
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def loader():
+        started.set()
+        await release.wait()
+        return ('10.0.0.1', 'alice')
+
+    async def run():
+        load = asyncio.ensure_future(entries.get_or_load('token', loader))
+        await started.wait()
+        invalidate(entries)
+        release.set()
+        # The caller still gets the row it loaded, but it is not kept.
+        assert await load == ('10.0.0.1', 'alice')
+
+    asyncio.run(run())
+    assert entries.peek('token') is MISSING
+    assert not entries._generations
+
+
+def test_invalidation_during_load_is_not_lost():
+    _invalidated_during_load(lambda entries: entries.invalidate('token'))
+    _invalidated_during_load(lambda entries: entries.invalidate_owner('alice'))
+    _invalidated_during_load(lambda entries: entries.clear())
+
+
+def test_invalidate_user_event():
+    registry = {'auth_tokens': _auth_cache(), 'user_ids': TTLCache('user_ids'), 'usernames': TTLCache('usernames')}
+    registry['auth_tokens'].set('token-1', ('10.0.0.1', 'alice'))
+    registry['auth_tokens'].set('token-2', ('10.0.0.2', 'bob'))
+    registry['user_ids'].set('alice', True)
+    registry['usernames'].set('Alice', True)
+    cache.apply_event(registry, 'invalidate_user', ['alice', 'Alice', None])
+    assert registry['auth_tokens'].peek('token-1') is MISSING
+    assert registry['auth_tokens'].peek('token-2') == ('10.0.0.2', 'bob')
+    assert registry['user_ids'].peek('alice') is MISSING
+    assert registry['usernames'].peek('Alice') is MISSING
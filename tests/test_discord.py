@@ -0,0 +1,137 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+import uvicorn
+from blacksheep import Request
+
+from benchmarks.discord_api import build_app
+from mspscammers.discord import DiscordClient, DiscordError
+from mspscammers.routes import discord_auth
+
+STATE = "expected-state"
+
+
+@asynccontextmanager
+async def _stub(**options):
+    server = uvicorn.Server(uvicorn.Config(build_app(**options), host="127.0.0.1", port=0, log_level="warning"))
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    client = DiscordClient(f"http://127.0.0.1:{port}/api/v10", "client", "secret", "http://testserver/discord/callback",
+                           timeout=2, retries=2, backoff=0.01)
+    try:
+        yield server.config.app, client
+    finally:
+        await client.close()
+        server.should_exit = True
+        await task
+
+
+async def _callback(client, code, ip="10.0.0.1"):
+    request = Request("GET", f"/discord/callback?code={code}&state={STATE}".encode(), [
+        (b"cookie", f"{discord_auth.STATE_COOKIE}={STATE}".encode()),
+    ])
+    request.scope = {"client": (ip, 1234)}
+    original, discord_auth.discord_client = discord_auth.discord_client, client
+    try:
+        response = await discord_auth.callback(request)
+    finally:
+        discord_auth.discord_client = original
+    return response.status, json.loads(response.content.body) if response.content else None
+
+
+def test_callback_registers_and_logs_in(run, database):
+    async def test():
+        async with _stub(client_secret="secret") as (stub, client):
+            status, body = await _callback(client, "user4242")
+            assert status == 200
+            user_data = body["user_data"]
+            assert user_data["discord_user_id"] == "4242"
+            assert user_data["discord_username"] == "user4242"
+            assert await database.get_auth_token_owner(user_data["auth_token"]) is not None
+
+            # Logging in again from elsewhere moves the account's token there.
+            status, body = await _callback(client, "user4242", ip="10.0.0.2")
+            assert status == 200
+            owner = await database.get_auth_token_owner(body["user_data"]["auth_token"])
+            assert owner[:2] == ("10.0.0.2", "4242")
+            assert stub.calls == {"token": 2, "users/@me": 2}
+
+    run(test())
+
+
+def test_callback_rejects_bad_state(run, database):
+    async def test():
+        async with _stub() as (stub, client):
+            request = Request("GET", b"/discord/callback?code=user1&state=forged", [
+                (b"cookie", f"{discord_auth.STATE_COOKIE}={STATE}".encode()),
+            ])
+            request.scope = {"client": ("10.0.0.1", 1234)}
+            response = await discord_auth.callback(request)
+            assert response.status == 400
+            assert stub.calls == {}
+
+    run(test())
+
+
+@pytest.mark.parametrize("options, code", [
+    ({"client_secret": "other secret"}, "user1"),  # 401 invalid_client
+    ({}, "not-a-code"),  # 400 invalid_grant
+])
+def test_callback_when_discord_refuses_the_code(run, database, options, code):
+    async def test():
+        async with _stub(**options) as (stub, client):
+            status, body = await _callback(client, code)
+            assert status == 400
+            assert body["detail"][0]["loc"] == ["query", "code"]
+            # Refusals are not retried.
+            assert stub.calls == {"token": 1}
+
+    run(test())
+
+
+def test_callback_retries_rate_limits(run, database):
+    async def test():
+        async with _stub(rate_limit=1, retry_after=0.01) as (stub, client):
+            status, body = await _callback(client, "user4343")
+            assert status == 200
+            assert body["user_data"]["discord_user_id"] == "4343"
+            assert stub.calls == {"token": 2, "users/@me": 2}
+
+    run(test())
+
+
+def test_callback_when_rate_limited_throughout(run, database):
+    async def test():
+        async with _stub(rate_limit=100, retry_after=0.01) as (stub, client):
+            status, body = await _callback(client, "user4444")
+            assert status == 502
+            assert stub.calls == {"token": 3}
+
+    run(test())
+
+
+def test_client_keeps_one_connection_alive(run):
+    async def test():
+        async with _stub() as (stub, client):
+            for _ in range(3):
+                access_token = await client.exchange_code("user1")
+                assert (await client.get_user(access_token))["id"] == "1"
+            pool = client._client._transport._pool
+            assert len(pool.connections) == 1
+
+    run(test())
+
+
+def test_unknown_access_token_is_refused(run):
+    async def test():
+        async with _stub() as (stub, client):
+            with pytest.raises(DiscordError) as error:
+                await client.get_user("not-a-token")
+            assert error.value.status == 401
+            assert stub.calls == {"users/@me": 1}
+
+    run(test())
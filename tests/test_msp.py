@@ -0,0 +1,118 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+import uvicorn
+
+from benchmarks.msp_gateway import build_app
+from mspscammers import msp
+from mspscammers.msp import MSPError, ProfileResolver, decode_lookups, encode_lookups
+
+METHOD = "Players.GetActorIdFromName"
+
+
+@asynccontextmanager
+async def _gateway(players=None, latency=0.0, **options):
+    server = uvicorn.Server(uvicorn.Config(build_app(players or {}, latency), host="127.0.0.1", port=0,
+                                          log_level="warning"))
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    resolver = ProfileResolver(f"http://127.0.0.1:{port}/Gateway.aspx", METHOD, timeout=2, **options)
+    msp.players.clear()
+    try:
+        yield server.config.app, resolver
+    finally:
+        await resolver.close()
+        server.should_exit = True
+        await task
+
+
+def test_envelope_round_trip():
+    from pyamf import remoting
+
+    request = remoting.decode(encode_lookups(METHOD, ["alice", "bob"]))
+    assert [(target, message.target, message.body) for target, message in request] == [
+        ("/1", METHOD, ["alice"]), ("/2", METHOD, ["bob"]),
+    ]
+    answer = remoting.Envelope(request.amfVersion)
+    for target, body in (("/1", 42), ("/2", 0), ("/7", 5)):
+        answer[target] = remoting.Response(body)
+    # Unknown names come back as 0 and targets outside the request are ignored.
+    assert decode_lookups(remoting.encode(answer).getvalue(), 2) == [42, None]
+
+    answer = remoting.Envelope(request.amfVersion)
+    answer["/1"] = remoting.Response("boom", status=remoting.STATUS_ERROR)
+    with pytest.raises(MSPError):
+        decode_lookups(remoting.encode(answer).getvalue(), 1)
+    with pytest.raises(MSPError):
+        decode_lookups(b"not amf", 1)
+
+
+def test_lookups_share_envelopes_and_the_cache():
+    async def test():
+        async with _gateway({"alice": 42}) as (gateway, resolver):
+            names = ["Alice", "alice ", "player7", "nobody"]
+            assert await asyncio.gather(*(resolver.resolve(name) for name in names)) == [42, 42, 7, None]
+            # Every name travelled in one envelope, "Alice" and "alice " as one body.
+            assert gateway.calls == 1
+            assert resolver.envelopes_sent == 1
+
+            # Answers, unknown names included, are served from the cache.
+            assert await resolver.resolve_many(["ALICE", "nobody"]) == {"ALICE": 42, "nobody": None}
+            assert gateway.calls == 1
+
+    asyncio.run(test())
+
+
+def test_batches_and_concurrency_are_bounded():
+    async def test():
+        async with _gateway(latency=0.1, concurrency=2, batch_size=2) as (gateway, resolver):
+            started = time.monotonic()
+            results = await resolver.resolve_many(f"player{n}" for n in range(1, 9))
+            elapsed = time.monotonic() - started
+            assert results == {f"player{n}": n for n in range(1, 9)}
+            # Four envelopes of two names, at most two of them at a time.
+            assert gateway.calls == 4
+            assert elapsed >= 0.2
+
+    asyncio.run(test())
+
+
+def test_unreachable_gateway():
+    async def test():
+        resolver = ProfileResolver("http://127.0.0.1:9/Gateway.aspx", METHOD, timeout=1)
+        msp.players.clear()
+        try:
+            with pytest.raises(MSPError):
+                await resolver.resolve("alice")
+            # Failures are not cached and names that failed are left out.
+            assert msp.players.peek("alice") is msp.MISSING
+            assert await resolver.resolve_many(["alice"]) == {}
+        finally:
+            await resolver.close()
+
+    asyncio.run(test())
+
+
+def test_check_player():
+    async def test():
+        async with _gateway({"alice": 42}) as (gateway, resolver):
+            original, msp.msp_resolver = msp.msp_resolver, resolver
+            try:
+                assert await msp.check_player("alice", "42") is None
+                assert await msp.check_player("alice", "43") == "'alice' is not the MSP player 43"
+                assert await msp.check_player("nobody", "1") == "No MSP player is named 'nobody'"
+                # Without a gateway reports are let through.
+                msp.msp_resolver = ProfileResolver("http://127.0.0.1:9/Gateway.aspx", METHOD, timeout=1)
+                msp.players.clear()
+                assert await msp.check_player("nobody", "1") is None
+                await msp.msp_resolver.close()
+                msp.msp_resolver = ProfileResolver("", METHOD)
+                assert await msp.check_player("nobody", "1") is None
+            finally:
+                msp.msp_resolver = original
+
+    asyncio.run(test())
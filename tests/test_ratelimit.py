@@ -0,0 +1,55 @@
+import pytest
+from blacksheep import Request
+
+from mspscammers.ratelimit import RateLimit, TokenBuckets, parse_limit
+
+
+def _request(ip, auth_token=None):
+    headers = [(b"authorization", auth_token.encode())] if auth_token else []
+    request = Request("POST", b"/api/v1/reporting/report-user", headers)
+    request.scope = {"client": (ip, 1234)}
+    return request
+
+
+def test_parse_limit():
+    assert parse_limit("5/60") == (5, 60.0)
+    assert parse_limit("3") == (3, 1.0)
+    for value in ("0/10", "-1/10", "5/0", "5/-1", "five/10", "5/x"):
+        with pytest.raises(ValueError):
+            parse_limit(value)
+
+
+def test_bucket_starts_full_and_refills():
+    buckets = TokenBuckets(2, 10)
+    assert buckets.take("a", now=0) == 0
+    assert buckets.take("a", now=0) == 0
+    assert buckets.take("a", now=0) == pytest.approx(5)
+    # A rejected request does not use up a token.
+    assert buckets.take("a", now=4) == pytest.approx(1)
+    assert buckets.take("a", now=5) == 0
+    assert buckets.take("b", now=5) == 0
+
+
+def test_idle_buckets_are_evicted():
+    buckets = TokenBuckets(1, 10, max_buckets=2)
+    buckets.take("a", now=0)
+    buckets.take("b", now=1)
+    buckets.take("c", now=10.5)
+    assert len(buckets) == 2
+    # "a" was forgotten, and comes back full.
+    assert buckets.take("a", now=10.5) == 0
+
+
+def test_rejected_request_charges_neither_bucket():
+    limit = RateLimit(1, 60)
+    assert limit.take(_request("10.0.0.1", "token")) == 0
+
+    # Same token from another IP: the token bucket is empty, so the new IP's
+    # bucket must stay full.
+    assert limit.take(_request("10.0.0.2", "token")) > 0
+    assert limit.take(_request("10.0.0.2")) == 0
+
+    # Same IP with another token: the IP bucket is empty, so the new token's
+    # bucket must stay full.
+    assert limit.take(_request("10.0.0.1", "other")) > 0
+    assert limit.take(_request("10.0.0.3", "other")) == 0
@@ -0,0 +1,93 @@
+import pytest
+
+from mspscammers import settings
+from mspscammers.reputation import SECONDS_PER_DAY, current_score, decay, report_weight
+
+HALF_LIFE = settings.REPUTATION_HALF_LIFE_DAYS * SECONDS_PER_DAY
+
+
+def test_decay_halves_every_half_life():
+    assert decay(0) == 1
+    assert decay(-60) == 1
+    assert decay(HALF_LIFE) == pytest.approx(0.5)
+    assert decay(3 * HALF_LIFE) == pytest.approx(0.125)
+    assert current_score(8.0, 1000.0, now=1000.0 + 2 * HALF_LIFE) == pytest.approx(2.0)
+
+
+def test_report_weight():
+    now = 1_700_000_000.0
+    # Unknown and old accounts count fully; brand new ones start low and ramp up.
+    assert report_weight(None, now, 0, 1) == 1
+    assert report_weight(now - 365 * SECONDS_PER_DAY, now, 0, 1) == 1
+    assert report_weight(now, now, 0, 1) == pytest.approx(settings.REPUTATION_NEW_ACCOUNT_WEIGHT)
+    halfway = now - settings.REPUTATION_NEW_ACCOUNT_DAYS / 2 * SECONDS_PER_DAY
+    assert report_weight(halfway, now, 0, 1) == pytest.approx((1 + settings.REPUTATION_NEW_ACCOUNT_WEIGHT) / 2)
+    # A registration after the report (clock skew) is treated as brand new.
+    assert report_weight(now + 60, now, 0, 1) == pytest.approx(settings.REPUTATION_NEW_ACCOUNT_WEIGHT)
+
+    scale = int(settings.REPUTATION_HISTORY_SCALE)
+    assert report_weight(None, now, scale, 1) == pytest.approx(0.5)
+    assert report_weight(None, now, 0, 3) == pytest.approx(1 / 3)
+    assert report_weight(None, now, 0, 0) == 1
+
+
+async def _score(database, scammer_id):
+    stats = await database.get_scammer_stats(scammer_id)
+    return current_score(stats["score"], stats["score_at"])
+
+
+async def _incremental_matches_recompute(database):
+    reports = [
+        ("81-a", "10.81.0.1", "scammed me out of a diamond outfit"),
+        ("81-b", "10.81.0.1", "took my starcoins and left"),  # the same address counts half
+        ("81-c", "10.81.0.2", "asked for my password"),
+    ]
+    for reporter, ip_address, description in reports:
+        assert await database.add_report("s", "81", description, reporter, ip_address)
+    # A second report by the same reporter, against someone else, weighs less.
+    assert await database.add_report("s", "82", "a report about something else", "81-a", "10.81.0.1")
+
+    incremental = await _score(database, "81")
+    assert incremental == pytest.approx(1 + 1 / 2 + 1, abs=1e-3)
+    assert await _score(database, "82") == pytest.approx(1 / (1 + 1 / settings.REPUTATION_HISTORY_SCALE), abs=1e-3)
+
+    await database.recompute_reputation()
+    assert await _score(database, "81") == pytest.approx(incremental, abs=1e-3)
+
+    # Ageing the reports by one half-life halves the score.
+    async with database.reports_pool.writer() as db:
+        await db.execute(
+            "UPDATE reports SET created_at = datetime(created_at, ?) WHERE scammer_id = '81'",
+            (f"-{settings.REPUTATION_HALF_LIFE_DAYS} days",),
+        )
+        await db.commit()
+    await database.recompute_reputation()
+    assert await _score(database, "81") == pytest.approx(incremental / 2, abs=1e-3)
+
+
+def test_incremental_score_matches_recompute(run, database):
+    run(_incremental_matches_recompute(database))
+
+
+async def _ban_and_unban(database):
+    assert await database.add_report("s", "83", "kept the items I lent", "83-a", "10.83.0.1")
+    assert await database.add_report("s", "83", "never gave my rares back", "83-b", "10.83.0.2")
+    before = await _score(database, "83")
+    assert before == pytest.approx(2, abs=1e-3)
+
+    await database.ban_user("83-a", "false reports")
+    try:
+        assert await _score(database, "83") == pytest.approx(1, abs=1e-3)
+        # A ban applied twice is only subtracted once.
+        await database.ban_user("83-a", "false reports")
+        assert await _score(database, "83") == pytest.approx(1, abs=1e-3)
+        # The recompute agrees with the incremental adjustment.
+        await database.recompute_reputation()
+        assert await _score(database, "83") == pytest.approx(1, abs=1e-3)
+    finally:
+        await database.unban_user("83-a")
+    assert await _score(database, "83") == pytest.approx(before, abs=1e-3)
+
+
+def test_banned_reporters_count_for_nothing(run, database):
+    run(_ban_and_unban(database))
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+
+from mspscammers import brigading, cache
+from mspscammers.cache import MISSING
+from mspscammers.cache.shared import SharedCacheServer, SharedCacheTier
+from mspscammers.feed import record_feed_event, report_feed
+
+
+async def _until(condition, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def test_hub_protocol():
+    async def test():
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "hub.sock")
+            hub = SharedCacheServer()
+            server = await asyncio.start_unix_server(hub.handle, path=path)
+            first_reader, first = await asyncio.open_unix_connection(path)
+            second_reader, second = await asyncio.open_unix_connection(path)
+
+            async def send(writer, reader=None, **message):
+                writer.write(json.dumps(message).encode() + b"\n")
+                await writer.drain()
+                if reader is not None:
+                    return json.loads(await reader.readline())
+
+            await send(first, op="set", cache="auth_tokens", key="token", value=["10.0.0.1", "42", None])
+            reply = await send(second, second_reader, op="get", id=1, cache="auth_tokens", key="token")
+            assert reply == {"op": "reply", "id": 1, "found": True, "value": ["10.0.0.1", "42", None]}
+
+            # Events are applied to the hub's stores, by owner too, and relayed
+            # to every other client but not back to the sender.
+            await send(first, op="event", event="invalidate_user", args=["42", None, None])
+            relayed = json.loads(await second_reader.readline())
+            assert relayed == {"op": "event", "event": "invalidate_user", "args": ["42", None, None]}
+            reply = await send(first, first_reader, op="get", id=2, cache="auth_tokens", key="token")
+            assert reply["found"] is False
+            assert hub.stores["auth_tokens"]._owned == {}
+
+            first.close()
+            second.close()
+            await hub.close()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(test())
+
+
+def _worker(number, path, barrier, results):
+    async def work():
+        tier = SharedCacheTier(path, timeout=1.0)
+        await tier.start()
+        subscriber = report_feed.subscribe()
+        loads = []
+
+        async def loader():
+            loads.append(number)
+            return ["10.0.0.1", "42", None]
+
+        def phase():
+            return asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+
+        await phase()
+        if number == 0:
+            await cache.auth_tokens.get_or_load("token", loader)
+        await phase()
+        value = await cache.auth_tokens.get_or_load("token", loader)
+        await phase()
+        if number == 1:
+            cache.invalidate_user("42")
+        record_feed_event("report", {"id": number, "scammer_id": "5"})
+        brigading.record_report("shared", number, f"10.{number}.0.1", brigading.signature("same text " * 10))
+        await asyncio.sleep(0.3)
+        await phase()
+        events = []
+        while not subscriber.queue.empty():
+            events.append(subscriber.queue.get_nowait().id)
+        results.put({
+            "number": number,
+            "hub": tier.is_hub,
+            "loads": len(loads),
+            "value": value,
+            "cached": cache.auth_tokens.peek("token") is not MISSING,
+            "events": sorted(events),
+            "indexed": len(brigading.brigading_index._scammers["shared"].entries),
+        })
+        await phase()
+        await tier.close()
+
+    asyncio.run(work())
+
+
+def test_workers_share_entries_and_events():
+    context = multiprocessing.get_context("fork")
+    workers = 3
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "hub.sock")
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        processes = [context.Process(target=_worker, args=(number, path, barrier, results)) for number in range(workers)]
+        for process in processes:
+            process.start()
+        reports = sorted((results.get(timeout=20) for _ in processes), key=lambda result: result["number"])
+        for process in processes:
+            process.join(timeout=20)
+            assert process.exitcode == 0
+
+    assert sum(result["hub"] for result in reports) == 1
+    # Only the first worker went to the database; the others were served by the hub.
+    assert [result["loads"] for result in reports] == [1, 0, 0]
+    assert all(result["value"] == ["10.0.0.1", "42", None] for result in reports)
+    # The invalidation reached every worker.
+    assert not any(result["cached"] for result in reports)
+    # Every worker saw every event once, the hub's own worker included.
+    assert all(result["events"] == list(range(workers)) for result in reports)
+    assert all(result["indexed"] == workers for result in reports)
+
+
+def test_remaining_worker_takes_over_the_hub():
+    async def test():
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "hub.sock")
+            first = SharedCacheTier(path)
+            await first.start()
+            second = SharedCacheTier(path)
+            await second.start()
+            assert first.is_hub and not second.is_hub
+            cache.usernames.set("alice", True)
+
+            await first.close()
+            await _until(lambda: second.is_hub and second.connected)
+            # Invalidations may have been missed while there was no hub.
+            assert cache.usernames.peek("alice") is MISSING
+
+            second.set("usernames", "bob", True)
+            await _until(lambda: "usernames" in second._hub.stores)
+            assert await second.get("usernames", "bob") is True
+            await second.close()
+
+    asyncio.run(test())
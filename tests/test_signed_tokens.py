@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from mspscammers.token_manager.signed import SignedTokens, parse_keys
+
+KEYS = {'v2': b'new secret', 'v1': b'old secret'}
+
+
+def test_parse_keys():
+    assert parse_keys('v2:new secret, v1:old secret') == KEYS
+    for value in ('v1', ':secret', 'v1:', 'v.1:secret'):
+        with pytest.raises(ValueError):
+            parse_keys(value)
+
+
+def test_token_is_bound_to_its_ip():
+    tokens = SignedTokens(KEYS)
+    token = tokens.issue('1234', '10.0.0.1')
+    assert tokens.is_signed(token)
+    assert token.startswith('v2.1234.')
+    assert tokens.verify(token, '10.0.0.1') == '1234'
+    assert tokens.verify(token, '10.0.0.2') is None
+
+
+def test_tampered_tokens_are_rejected():
+    tokens = SignedTokens(KEYS)
+    token = tokens.issue('1234', '10.0.0.1')
+    version, user_id, issued_at, signature = token.split('.')
+    tampered = signature[:-1] + ('B' if signature.endswith('A') else 'A')
+    for forged in (
+        f'{version}.4321.{issued_at}.{signature}',
+        f'{version}.{user_id}.{issued_at}.{tampered}',
+        f'v3.{user_id}.{issued_at}.{signature}',
+        f'{version}.{user_id}.{signature}',
+        'not a token',
+        '....',
+    ):
+        assert tokens.verify(forged, '10.0.0.1') is None
+
+
+def test_user_ids_containing_dots():
+    tokens = SignedTokens(KEYS)
+    token = tokens.issue('some.user.id', '10.0.0.1', issued_at=1_700_000_000_000)
+    assert tokens.verify(token, '10.0.0.1') == 'some.user.id'
+    assert tokens.issued_at(token) == 1_700_000_000
+    assert tokens.verify(tokens.issue('.', '10.0.0.1'), '10.0.0.1') == '.'
+
+
+def test_key_rotation():
+    old = SignedTokens({'v1': b'old secret'})
+    token = old.issue('1234', '10.0.0.1')
+    # After rotating, tokens signed with a key that is still listed verify...
+    assert SignedTokens(KEYS).verify(token, '10.0.0.1') == '1234'
+    # ...and new tokens use the new key.
+    assert SignedTokens(KEYS).issue('1234', '10.0.0.1').startswith('v2.')
+    # Once the old key is dropped, its tokens stop working.
+    assert SignedTokens({'v2': b'new secret'}).verify(token, '10.0.0.1') is None
+    # A reused version with a different secret does not accept them either.
+    assert SignedTokens({'v1': b'other secret'}).verify(token, '10.0.0.1') is None
+
+
+def test_revocation_rejects_older_tokens_only():
+    tokens = SignedTokens(KEYS)
+    old = tokens.issue('1234', '10.0.0.1', issued_at=1000)
+    new = tokens.issue('1234', '10.0.0.1', issued_at=3000)
+    other = tokens.issue('5678', '10.0.0.1', issued_at=1000)
+    tokens.revoke('1234', 2000)
+    # An older revocation arriving late does not undo a newer one.
+    tokens.revoke('1234', 1500)
+    assert tokens.verify(old, '10.0.0.1') is None
+    assert tokens.verify(new, '10.0.0.1') == '1234'
+    assert tokens.verify(other, '10.0.0.1') == '5678'
+    assert len(tokens) == 1
+
+    tokens.load_revocations([])
+    assert tokens.verify(old, '10.0.0.1') == '1234'
+
+
+def test_max_age():
+    tokens = SignedTokens(KEYS, max_age=60)
+    now = int(time.time() * 1000)
+    assert tokens.verify(tokens.issue('1234', '10.0.0.1', issued_at=now), '10.0.0.1') == '1234'
+    assert tokens.verify(tokens.issue('1234', '10.0.0.1', issued_at=now - 61_000), '10.0.0.1') is None
+
+
+def test_issuing_needs_a_key():
+    tokens = SignedTokens({})
+    assert not tokens.enabled
+    with pytest.raises(RuntimeError):
+        tokens.issue('1234', '10.0.0.1')